@@ -0,0 +1,285 @@
+"""Benchmark suite of the auto spray matching hot path.
+
+Generates synthetic prescription maps and GPS traces, times every matching path of ``robo_spray.auto_spray`` and
+reports per-query latency percentiles and memory. Results can be saved as JSON and compared against a previous run,
+so regressions in the spray decision path are caught before field deployment.
+
+Usage:
+    python benchmarks/bench_auto_spray.py --sizes 1000 100000 1000000 --output results.json
+    python benchmarks/bench_auto_spray.py --baseline results.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from robo_spray.auto_spray import build_kd_tree
+from robo_spray.auto_spray import calculate_utm_distance
+from robo_spray.auto_spray import calculate_utm_distances
+from robo_spray.auto_spray import get_spray_index
+from robo_spray.auto_spray import LocalFrame
+from robo_spray.auto_spray import match_gps_position
+from robo_spray.auto_spray import match_gps_positions
+from robo_spray.auto_spray import SprayIndex
+from robo_spray.prescription import open_prescription
+from robo_spray.prescription import write_prescription
+from robo_spray.tiles import build_tiles
+from robo_spray.tiles import TiledSprayIndex
+
+# Origin of the synthetic fields (UC Davis test plot)
+ORIGIN_LON = -121.7520
+ORIGIN_LAT = 38.5323
+# Targets per square meter
+TARGET_DENSITY = 0.5
+ROW_SPACING = 0.75
+SPRAY_RADIUS = 3.0
+
+
+def make_targets(n_targets: int, seed: int = 0):
+    """Returns (frame, east, north) of ``n_targets`` random targets on a square field around the origin."""
+    rng = np.random.default_rng(seed)
+    half_size = np.sqrt(n_targets / TARGET_DENSITY) / 2.0
+    frame = LocalFrame(ORIGIN_LAT, ORIGIN_LON)
+    return frame, rng.uniform(-half_size, half_size, n_targets), rng.uniform(-half_size, half_size, n_targets)
+
+
+def make_prescription_map(n_targets: int, seed: int = 0) -> dict:
+    """Creates a GeoJSON FeatureCollection with ``n_targets`` random plant targets around the origin."""
+    frame, east, north = make_targets(n_targets, seed)
+    lat, lon = frame.to_latlon(east, north)
+    conditions = np.array(["low", "med", "high"])[np.random.default_rng(seed).integers(0, 3, n_targets)]
+    features = [
+        {
+            "type": "Feature",
+            "properties": {"altitude": 0.0, "name": f"target_{i:07d}", "condition": str(conditions[i])},
+            "geometry": {"type": "Point", "coordinates": [float(lon[i]), float(lat[i])]},
+        }
+        for i in range(n_targets)
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def make_spray_index(n_targets: int, seed: int = 0) -> SprayIndex:
+    """Builds the SprayIndex of the synthetic map directly from arrays, without GeoJSON dicts."""
+    frame, east, north = make_targets(n_targets, seed)
+    lat, lon = frame.to_latlon(east, north)
+    names = [f"target_{i:07d}" for i in range(n_targets)]
+    condition_codes = np.random.default_rng(seed).integers(0, 3, n_targets).astype(np.uint16)
+    return SprayIndex(np.column_stack((lon, lat)), names, condition_codes, ["high", "low", "med"], frame=frame)
+
+
+def make_gps_trace(spray_index: SprayIndex, n_fixes: int, kind: str, seed: int = 1) -> np.ndarray:
+    """Returns ``n_fixes`` (lat, lon) positions inside the field.
+
+    ``random`` positions are uniform over the field, ``rows`` follows a serpentine path along the crop rows at
+    1 m/s sampled at 10 Hz.
+    """
+    low, high = spray_index.xy.min(axis=0), spray_index.xy.max(axis=0)
+    if kind == "random":
+        east, north = np.random.default_rng(seed).uniform(low, high, (n_fixes, 2)).T
+    else:
+        step = 0.1
+        row_length = high[1] - low[1]
+        distance = np.arange(n_fixes) * step
+        row, along = np.divmod(distance, row_length)
+        east = low[0] + row * ROW_SPACING
+        north = np.where(row % 2 == 0, low[1] + along, high[1] - along)
+    lat, lon = spray_index.frame.to_latlon(east, north)
+    return np.column_stack((lat, lon))
+
+
+def percentiles(samples) -> dict:
+    """Latency statistics in microseconds."""
+    samples = np.asarray(samples) * 1e6
+    return {
+        "p50_us": float(np.percentile(samples, 50)),
+        "p90_us": float(np.percentile(samples, 90)),
+        "p99_us": float(np.percentile(samples, 99)),
+        "max_us": float(samples.max()),
+    }
+
+
+def time_queries(func, trace) -> dict:
+    """Times ``func(lat, lon)`` for every position of the trace."""
+    samples = np.empty(len(trace))
+    for i, (lat, lon) in enumerate(trace):
+        start = time.perf_counter()
+        func(lat, lon)
+        samples[i] = time.perf_counter() - start
+    return percentiles(samples)
+
+
+def time_batch(func, trace, repeat: int = 5) -> dict:
+    """Times ``func(lats, lons)`` over the whole trace and reports the amortized cost per position."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(trace[:, 0], trace[:, 1])
+        samples.append((time.perf_counter() - start) / len(trace))
+    return percentiles(samples)
+
+
+def measure_memory(func):
+    """Returns (result, peak traced allocation in MB) of ``func()``."""
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / 2**20
+
+
+def bench_size(n_targets: int, n_fixes: int, geojson_limit: int, legacy_limit: int) -> dict:
+    results = {}
+
+    spray_index, build_mb = measure_memory(lambda: make_spray_index(n_targets))
+    start = time.perf_counter()
+    make_spray_index(n_targets)
+    results["spray_index_build"] = {"total_ms": (time.perf_counter() - start) * 1e3, "peak_mb": build_mb}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rsp_file = os.path.join(tmp_dir, "map.rsp")
+        write_prescription(spray_index, rsp_file)
+        start = time.perf_counter()
+        compiled, load_mb = measure_memory(lambda: open_prescription(rsp_file))
+        results["prescription_load"] = {"total_ms": (time.perf_counter() - start) * 1e3, "peak_mb": load_mb}
+
+        tile_dir = os.path.join(tmp_dir, "tiles")
+        build_tiles(spray_index, tile_dir)
+        tiled = TiledSprayIndex(tile_dir)
+
+        for kind in ("random", "rows"):
+            trace = make_gps_trace(spray_index, n_fixes, kind)
+            results[f"nearest/{kind}"] = time_queries(
+                lambda lat, lon: spray_index.nearest(lat, lon, radius=SPRAY_RADIUS), trace
+            )
+            results[f"nearest_mmap/{kind}"] = time_queries(
+                lambda lat, lon: compiled.nearest(lat, lon, radius=SPRAY_RADIUS), trace
+            )
+            results[f"nearest_tiled/{kind}"] = time_queries(
+                lambda lat, lon: tiled.nearest(lat, lon, radius=SPRAY_RADIUS), trace
+            )
+            results[f"predict/{kind}"] = time_queries(
+                lambda lat, lon: spray_index.predict(
+                    lat, lon, heading=0.0, speed=1.0, latency=0.4, radius=SPRAY_RADIUS
+                ),
+                trace,
+            )
+            results[f"match_gps_positions/{kind}"] = time_batch(
+                lambda lats, lons: match_gps_positions(lats, lons, spray_index, radius=SPRAY_RADIUS), trace
+            )
+
+    trace = make_gps_trace(spray_index, n_fixes, "rows")
+    targets = spray_index.points[np.arange(n_fixes) % n_targets]
+    results["calculate_utm_distance"] = time_queries(
+        lambda lat, lon: calculate_utm_distance(lat, lon, targets[0, 1], targets[0, 0]), trace
+    )
+    results["calculate_utm_distances"] = time_batch(
+        lambda lats, lons: calculate_utm_distances(lats, lons, targets[:, 1], targets[:, 0]), trace
+    )
+
+    if n_targets <= geojson_limit:
+        geojson_data = make_prescription_map(n_targets)
+        kdtree, legacy_mb = measure_memory(lambda: build_kd_tree(geojson_data))
+        start = time.perf_counter()
+        build_kd_tree(geojson_data)
+        results["build_kd_tree"] = {"total_ms": (time.perf_counter() - start) * 1e3, "peak_mb": legacy_mb}
+        results["match_gps_position"] = time_queries(
+            lambda lat, lon: match_gps_position((lon, lat), kdtree, geojson_data), trace
+        )
+        results["get_spray_index_cached"] = time_queries(
+            lambda lat, lon: get_spray_index(geojson_data).nearest(lat, lon, radius=SPRAY_RADIUS), trace
+        )
+        if n_targets <= legacy_limit:
+            # The original per tick path: rebuild the tree, match in degrees, then solve the geodesic
+            def legacy_tick(lat, lon):
+                feature = match_gps_position((lon, lat), build_kd_tree(geojson_data), geojson_data)
+                target_lon, target_lat = feature["geometry"]["coordinates"]
+                calculate_utm_distance(lat, lon, target_lat, target_lon)
+
+            results["legacy_tick"] = time_queries(legacy_tick, trace[: max(1, n_fixes // 100)])
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, metrics) -> list:
+    """Returns the (size, benchmark, metric, baseline, current) entries slower than the baseline by ``tolerance``."""
+    regressions = []
+    for size, benchmarks in results["sizes"].items():
+        for name, values in benchmarks.items():
+            for metric in metrics:
+                value = values.get(metric)
+                reference = baseline.get("sizes", {}).get(size, {}).get(name, {}).get(metric)
+                if value is not None and reference is not None and value > reference * (1.0 + tolerance):
+                    regressions.append((size, name, metric, reference, value))
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    for size, benchmarks in results["sizes"].items():
+        print(f"\n{size} targets")
+        for name, metrics in benchmarks.items():
+            values = "  ".join(f"{metric}={value:.1f}" for metric, value in metrics.items())
+            print(f"  {name:<32} {values}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="bench-auto-spray")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--fixes", type=int, default=2000, help="Number of GPS fixes per trace.")
+    parser.add_argument(
+        "--geojson-limit",
+        type=int,
+        default=100_000,
+        help="Largest map size for which the GeoJSON based functions are measured.",
+    )
+    parser.add_argument(
+        "--legacy-limit",
+        type=int,
+        default=100_000,
+        help="Largest map size for which the original rebuild-per-tick path is measured.",
+    )
+    parser.add_argument("--output", type=str, default=None, help="Save the results as JSON.")
+    parser.add_argument("--baseline", type=str, default=None, help="JSON results of a previous run to compare to.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown relative to the baseline.")
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        nargs="+",
+        default=["p50_us", "p90_us", "total_ms"],
+        help="Metrics compared to the baseline. Tail latencies are noisy on a desktop.",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "fixes": args.fixes,
+        "sizes": {
+            str(n_targets): bench_size(n_targets, args.fixes, args.geojson_limit, args.legacy_limit)
+            for n_targets in args.sizes
+        },
+    }
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance, args.metrics)
+        for size, name, metric, reference, value in regressions:
+            print(f"REGRESSION {size} targets {name} {metric}: {reference:.1f} -> {value:.1f}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,56 @@ from farm_ng.utils.general import TickRepeater
 from farm_ng.utils.main_loop import MainLoop
 from struct import pack,unpack
 
+from canio import Message
+
 from digitalio import DigitalInOut, Direction, Pull
+from supervisor import ticks_ms
 import board
+import pwmio
 import time
 
 switch = DigitalInOut(board.D11)
 switch.direction = Direction.OUTPUT
 
+# Spray command v2: boom sections driven by PWM, section i on SECTION_PINS[i].
+# The protocol carries SPRAY2_SECTIONS sections but only 6 are wired to this board, the bits of the
+# other sections are ignored and reported with STATUS_UNSUPPORTED_SECTIONS in the status frame
+SPRAY2_ID = 0x778
+SPRAY2_SECTIONS = 16
+SECTION_PINS = (board.D5, board.D6, board.D9, board.D10, board.D12, board.D13)
+assert len(SECTION_PINS) <= SPRAY2_SECTIONS
+SUPPORTED_SECTIONS = (1 << len(SECTION_PINS)) - 1
+SECTION_PWM_FREQUENCY = 15
+sections = [pwmio.PWMOut(pin, frequency=SECTION_PWM_FREQUENCY, duty_cycle=0) for pin in SECTION_PINS]
+
+# Spray pulses timed here: [uint8 seq, uint8 level, uint16 start offset ms, uint16 duration ms, uint16 mask]
+SPRAY_PULSE_ID = 0x779
+SPRAY_PULSE_FORMAT = "<BBHHH"
+
+# Status of the outputs, sent on change and every STATUS_PERIOD_MS:
+# [uint8 flags, uint8 last pulse seq, uint16 open sections, uint32 ticks_ms]
+SPRAY_STATUS_ID = 0x77A
+SPRAY_STATUS_FORMAT = "<BBHI"
+STATUS_PERIOD_MS = 1000
+STATUS_SWITCH_OPEN = 0x01
+STATUS_ACTIVATED = 0x02
+STATUS_PULSES_PENDING = 0x04
+STATUS_UNSUPPORTED_SECTIONS = 0x08
+
+# supervisor.ticks_ms wraps around every 2**29 ms
+_TICKS_PERIOD = 1 << 29
+_TICKS_HALFPERIOD = 1 << 28
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % _TICKS_PERIOD
+
+
+def ticks_diff(end, start):
+    """Signed time in ms from start to end, valid across a wrap around."""
+    return ((end - start + _TICKS_HALFPERIOD) % _TICKS_PERIOD) - _TICKS_HALFPERIOD
+
+
 class CansnifferApp:
     def __init__(self, main_loop: MainLoop, can, node_id) -> None:
         self.can = can
@@ -21,25 +64,97 @@ class CansnifferApp:
 
         self.format = "<Bhx" # little-endian [unsigned char, short]
 
+        # Switch state commanded by spray v1, pulses open the switch on top of it
+        self.activated = False
+        # Pending and running pulses, [start tick, end tick, level, mask]
+        self.pulses = []
+        self.pulse_mask = 0
+        self.last_pulse_seq = None
+        # Sections of the last spray v2 or pulse command without an output
+        self.unsupported_mask = 0
+
+        # Status reported to the host, resent on change and at STATUS_PERIOD_MS
+        self.status_repeater = TickRepeater(ticks_period_ms=STATUS_PERIOD_MS)
+        self.last_status = None
+
         self._register_message_handlers()
 
     def _register_message_handlers(self):
         can_id = 0x777
         self.main_loop.command_handlers[can_id] = self._handle_amiga_spary1
+        self.main_loop.command_handlers[SPRAY2_ID] = self._handle_amiga_spray2
+        self.main_loop.command_handlers[SPRAY_PULSE_ID] = self._handle_amiga_spray_pulse
 
     def _handle_amiga_spary1(self, message):
         #print(message.data)
         decoded_msg = self.decode(message.data)
         print(decoded_msg)
-        if int(decoded_msg) > 0:
-
-            # turn switch on
-            switch.value = True
-
+        # turn switch on or off, unless a pulse holds it open
+        self.activated = int(decoded_msg) > 0
+        switch.value = self.activated or bool(self.pulse_mask & 1)
+
+    def _check_sections(self, mask):
+        self.unsupported_mask = mask & ~SUPPORTED_SECTIONS
+        if self.unsupported_mask:
+            print("Unsupported sections", hex(self.unsupported_mask))
+
+    def _handle_amiga_spray2(self, message):
+        mask, levels = self.decode_spray2(message.data)
+        self._check_sections(mask)
+        for section, pwm in enumerate(sections):
+            if mask >> section & 1:
+                # Duty (level + 1) / 8 of the 16-bit PWM range, level 7 fully open
+                pwm.duty_cycle = ((levels >> (3 * section) & 0x7) + 1) * 0xFFFF // 8
+            else:
+                pwm.duty_cycle = 0
+
+    def _handle_amiga_spray_pulse(self, message):
+        seq, level, start_offset_ms, duration_ms, mask = unpack(SPRAY_PULSE_FORMAT, message.data)
+        if seq == self.last_pulse_seq:
+            # Repeated frame
+            return
+        self.last_pulse_seq = seq
+        self._check_sections(mask)
+        if duration_ms == 0:
+            self.pulses = []
         else:
-
-            # turn switch off
-            switch.value = False
+            start = ticks_add(ticks_ms(), start_offset_ms)
+            self.pulses.append([start, ticks_add(start, duration_ms), level, mask])
+        self._update_pulses()
+
+    def _update_pulses(self):
+        """Opens the outputs of the running pulses and closes those of the ended ones."""
+        now = ticks_ms()
+        pulse_mask = 0
+        levels = [0] * len(sections)
+        running = []
+        for pulse in self.pulses:
+            start, end, level, mask = pulse
+            if ticks_diff(now, end) >= 0:
+                continue
+            running.append(pulse)
+            if ticks_diff(now, start) >= 0:
+                pulse_mask |= mask
+                for section in range(len(sections)):
+                    if mask >> section & 1:
+                        levels[section] = max(levels[section], level)
+        self.pulses = running
+
+        if pulse_mask == self.pulse_mask:
+            return
+        # Only the outputs of pulses are touched, the last command wins
+        for section, pwm in enumerate(sections):
+            if pulse_mask >> section & 1:
+                pwm.duty_cycle = (levels[section] + 1) * 0xFFFF // 8
+            elif self.pulse_mask >> section & 1:
+                pwm.duty_cycle = 0
+        switch.value = self.activated or bool(pulse_mask & 1)
+        self.pulse_mask = pulse_mask
+
+    def decode_spray2(self, data):
+        """Returns the section mask and the packed 3-bit section levels of a spray v2 command."""
+        (mask,) = unpack("<H", data[:2])
+        return mask, int.from_bytes(data[2:8], "little")
 
     def decode(self, data):
         """Decodes CAN message data and populates the values of the class."""
@@ -48,7 +163,33 @@ class CansnifferApp:
         self.activate = activate
         return self.activate
 
+    def _status(self):
+        flags = 0
+        if switch.value:
+            flags |= STATUS_SWITCH_OPEN
+        if self.activated:
+            flags |= STATUS_ACTIVATED
+        if self.pulses:
+            flags |= STATUS_PULSES_PENDING
+        if self.unsupported_mask:
+            flags |= STATUS_UNSUPPORTED_SECTIONS
+        open_mask = 0
+        for section, pwm in enumerate(sections):
+            if pwm.duty_cycle:
+                open_mask |= 1 << section
+        return (flags, self.last_pulse_seq or 0, open_mask)
+
+    def _send_status(self):
+        status = self._status()
+        if status != self.last_status or self.status_repeater.check():
+            self.last_status = status
+            self.can.send(Message(id=SPRAY_STATUS_ID, data=pack(SPRAY_STATUS_FORMAT, *status, ticks_ms())))
+
     def iter(self):
+        if self.pulses or self.pulse_mask:
+            self._update_pulses()
+        self._send_status()
+
         if self.debug_repeater.check():
             print("\033[2J", end="")
             print(self.main_loop.io_debug_str())
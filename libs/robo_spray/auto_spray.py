@@ -1,10 +1,15 @@
+import hashlib
 import json
+import os
+from collections import OrderedDict
+
+import numpy as np
 from scipy.spatial import KDTree
 from shapely.geometry import Point
 from geopy.distance import geodesic
 
 def load_geojson(geojson_file):
-    with open('src/assets/spray_position_all.json') as file:
+    with open(geojson_file) as file:
         data = json.load(file)
     return data
 
@@ -22,6 +27,355 @@ def calculate_utm_distance(lat1, lon1, lat2, lon2):
     distance = geodesic((lat1, lon1), (lat2, lon2)).meters
     return distance
 
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+
+def calculate_utm_distances(lat1, lon1, lat2, lon2, iterations: int = 20):
+    """Vectorized counterpart of calculate_utm_distance for arrays of N positions.
+
+    Solves the inverse geodesic problem on the WGS84 ellipsoid with Vincenty's formula for all pairs at once,
+    agreeing with geopy's geodesic to well below a millimeter for non antipodal points.
+
+    Args:
+        lat1: Latitudes of the first positions, in degrees.
+        lon1: Longitudes of the first positions, in degrees.
+        lat2: Latitudes of the second positions, in degrees.
+        lon2: Longitudes of the second positions, in degrees.
+        iterations: Fixed number of iterations of the longitude difference on the auxiliary sphere.
+
+    Returns:
+        The distances in meters, broadcast to the shape of the inputs.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    )
+    # Reduced latitudes
+    u1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    delta_lon = lon2 - lon1
+    lam = delta_lon
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha**2
+            # Equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam = delta_lon + (1 - c) * WGS84_F * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m**2))
+            )
+
+    u_sq = cos2_alpha * (WGS84_A**2 - WGS84_B**2) / WGS84_B**2
+    a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = b * sin_sigma * (
+        cos_2sigma_m
+        + b / 4 * (cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+                   - b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2))
+    )
+    return WGS84_B * a * (sigma - delta_sigma)
+
+
+class LocalFrame:
+    """Field-local ENU (east, north) tangent plane in meters around an origin.
+
+    Uses the WGS84 radii of curvature at the origin. Across a field of about a kilometer the relative distance error
+    stays below 1e-4 (sub-millimeter at the spray radius) while costing only a couple of multiplications per point.
+    """
+
+    def __init__(self, origin_lat: float, origin_lon: float) -> None:
+        self.origin_lat = origin_lat
+        self.origin_lon = origin_lon
+
+        sin_lat = np.sin(np.radians(origin_lat))
+        w2 = 1.0 - WGS84_E2 * sin_lat**2
+        # Meters per radian along the meridian and along the parallel
+        meridian_radius = WGS84_A * (1.0 - WGS84_E2) / w2**1.5
+        normal_radius = WGS84_A / np.sqrt(w2)
+        self.m_per_deg_lat = float(np.radians(meridian_radius))
+        self.m_per_deg_lon = float(np.radians(normal_radius * np.cos(np.radians(origin_lat))))
+
+    def to_enu(self, lat, lon):
+        """Converts lat/lon (scalars or arrays) to (east, north) meters."""
+        east = (np.asarray(lon, dtype=np.float64) - self.origin_lon) * self.m_per_deg_lon
+        north = (np.asarray(lat, dtype=np.float64) - self.origin_lat) * self.m_per_deg_lat
+        return east, north
+
+    def to_latlon(self, east, north):
+        """Converts (east, north) meters (scalars or arrays) back to lat/lon."""
+        lat = self.origin_lat + np.asarray(north, dtype=np.float64) / self.m_per_deg_lat
+        lon = self.origin_lon + np.asarray(east, dtype=np.float64) / self.m_per_deg_lon
+        return lat, lon
+
+
+class TargetIndex:
+    """Queries shared by the prescription indexes.
+
+    Subclasses provide ``frame``, ``nearest``, ``within``, ``name``, ``condition``, ``feature`` and ``fingerprint``.
+    """
+
+    def predict(self, lat: float, lon: float, heading: float, speed: float, latency: float, radius: float,
+                horizon: float = 2.0, min_speed: float = 0.05, skip=None):
+        """Finds the next target on the path of the vehicle and when the spray must be commanded to hit it.
+
+        The vehicle is assumed to drive straight along ``heading`` at ``speed``. A target is on the path when its
+        cross-track distance is below ``radius``, and the spray command is scheduled ``latency`` seconds before the
+        vehicle reaches it.
+
+        Args:
+            lat: Latitude of the GPS fix.
+            lon: Longitude of the GPS fix.
+            heading: Heading of motion in degrees, clockwise from north (``headMot`` of the fix).
+            speed: Measured speed in m/s, negative when driving backwards (``meas_speed`` of AmigaTpdo1).
+            latency: Total system latency in seconds, from the GPS fix to the nozzle opening.
+            radius: Spray radius in meters.
+            horizon: Targets reached later than this many seconds from now are ignored.
+            min_speed: Below this speed in m/s the prediction falls back to the nearest target within ``radius``.
+            skip: Predicate of the target indices to ignore, e.g. ``SprayedRegistry.__contains__``, so the next
+                target is scheduled while an already sprayed one is still ahead.
+
+        Returns:
+            (index, delay) of the next target and the delay in seconds from now to send the spray command,
+            or (None, None) if no target is reached within ``horizon``.
+        """
+        if abs(speed) < min_speed and skip is None:
+            index, _ = self.nearest(lat, lon, radius=radius)
+            return (index, 0.0) if index is not None else (None, None)
+
+        position = np.array(self.frame.to_enu(lat, lon))
+        if abs(speed) < min_speed:
+            candidates, xy = self._unskipped(*self.within(position, radius), skip)
+            if len(candidates) == 0:
+                return None, None
+            closest = np.argmin(np.hypot(*(xy - position).T))
+            return int(candidates[closest]), 0.0
+
+        heading_rad = np.radians(heading)
+        direction = np.array((np.sin(heading_rad), np.cos(heading_rad))) * np.sign(speed)
+        speed = abs(speed)
+
+        # Every target reachable before the horizon is within this distance of the fix
+        reach = speed * (latency + horizon) + radius
+        candidates, xy = self._unskipped(*self.within(position, reach), skip)
+        if len(candidates) == 0:
+            return None, None
+
+        offsets = xy - position
+        along = offsets @ direction
+        cross = np.abs(offsets[:, 0] * direction[1] - offsets[:, 1] * direction[0])
+        ahead = (along >= 0) & (cross <= radius)
+        if not ahead.any():
+            return None, None
+
+        closest = np.argmin(np.where(ahead, along, np.inf))
+        delay = along[closest] / speed - latency
+        if delay > horizon:
+            return None, None
+        return int(candidates[closest]), max(0.0, float(delay))
+
+    @staticmethod
+    def _unskipped(candidates, xy, skip):
+        """Filters the (candidates, xy) of ``within`` with the ``skip`` predicate of ``predict``."""
+        if skip is None or len(candidates) == 0:
+            return candidates, xy
+        keep = np.fromiter((not skip(int(index)) for index in candidates), dtype=bool, count=len(candidates))
+        return candidates[keep], xy[keep]
+
+    def match(self, gps_position) -> dict:
+        """Returns the feature closest to ``gps_position`` given as (lon, lat).
+
+        Indexes searching a bounded area, like TiledSprayIndex, return None if no target is within it.
+        """
+        index, _ = self.nearest(gps_position[1], gps_position[0])
+        return self.feature(index) if index is not None else None
+
+
+class SprayIndex(TargetIndex):
+    """Prescription index of a loaded spray map.
+
+    The map is projected once into a field-local metric frame and the KD-tree is built once when the map is loaded,
+    so the per-tick cost of the auto spray loop is a single O(log n) query in meters, independent of the field size.
+    """
+
+    def __init__(self, points, names, condition_codes, condition_table, frame: LocalFrame = None,
+                 kdtree: KDTree = None, geojson_data: dict = None) -> None:
+        """
+        Args:
+            points: (N, 2) array of target (lon, lat).
+            names: Sequence of the N target names.
+            condition_codes: (N,) integer array indexing ``condition_table`` for each target.
+            condition_table: Interned condition strings, e.g. ["high", "low", "med"].
+            frame: Metric frame of the map, centered on the targets if not given.
+            kdtree: Prebuilt KD-tree over the targets in ``frame`` meters, built if not given.
+            geojson_data: The GeoJSON map the index was built from, if any.
+        """
+        self.points = points
+        self.names = names
+        self.condition_codes = condition_codes
+        self.condition_table = condition_table
+        self.geojson_data = geojson_data
+        self.features = geojson_data['features'] if geojson_data is not None else None
+
+        if frame is None:
+            origin_lon, origin_lat = np.mean(points, axis=0)
+            frame = LocalFrame(float(origin_lat), float(origin_lon))
+        self.frame = frame
+        if kdtree is None:
+            kdtree = KDTree(np.column_stack(self.frame.to_enu(points[:, 1], points[:, 0])))
+        self.kdtree = kdtree
+        # Targets in meters, shared with the KD-tree
+        self.xy = kdtree.data
+
+    @classmethod
+    def from_geojson(cls, geojson_data: dict) -> "SprayIndex":
+        """Builds the index of a loaded GeoJSON FeatureCollection of point targets."""
+        features = geojson_data['features']
+        points = np.array([feature['geometry']['coordinates'][:2] for feature in features], dtype=np.float64)
+        names = [feature['properties'].get('name', "") for feature in features]
+        condition_table = sorted({feature['properties'].get('condition', "") for feature in features})
+        lookup = {condition: code for code, condition in enumerate(condition_table)}
+        condition_codes = np.array(
+            [lookup[feature['properties'].get('condition', "")] for feature in features], dtype=np.uint8
+        )
+        return cls(points, names, condition_codes, condition_table, geojson_data=geojson_data)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def fingerprint(self) -> int:
+        """Returns a 64-bit hash of the target positions, identifying the map e.g. in the sprayed journal."""
+        return points_fingerprint([self.points])
+
+    def name(self, index: int) -> str:
+        return self.names[index]
+
+    def condition(self, index: int) -> str:
+        return self.condition_table[self.condition_codes[index]]
+
+    def feature(self, index: int) -> dict:
+        """Returns the GeoJSON feature of the target ``index``, rebuilt from the arrays if the map is not loaded."""
+        if self.features is not None:
+            return self.features[index]
+        return {
+            'type': 'Feature',
+            'properties': {'name': self.name(index), 'condition': self.condition(index)},
+            'geometry': {'type': 'Point', 'coordinates': [float(v) for v in self.points[index]]},
+        }
+
+    def to_geojson(self) -> dict:
+        """Returns the map as a GeoJSON FeatureCollection, e.g. for drawing markers."""
+        if self.geojson_data is not None:
+            return self.geojson_data
+        return {'type': 'FeatureCollection', 'features': [self.feature(i) for i in range(len(self))]}
+
+    def nearest(self, lat: float, lon: float, radius: float = np.inf):
+        """Finds the closest target to a GPS position.
+
+        Args:
+            lat: Latitude of the GPS position.
+            lon: Longitude of the GPS position.
+            radius: Only targets closer than this distance in meters are considered.
+
+        Returns:
+            (index, distance) of the closest target in meters, or (None, inf) if no target is within ``radius``.
+        """
+        dist, index = self.kdtree.query(self.frame.to_enu(lat, lon), k=1, distance_upper_bound=radius)
+        if index == len(self):
+            return None, np.inf
+        return int(index), float(dist)
+
+    def within(self, position, radius: float):
+        """Returns (indices, xy) of the targets closer than ``radius`` meters to ``position`` (east, north)."""
+        indices = np.asarray(self.kdtree.query_ball_point(position, radius), dtype=np.intp)
+        return indices, self.xy[indices]
+
+
+def points_fingerprint(chunks) -> int:
+    """64-bit hash of an iterable of (N, 2) arrays of target (lon, lat), hashed like their concatenation."""
+    hasher = hashlib.blake2b(digest_size=8)
+    for points in chunks:
+        hasher.update(np.ascontiguousarray(points, dtype="<f8").tobytes())
+    return int.from_bytes(hasher.digest(), "little")
+
+
+def match_gps_positions(lats, lons, spray_index: SprayIndex, radius: float = np.inf):
+    """Vectorized counterpart of match_gps_position for arrays of N positions.
+
+    Args:
+        lats: Latitudes of the GPS positions.
+        lons: Longitudes of the GPS positions.
+        spray_index: The prescription index to match against.
+        radius: Spray radius in meters used for the in-radius mask.
+
+    Returns:
+        (indices, distances, in_radius) arrays of length N: the index of the nearest target of each position,
+        the metric distance to it and whether it is closer than ``radius``.
+    """
+    east, north = spray_index.frame.to_enu(lats, lons)
+    distances, indices = spray_index.kdtree.query(np.column_stack((np.ravel(east), np.ravel(north))), k=1)
+    return indices, distances, distances < radius
+
+
+# Indexes memoized by map identity or by (file path, mtime), the least recently used ones are evicted
+SPRAY_INDEX_CACHE_SIZE = 4
+_spray_index_cache = OrderedDict()
+
+
+def _cache_get(key):
+    cached = _spray_index_cache.get(key)
+    if cached is not None:
+        _spray_index_cache.move_to_end(key)
+    return cached
+
+
+def _cache_put(key, value) -> None:
+    _spray_index_cache[key] = value
+    _spray_index_cache.move_to_end(key)
+    while len(_spray_index_cache) > SPRAY_INDEX_CACHE_SIZE:
+        _spray_index_cache.popitem(last=False)
+
+
+def get_spray_index(geojson_data: dict) -> SprayIndex:
+    """Returns the SprayIndex of an already loaded GeoJSON map, building it only once per map object."""
+    key = ("data", id(geojson_data))
+    cached = _cache_get(key)
+    # The id of a map dropped by its caller can be reused by another object, the index keeps the map it was built from
+    if cached is None or cached.geojson_data is not geojson_data:
+        cached = SprayIndex.from_geojson(geojson_data)
+        _cache_put(key, cached)
+    return cached
+
+
+def load_spray_index(prescription_file: str) -> SprayIndex:
+    """Loads a prescription map into a SprayIndex, reloading it only when the file changes on disk.
+
+    GeoJSON maps are compiled once into the binary prescription format next to the GeoJSON file, which is then
+    memory-mapped, see ``robo_spray.prescription``.
+    """
+    from robo_spray.prescription import load_prescription
+
+    path = os.path.abspath(prescription_file)
+    mtime_ns = os.stat(path).st_mtime_ns
+    key = ("file", path)
+    cached = _cache_get(key)
+    if cached is None or cached[0] != mtime_ns:
+        cached = (mtime_ns, load_prescription(path))
+        _cache_put(key, cached)
+    return cached[1]
+
+
 if __name__ == "__main__":
     # Example usage
     geojson_file = 'src/assets/spray_position_all.json'
@@ -50,4 +404,4 @@ if __name__ == "__main__":
     lon2 = -122.4194  # Longitude of location 2
 
     distance = calculate_utm_distance(lat1, lon1, lat2, lon2)
-    print("UTM Distance:", distance, "meters")
\ No newline at end of file
+    print("UTM Distance:", distance, "meters")
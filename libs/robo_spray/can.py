@@ -1,8 +1,9 @@
 
 import time
-from struct import pack,unpack
+from collections import deque
+from struct import pack,unpack,Struct
 
-from farm_ng.canbus.packet import AmigaControlState, Packet, DASHBOARD_NODE_ID
+from farm_ng.canbus.packet import AmigaControlState, AmigaTpdo1, Packet, DASHBOARD_NODE_ID
 from farm_ng.canbus import canbus_pb2
 
 from farm_ng.canbus.packet import AmigaRpdo1 # for reference
@@ -38,7 +39,7 @@ class AmigaSpray1(Packet):
 
     def decode(self, data):
         """Decodes CAN message data and populates the values of the class."""
-        (self.state_req, activate, _) = unpack(self.format, data)
+        (self.state_req, activate) = unpack(self.format, data)
         self.activate = activate
 
     def __str__(self):
@@ -72,6 +73,362 @@ def make_amiga_spray1_proto(
     )
 
 
+# Spray command v2: up to 16 boom sections in one frame, on ID SPRAY2_ID
+SPRAY2_ID = 0x778
+SPRAY2_SECTIONS = 16
+SPRAY2_LEVEL_BITS = 3
+# Duty cycle of an open section is (level + 1) / SPRAY2_DUTY_STEPS, a closed section is off whatever its level
+SPRAY2_DUTY_STEPS = 1 << SPRAY2_LEVEL_BITS
+_SPRAY2_LEVEL_MASK = SPRAY2_DUTY_STEPS - 1
+
+
+class AmigaSpray2(Packet):
+    """On/off state and PWM duty of up to 16 nozzle sections, in one 8-byte frame.
+
+    Layout (little-endian): uint16 section mask, bit i opens section i, then 48 bits of 3-bit levels, the level of
+    section i at bits 3 * i. An open section is driven at a duty cycle of (level + 1) / 8, level 7 is fully open.
+
+    The feather firmware wires sections 0 to 5 only, it reports the others with STATUS_UNSUPPORTED_SECTIONS.
+
+    Args:
+        mask: Open sections.
+        levels: Duty level of each section from 0 to 7, missing ones are 0.
+    """
+
+    def __init__(self, mask: int = 0, levels=()) -> None:
+        if not 0 <= mask < 1 << SPRAY2_SECTIONS:
+            raise ValueError(f"The section mask {mask:#x} does not fit in {SPRAY2_SECTIONS} bits")
+        if len(levels) > SPRAY2_SECTIONS or any(not 0 <= level <= _SPRAY2_LEVEL_MASK for level in levels):
+            raise ValueError(f"Expected at most {SPRAY2_SECTIONS} levels from 0 to {_SPRAY2_LEVEL_MASK}: {levels}")
+        self.mask = mask
+        self.levels = list(levels) + [0] * (SPRAY2_SECTIONS - len(levels))
+        self.stamp_packet(time.monotonic())
+
+    @classmethod
+    def from_duties(cls, duties) -> "AmigaSpray2":
+        """Quantizes the duty cycles of the sections, 0 closes a section and 1 opens it fully."""
+        mask = 0
+        levels = []
+        for section, duty in enumerate(duties):
+            if duty > 0.0:
+                mask |= 1 << section
+            levels.append(min(max(round(duty * SPRAY2_DUTY_STEPS) - 1, 0), _SPRAY2_LEVEL_MASK))
+        return cls(mask, levels)
+
+    def duties(self) -> list:
+        """Duty cycle of every section, 0 for closed sections."""
+        return [
+            (level + 1) / SPRAY2_DUTY_STEPS if self.mask >> section & 1 else 0.0
+            for section, level in enumerate(self.levels)
+        ]
+
+    def encode(self):
+        """Returns the data contained by the class encoded as CAN message data."""
+        packed_levels = 0
+        for section, level in enumerate(self.levels):
+            packed_levels |= level << (SPRAY2_LEVEL_BITS * section)
+        return pack("<H", self.mask) + packed_levels.to_bytes(6, "little")
+
+    def decode(self, data):
+        """Decodes CAN message data and populates the values of the class."""
+        (self.mask,) = unpack("<H", data[:2])
+        packed_levels = int.from_bytes(data[2:8], "little")
+        self.levels = [
+            packed_levels >> (SPRAY2_LEVEL_BITS * section) & _SPRAY2_LEVEL_MASK for section in range(SPRAY2_SECTIONS)
+        ]
+
+    def __str__(self):
+        return f"AMIGA Spray2 Request mask {self.mask:#06x} levels {self.levels}"
+
+
+def make_amiga_spray2_proto(mask: int, levels=()) -> canbus_pb2.RawCanbusMessage:
+    """Creates the RawCanbusMessage of an AmigaSpray2 command, the state of the whole boom in one frame.
+
+    Args:
+        mask: Open sections, bit i for section i.
+        levels: Duty level of each section from 0 to 7, see AmigaSpray2.
+
+    Returns:
+        An instance of a canbus_pb2.RawCanbusMessage.
+    """
+    return canbus_pb2.RawCanbusMessage(id=SPRAY2_ID, data=AmigaSpray2(mask, levels).encode())
+
+
+# Timed spray pulse, on ID SPRAY_PULSE_ID
+SPRAY_PULSE_ID = 0x779
+
+
+class AmigaSprayPulse(Packet):
+    """Spray pulse timed by the feather, so its edges do not depend on the host and bus timing.
+
+    The feather opens the sections of ``mask`` at the duty ``level`` of AmigaSpray2, ``start_offset_ms`` after it
+    receives the frame, for ``duration_ms``. Bit 0 of ``mask`` also opens the single spray switch. A pulse of
+    duration 0 cancels the pending and running pulses. ``seq`` is incremented by the host for every new pulse, the
+    feather ignores a repeated ``seq``.
+    """
+
+    def __init__(
+        self, seq: int = 0, level: int = 0, start_offset_ms: int = 0, duration_ms: int = 0, mask: int = 1
+    ) -> None:
+        self.format = "<BBHHH" # little-endian [uint8 seq, uint8 level, uint16 offset, uint16 duration, uint16 mask]
+
+        self.seq = seq
+        self.level = level
+        self.start_offset_ms = start_offset_ms
+        self.duration_ms = duration_ms
+        self.mask = mask
+        self.stamp_packet(time.monotonic())
+
+    def encode(self):
+        """Returns the data contained by the class encoded as CAN message data."""
+        return pack(self.format, self.seq, self.level, self.start_offset_ms, self.duration_ms, self.mask)
+
+    def decode(self, data):
+        """Decodes CAN message data and populates the values of the class."""
+        (self.seq, self.level, self.start_offset_ms, self.duration_ms, self.mask) = unpack(self.format, data)
+
+    def __str__(self):
+        return (
+            f"AMIGA Spray Pulse seq {self.seq} level {self.level} start {self.start_offset_ms} ms "
+            f"duration {self.duration_ms} ms mask {self.mask:#06x}"
+        )
+
+
+def make_amiga_spray_pulse_proto(
+    seq: int, level: int, start_offset: float, duration: float, mask: int = 1
+) -> canbus_pb2.RawCanbusMessage:
+    """Creates the RawCanbusMessage of an AmigaSprayPulse.
+
+    Args:
+        seq: Sequence number of the pulse, wrapped to 8 bits. 0 is reported by the feather before the first pulse,
+            avoid it.
+        level: Duty level from 0 to 7, see AmigaSpray2.
+        start_offset: Time in seconds between the reception of the frame and the pulse, clipped to 65.535 s.
+        duration: Duration of the pulse in seconds, clipped to 65.535 s. 0 cancels every pulse.
+        mask: Opened sections.
+
+    Returns:
+        An instance of a canbus_pb2.RawCanbusMessage.
+    """
+    return canbus_pb2.RawCanbusMessage(
+        id=SPRAY_PULSE_ID,
+        data=AmigaSprayPulse(
+            seq=seq & 0xFF,
+            level=level,
+            start_offset_ms=min(max(round(start_offset * 1000.0), 0), 0xFFFF),
+            duration_ms=min(max(round(duration * 1000.0), 0), 0xFFFF),
+            mask=mask,
+        ).encode(),
+    )
+
+
+# Pre-encoded spray commands per (state_req, activate), activate only takes a few values
+_spray1_protos = {}
+_spray1_requests = {}
+
+
+def get_amiga_spray1_proto(state_req: AmigaControlState, activate: int) -> canbus_pb2.RawCanbusMessage:
+    """Returns the RawCanbusMessage of an AmigaSpray1 command, see make_amiga_spray1_proto.
+
+    Messages are encoded once and reused for every send, do not modify them.
+    """
+    key = (int(state_req), int(activate))
+    proto = _spray1_protos.get(key)
+    if proto is None:
+        proto = _spray1_protos[key] = make_amiga_spray1_proto(state_req, activate)
+    return proto
+
+
+def get_amiga_spray1_request(state_req: AmigaControlState, activate: int) -> "canbus_pb2.SendCanbusMessageRequest":
+    """Returns the SendCanbusMessageRequest of an AmigaSpray1 command, cached like get_amiga_spray1_proto."""
+    key = (int(state_req), int(activate))
+    request = _spray1_requests.get(key)
+    if request is None:
+        request = _spray1_requests[key] = canbus_pb2.SendCanbusMessageRequest(
+            message=get_amiga_spray1_proto(state_req, activate)
+        )
+    return request
+
+
+# AmigaTpdo1 from the dashboard: state, speed and angular rate in 1/1000, the first 5 bytes of every firmware version
+AMIGA_TPDO1_ID = AmigaTpdo1.cob_id + DASHBOARD_NODE_ID
+_TPDO1_STRUCT = Struct("<Bhh")
+
+
+class AmigaStatus:
+    """Latest state reported by the Amiga, as numbers. ``t_mono`` is None until the first AmigaTpdo1."""
+
+    __slots__ = ("state", "meas_speed", "meas_ang_rate", "t_mono", "frames")
+
+    def __init__(self) -> None:
+        self.state = AmigaControlState.STATE_ESTOPPED
+        self.meas_speed = 0.0
+        self.meas_ang_rate = 0.0
+        self.t_mono = None
+        self.frames = 0
+
+
+# Status of the feather outputs, sent on change and every second:
+# [uint8 flags, uint8 last pulse seq, uint16 open sections, uint32 feather ticks_ms]
+SPRAY_STATUS_ID = 0x77A
+SPRAY_STATUS_STRUCT = Struct("<BBHI")
+STATUS_SWITCH_OPEN = 0x01
+STATUS_ACTIVATED = 0x02
+STATUS_PULSES_PENDING = 0x04
+# The last AmigaSpray2 or AmigaSprayPulse opened sections the feather has no output for, the feather drives 6
+STATUS_UNSUPPORTED_SECTIONS = 0x08
+
+
+class SprayStatus:
+    """Latest status reported by the feather. ``t_mono`` is None until the first status frame.
+
+    ``last_seq`` is the sequence number of the last AmigaSprayPulse the feather accepted, 0 before the first one.
+    ``feather_ms`` is the feather tick counter when the frame was sent, it wraps around every 2**29 ms.
+    """
+
+    __slots__ = ("flags", "last_seq", "open_mask", "feather_ms", "t_mono", "frames")
+
+    def __init__(self) -> None:
+        self.flags = 0
+        self.last_seq = 0
+        self.open_mask = 0
+        self.feather_ms = 0
+        self.t_mono = None
+        self.frames = 0
+
+    @property
+    def switch_open(self) -> bool:
+        return bool(self.flags & STATUS_SWITCH_OPEN)
+
+    @property
+    def unsupported_sections(self) -> bool:
+        return bool(self.flags & STATUS_UNSUPPORTED_SECTIONS)
+
+
+class SprayTelemetry:
+    """Matches the status frames of the feather with the spray pulses sent to it.
+
+    Measures the acknowledgment latency, from sending a pulse to the status reporting its sequence number, and the
+    actuation latency, from the time the pulse should have opened the switch to the status reporting it open. A pulse
+    not acknowledged within ``timeout`` seconds is counted as dropped.
+
+    The status only reports the last pulse the feather accepted, pulses sent before it and still pending were accepted
+    in between two status frames and are counted as superseded. Sequence numbers cycle from 1 to 255.
+
+    Args:
+        timeout: Time in seconds after which an unacknowledged pulse is dropped.
+        history: Number of latencies kept.
+    """
+
+    def __init__(self, timeout: float = 0.5, history: int = 100) -> None:
+        self.timeout = timeout
+        # seq -> (t_mono sent, t_mono the pulse should start)
+        self.pending = {}
+        self.awaiting_open = None
+        self.ack_latencies = deque(maxlen=history)
+        self.actuation_latencies = deque(maxlen=history)
+        self.acknowledged = 0
+        self.superseded = 0
+        self.dropped = 0
+
+    def sent(self, seq: int, t_mono: float, start_offset: float = 0.0) -> None:
+        """Records a pulse ``seq`` sent at ``t_mono``, starting ``start_offset`` seconds after its reception."""
+        self.pending[seq] = (t_mono, t_mono + start_offset)
+
+    def on_status(self, status: SprayStatus) -> None:
+        """Call it with every decoded status, e.g. as the ``on_spray_status`` of a CanDecoder."""
+        sent = self.pending.pop(status.last_seq, None)
+        if sent is not None:
+            self.ack_latencies.append(status.t_mono - sent[0])
+            self.acknowledged += 1
+            self.awaiting_open = (status.last_seq, sent[1])
+            # Sent before the acknowledged pulse, less than half the sequence cycle ago
+            superseded = [seq for seq in self.pending if 0 < (status.last_seq - seq) % 255 < 128]
+            for seq in superseded:
+                del self.pending[seq]
+            self.superseded += len(superseded)
+        if self.awaiting_open is not None and status.switch_open and status.last_seq == self.awaiting_open[0]:
+            self.actuation_latencies.append(max(status.t_mono - self.awaiting_open[1], 0.0))
+            self.awaiting_open = None
+
+    def expire(self, t_mono: float = None) -> int:
+        """Drops the pulses not acknowledged within the timeout and returns how many."""
+        t_mono = time.monotonic() if t_mono is None else t_mono
+        expired = [seq for seq, (t_sent, _) in self.pending.items() if t_mono - t_sent > self.timeout]
+        for seq in expired:
+            del self.pending[seq]
+        self.dropped += len(expired)
+        return len(expired)
+
+    def __str__(self) -> str:
+        ack = max(self.ack_latencies) * 1e3 if self.ack_latencies else float("nan")
+        actuation = max(self.actuation_latencies) * 1e3 if self.actuation_latencies else float("nan")
+        return (
+            f"Spray pulses acknowledged {self.acknowledged} superseded {self.superseded} dropped {self.dropped}, "
+            f"max latency ack {ack:.0f} ms actuation {actuation:.0f} ms"
+        )
+
+
+class CanDecoder:
+    """Decodes the CAN frames the app uses into numeric state, dispatching on the arbitration ID.
+
+    Frames of any other ID cost a single dict lookup. Nothing is formatted here, the UI formats the state at its own
+    refresh rate.
+
+    Args:
+        on_odometry: Called with (meas_speed, meas_ang_rate, t_mono) on every AmigaTpdo1, e.g.
+            PoseFilter.update_odometry.
+        on_spray_status: Called with the SprayStatus on every status frame of the feather, e.g.
+            SprayTelemetry.on_status.
+    """
+
+    def __init__(self, on_odometry=None, on_spray_status=None) -> None:
+        self.on_odometry = on_odometry
+        self.on_spray_status = on_spray_status
+        self.amiga = AmigaStatus()
+        self.feather = SprayStatus()
+        self.handlers = {AMIGA_TPDO1_ID: self._decode_amiga_tpdo1, SPRAY_STATUS_ID: self._decode_spray_status}
+
+    def register(self, arbitration_id: int, handler) -> None:
+        """Calls ``handler(data, t_mono)`` for every frame of ``arbitration_id``."""
+        self.handlers[arbitration_id] = handler
+
+    def feed(self, messages, t_mono: float = None) -> int:
+        """Decodes an iterable of RawCanbusMessage received at ``t_mono``, now if not given.
+
+        Returns:
+            The number of decoded frames.
+        """
+        t_mono = time.monotonic() if t_mono is None else t_mono
+        handlers = self.handlers
+        decoded = 0
+        for message in messages:
+            handler = handlers.get(message.id)
+            if handler is not None:
+                handler(message.data, t_mono)
+                decoded += 1
+        return decoded
+
+    def _decode_amiga_tpdo1(self, data: bytes, t_mono: float) -> None:
+        state, speed, ang_rate = _TPDO1_STRUCT.unpack_from(data)
+        amiga = self.amiga
+        amiga.state = state
+        amiga.meas_speed = speed / 1000.0
+        amiga.meas_ang_rate = ang_rate / 1000.0
+        amiga.t_mono = t_mono
+        amiga.frames += 1
+        if self.on_odometry is not None:
+            self.on_odometry(amiga.meas_speed, amiga.meas_ang_rate, t_mono)
+
+    def _decode_spray_status(self, data: bytes, t_mono: float) -> None:
+        feather = self.feather
+        feather.flags, feather.last_seq, feather.open_mask, feather.feather_ms = SPRAY_STATUS_STRUCT.unpack_from(data)
+        feather.t_mono = t_mono
+        feather.frames += 1
+        if self.on_spray_status is not None:
+            self.on_spray_status(feather)
+
+
 if __name__=="__main__":
 
     # Test the can message
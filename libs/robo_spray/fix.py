@@ -0,0 +1,168 @@
+"""Fixed-layout GPS fix record shared by the GPS process and its consumers."""
+from operator import attrgetter
+
+import numpy as np
+
+# One GPS fix, in the units of the scaled UBX-NAV-PVT fields: degrees, meters and m/s.
+# ``seq`` is the 1-based sequence number of the fix, 0 while the record is being written.
+# ``t_mono`` is the time.monotonic() at which the fix was received. ``fixFlags`` are the NAV-PVT flags, renamed
+# since numpy records already have a ``flags`` attribute; for the same reason read ``min`` as ``fix["min"]``.
+# Consumers read fixes as GpsFix objects, see below.
+FIX_DTYPE = np.dtype(
+    [
+        ("seq", "<u8"),
+        ("t_mono", "<f8"),
+        ("iTOW", "<u4"),
+        ("year", "<u2"),
+        ("month", "u1"),
+        ("day", "u1"),
+        ("hour", "u1"),
+        ("min", "u1"),
+        ("sec", "u1"),
+        ("nano", "<i4"),
+        ("fixType", "u1"),
+        ("fixFlags", "u1"),
+        ("numSV", "u1"),
+        ("lon", "<f8"),
+        ("lat", "<f8"),
+        ("height", "<f8"),
+        ("hAcc", "<f4"),
+        ("vAcc", "<f4"),
+        ("velN", "<f4"),
+        ("velE", "<f4"),
+        ("velD", "<f4"),
+        ("gSpeed", "<f4"),
+        ("headMot", "<f8"),
+        ("headAcc", "<f4"),
+    ],
+    align=True,
+)
+
+# UBX-NAV-PVT fixType values
+FIX_NONE = 0
+FIX_DEAD_RECKONING = 1
+FIX_2D = 2
+FIX_3D = 3
+FIX_GNSS_DEAD_RECKONING = 4
+FIX_TIME_ONLY = 5
+
+# UBX-NAV-PVT flags, valid fix within the DOP and accuracy masks
+FLAG_GNSS_FIX_OK = 0x01
+
+
+def make_fix(**fields) -> np.record:
+    """Returns a FIX_DTYPE record with the given field values, the other fields are zero."""
+    fix = np.zeros(1, dtype=FIX_DTYPE).view(np.recarray)[0]
+    for name, value in fields.items():
+        fix[name] = value
+    return fix
+
+
+class GpsFix:
+    """A GPS fix, with the fields of FIX_DTYPE as plain Python attributes.
+
+    Reading attributes of a numpy record costs a dtype lookup each time; consumers get a GpsFix instead, converted
+    once per fix with ``from_record``. Fields can also be read by name, ``fix["lat"]``, like a record.
+
+    Attributes:
+        seq: Sequence number of the fix, from 1.
+        t_mono: time.monotonic() at which the fix was received.
+        iTOW: GPS time of week of the navigation epoch, in ms.
+        year, month, day, hour, min, sec, nano: UTC date and time of the fix.
+        fixType: FIX_NONE, FIX_DEAD_RECKONING, FIX_2D, FIX_3D, FIX_GNSS_DEAD_RECKONING or FIX_TIME_ONLY.
+        fixFlags: NAV-PVT flags, bit 0 is gnssFixOK, bits 6-7 the RTK carrier phase solution.
+        numSV: Number of satellites used.
+        lon, lat: Position in degrees.
+        height: Height above the ellipsoid, in m.
+        hAcc, vAcc: Horizontal and vertical accuracy estimates, in m.
+        velN, velE, velD: NED velocity, in m/s.
+        gSpeed: Ground speed, in m/s.
+        headMot: Heading of motion, in degrees clockwise from north.
+        headAcc: Accuracy estimate of the heading of motion, in degrees.
+    """
+
+    __slots__ = FIX_DTYPE.names
+
+    seq: int
+    t_mono: float
+    iTOW: int
+    year: int
+    month: int
+    day: int
+    hour: int
+    min: int
+    sec: int
+    nano: int
+    fixType: int
+    fixFlags: int
+    numSV: int
+    lon: float
+    lat: float
+    height: float
+    hAcc: float
+    vAcc: float
+    velN: float
+    velE: float
+    velD: float
+    gSpeed: float
+    headMot: float
+    headAcc: float
+
+    def __init__(self, **fields) -> None:
+        for name in self.__slots__:
+            setattr(self, name, fields.pop(name, 0))
+        if fields:
+            raise TypeError(f"Unknown GPS fix fields {sorted(fields)}")
+
+    @classmethod
+    def from_record(cls, record) -> "GpsFix":
+        """Converts a FIX_DTYPE record."""
+        fix = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, record.item()):
+            setattr(fix, name, value)
+        return fix
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "GpsFix":
+        """Converts a FIX_DTYPE record in its binary layout."""
+        return cls.from_record(np.frombuffer(data, dtype=FIX_DTYPE, count=1)[0])
+
+    def astuple(self) -> tuple:
+        """Field values in the FIX_DTYPE order."""
+        return _get_fields(self)
+
+    def to_record(self) -> np.record:
+        """Converts to a FIX_DTYPE record."""
+        # Zeroed first, so the alignment padding is deterministic
+        records = np.zeros(1, dtype=FIX_DTYPE).view(np.recarray)
+        records[0] = self.astuple()
+        return records[0]
+
+    def to_bytes(self) -> bytes:
+        """Converts to the FIX_DTYPE binary layout."""
+        return self.to_record().tobytes()
+
+    def __getitem__(self, name: str):
+        return getattr(self, name)
+
+    def __reduce__(self):
+        return _fix_from_tuple, (self.astuple(),)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, GpsFix) and self.astuple() == other.astuple()
+
+    def __repr__(self) -> str:
+        return (
+            f"GpsFix(seq={self.seq}, lat={self.lat:.7f}, lon={self.lon:.7f}, fixType={self.fixType}, "
+            f"hAcc={self.hAcc:.3f}, headMot={self.headMot:.1f}, gSpeed={self.gSpeed:.2f})"
+        )
+
+
+_get_fields = attrgetter(*FIX_DTYPE.names)
+
+
+def _fix_from_tuple(values: tuple) -> GpsFix:
+    fix = GpsFix.__new__(GpsFix)
+    for name, value in zip(GpsFix.__slots__, values):
+        setattr(fix, name, value)
+    return fix
@@ -0,0 +1,171 @@
+"""Fusion of GPS fixes with the wheel odometry of the Amiga.
+
+GPS fixes arrive at a few Hz and are already tens of milliseconds old when they are decoded, while the CAN bus
+reports the measured speed and angular rate of the robot continuously. PoseFilter is an extended Kalman filter
+that dead-reckons the pose with the odometry and corrects it with every fix, so a fresh pose can be read at the
+50 Hz control rate.
+
+The state is (east, north, heading) in the field-local frame of the prescription map, see LocalFrame. Headings are
+in radians clockwise from north, like the NAV-PVT heading of motion, so a positive (counterclockwise) angular rate
+decreases the heading.
+"""
+import math
+import time
+
+import numpy as np
+from robo_spray.auto_spray import LocalFrame
+from robo_spray.fix import FIX_2D
+from robo_spray.fix import FIX_GNSS_DEAD_RECKONING
+
+
+class Pose:
+    """Estimated pose of the robot at ``t_mono``, heading in degrees clockwise from north and speed in m/s."""
+
+    __slots__ = ("t_mono", "lat", "lon", "heading", "speed")
+
+    def __init__(self, t_mono: float, lat: float, lon: float, heading: float, speed: float) -> None:
+        self.t_mono = t_mono
+        self.lat = lat
+        self.lon = lon
+        self.heading = heading
+        self.speed = speed
+
+    def __repr__(self) -> str:
+        return f"Pose(lat={self.lat:.7f}, lon={self.lon:.7f}, heading={self.heading:.1f}, speed={self.speed:.2f})"
+
+
+class PoseFilter:
+    """Extended Kalman filter of the robot pose from GPS fixes and wheel odometry.
+
+    Args:
+        frame: Field-local frame of the estimate, the frame of the first fix if not given.
+        speed_noise: Standard deviation of the odometry speed, in m/s.
+        ang_rate_noise: Standard deviation of the odometry angular rate, in rad/s.
+        min_position_noise: Lower bound of the standard deviation of a GPS position, in m. The reported horizontal
+            accuracy of RTK fixes is optimistic once latency and antenna offset are accounted for.
+        min_heading_speed: Speed in m/s above which the GPS heading of motion is used.
+        max_odometry_age: Time in seconds after which the odometry is considered stale and no longer extrapolated.
+    """
+
+    def __init__(
+        self,
+        frame: LocalFrame = None,
+        speed_noise: float = 0.1,
+        ang_rate_noise: float = 0.05,
+        min_position_noise: float = 0.02,
+        min_heading_speed: float = 0.3,
+        max_odometry_age: float = 0.5,
+    ) -> None:
+        self.frame = frame
+        self.speed_noise = speed_noise
+        self.ang_rate_noise = ang_rate_noise
+        self.min_position_noise = min_position_noise
+        self.min_heading_speed = min_heading_speed
+        self.max_odometry_age = max_odometry_age
+
+        # State (east, north, heading) and its covariance, valid at self.t_mono
+        self.x = np.zeros(3)
+        self.P = np.diag([1e6, 1e6, math.pi**2])
+        self.t_mono = None
+
+        # Latest odometry and GPS speed
+        self.speed = 0.0
+        self.ang_rate = 0.0
+        self.t_odometry = -math.inf
+        self.gps_speed = 0.0
+
+    @property
+    def initialized(self) -> bool:
+        """Whether a GPS fix was fused."""
+        return self.t_mono is not None
+
+    def _inputs(self, t_mono: float):
+        """Speed and angular rate driving the motion model at ``t_mono``."""
+        if t_mono - self.t_odometry <= self.max_odometry_age:
+            return self.speed, self.ang_rate
+        # Without odometry, coast on the GPS speed
+        return self.gps_speed, 0.0
+
+    def _propagate(self, t_mono: float) -> None:
+        dt = t_mono - self.t_mono
+        if dt <= 0.0:
+            return
+        speed, ang_rate = self._inputs(t_mono)
+        east, north, heading = self.x
+        sin_h, cos_h = math.sin(heading), math.cos(heading)
+
+        self.x = np.array([east + speed * dt * sin_h, north + speed * dt * cos_h, heading - ang_rate * dt])
+        F = np.array([[1.0, 0.0, speed * dt * cos_h], [0.0, 1.0, -speed * dt * sin_h], [0.0, 0.0, 1.0]])
+        # Odometry noise mapped to the state
+        G = np.array([[dt * sin_h, 0.0], [dt * cos_h, 0.0], [0.0, -dt]])
+        Q = G @ np.diag([self.speed_noise**2, self.ang_rate_noise**2]) @ G.T
+        self.P = F @ self.P @ F.T + Q
+        self.t_mono = t_mono
+
+    def _correct(self, innovation: np.ndarray, H: np.ndarray, R: np.ndarray) -> None:
+        S = H @ self.P @ H.T + R
+        K = self.P @ H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ innovation
+        self.P = (np.eye(3) - K @ H) @ self.P
+
+    def update_odometry(self, speed: float, ang_rate: float, t_mono: float = None) -> None:
+        """Fuses the measured speed (m/s) and angular rate (rad/s, counterclockwise positive) of the robot."""
+        t_mono = time.monotonic() if t_mono is None else t_mono
+        if self.initialized:
+            # The previous inputs drove the robot until now
+            self._propagate(t_mono)
+        self.speed = float(speed)
+        self.ang_rate = float(ang_rate)
+        self.t_odometry = t_mono
+
+    def update_gps(self, fix) -> None:
+        """Fuses a GPS fix, a FIX_DTYPE record. Fixes without a 2D or 3D position are ignored."""
+        if not FIX_2D <= fix.fixType <= FIX_GNSS_DEAD_RECKONING:
+            return
+        if self.frame is None:
+            self.frame = LocalFrame(float(fix.lat), float(fix.lon))
+        east, north = self.frame.to_enu(float(fix.lat), float(fix.lon))
+        position_var = max(float(fix.hAcc), self.min_position_noise) ** 2
+        self.gps_speed = float(fix.gSpeed)
+        t_mono = float(fix.t_mono)
+
+        if not self.initialized:
+            self.x = np.array([east, north, math.radians(float(fix.headMot))])
+            self.P = np.diag([position_var, position_var, math.pi**2])
+            self.t_mono = t_mono
+        else:
+            # A fix older than the state, e.g. decoded after newer odometry, is fused at the state time
+            self._propagate(max(t_mono, self.t_mono))
+            H = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+            self._correct(np.array([east, north]) - self.x[:2], H, np.diag([position_var, position_var]))
+
+        if self.gps_speed >= self.min_heading_speed and fix.headAcc > 0:
+            # The heading of motion is only meaningful while moving
+            heading_error = math.radians(float(fix.headMot)) - self.x[2]
+            heading_error = (heading_error + math.pi) % (2.0 * math.pi) - math.pi
+            H = np.array([[0.0, 0.0, 1.0]])
+            self._correct(np.array([heading_error]), H, np.array([[math.radians(float(fix.headAcc)) ** 2]]))
+
+    def pose_at(self, t_mono: float = None):
+        """Returns the Pose extrapolated to ``t_mono``, now if not given, or None before the first fix.
+
+        The filter state is not modified, call it at any rate.
+        """
+        if not self.initialized:
+            return None
+        t_mono = time.monotonic() if t_mono is None else t_mono
+        speed, ang_rate = self._inputs(t_mono)
+        dt = max(t_mono - self.t_mono, 0.0)
+        east, north, heading = self.x
+        if abs(ang_rate) > 1e-6:
+            # Arc of constant curvature
+            end_heading = heading - ang_rate * dt
+            radius = speed / ang_rate
+            east += radius * (math.cos(end_heading) - math.cos(heading))
+            north -= radius * (math.sin(end_heading) - math.sin(heading))
+            heading = end_heading
+        else:
+            east += speed * dt * math.sin(heading)
+            north += speed * dt * math.cos(heading)
+        lat, lon = self.frame.to_latlon(east, north)
+        return Pose(t_mono, float(lat), float(lon), math.degrees(heading) % 360.0, speed)
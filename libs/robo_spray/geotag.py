@@ -0,0 +1,148 @@
+"""Batch geotagging of captured images from a recorded GPS log.
+
+Each image is matched to the position of the robot when it was captured, interpolated between the fixes of the GPS
+log, and the position is written in its EXIF metadata. Images are tagged in parallel by a process pool.
+
+Usage:
+    python -m robo_spray.geotag images/ run.gpslog --output-dir tagged/
+"""
+import argparse
+import datetime
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import piexif
+from robo_spray.fix import FIX_2D
+from robo_spray.fix import FIX_GNSS_DEAD_RECKONING
+from robo_spray.fix import FLAG_GNSS_FIX_OK
+from robo_spray.gps import FixHistory
+from robo_spray.gps import set_gps_location
+from robo_spray.gpslog import read_fixes
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.JPG", "*.JPEG")
+
+
+def fix_utc_times(fixes) -> np.ndarray:
+    """Returns the UTC times of FIX_DTYPE fixes, in seconds since the epoch."""
+    months = (fixes["year"].astype(np.int64) - 1970) * 12 + fixes["month"].astype(np.int64) - 1
+    days = months.astype("datetime64[M]").astype("datetime64[D]") + (fixes["day"].astype(np.int64) - 1)
+    seconds = days.astype("datetime64[s]").astype(np.int64) + (
+        fixes["hour"].astype(np.int64) * 3600 + fixes["min"].astype(np.int64) * 60 + fixes["sec"].astype(np.int64)
+    )
+    return seconds + fixes["nano"] * 1e-9
+
+
+def image_time(image_file: str, time_source: str = "mtime") -> float:
+    """Returns the capture time of an image in seconds since the epoch.
+
+    ``mtime`` is the modification time of the file. ``exif`` is the DateTimeOriginal of its EXIF metadata, read as
+    UTC: cameras do not record their time zone, correct it with the time offset of ``geotag_images``.
+    """
+    if time_source == "mtime":
+        return os.stat(image_file).st_mtime
+    exif = piexif.load(image_file)
+    stamp = exif["Exif"][piexif.ExifIFD.DateTimeOriginal].decode("ascii")
+    capture_time = datetime.datetime.strptime(stamp, "%Y:%m:%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+    subsec = exif["Exif"].get(piexif.ExifIFD.SubSecTimeOriginal, b"").decode("ascii")
+    return capture_time.timestamp() + (float(f"0.{subsec}") if subsec.isdigit() else 0.0)
+
+
+def _tag_image(task) -> None:
+    image_file, lat, lon, altitude, date_stamp, output_file = task
+    set_gps_location(image_file, lat, lon, altitude, date_stamp, output_file)
+
+
+def geotag_images(
+    image_files,
+    fixes,
+    output_dir: str = None,
+    time_source: str = "mtime",
+    time_offset: float = 0.0,
+    max_gap: float = 1.0,
+    workers: int = None,
+) -> dict:
+    """Writes the interpolated GPS position of every image in its EXIF metadata.
+
+    Args:
+        image_files: Paths of the JPEG images.
+        fixes: FIX_DTYPE fixes covering the capture, e.g. ``read_fixes`` of a GPS log.
+        output_dir: Directory of the tagged copies, the images are modified in place if not given.
+        time_source: Capture time of the images, ``mtime`` or ``exif``, see ``image_time``.
+        time_offset: Seconds added to the capture times to bring them to UTC.
+        max_gap: Longest time in seconds between two fixes to interpolate over.
+        workers: Number of worker processes, the number of CPUs if not given.
+
+    Returns:
+        A report with the number of ``tagged`` and ``skipped`` images, without a position at their capture time,
+        the elapsed ``seconds`` and the ``images_per_second``.
+    """
+    start = time.perf_counter()
+    # Valid 2D or 3D positions only, time-only and dead reckoning fixes have none
+    has_position = (fixes.fixType >= FIX_2D) & (fixes.fixType <= FIX_GNSS_DEAD_RECKONING)
+    fixes = fixes[has_position & (fixes.fixFlags & FLAG_GNSS_FIX_OK != 0)]
+    # Interpolate on the UTC time of the fixes, the receive times are not comparable to image times
+    history = FixHistory(capacity=max(len(fixes), 1))
+    utc_fixes = fixes.copy()
+    utc_fixes.t_mono = fix_utc_times(fixes)
+    history.append(utc_fixes)
+
+    image_files = list(image_files)
+    times = np.array([image_time(image_file, time_source) for image_file in image_files]) + time_offset
+    lats, lons = history.position_at(times, max_gap)
+    altitudes = np.interp(times, utc_fixes.t_mono, fixes.height) if len(fixes) else np.zeros(len(times))
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    tasks = []
+    for image_file, capture_time, lat, lon, altitude in zip(image_files, times, lats, lons, altitudes):
+        if np.isnan(lat):
+            continue
+        date_stamp = datetime.datetime.fromtimestamp(capture_time, datetime.timezone.utc).strftime("%Y:%m:%d")
+        output_file = None if output_dir is None else os.path.join(output_dir, os.path.basename(image_file))
+        tasks.append((image_file, float(lat), float(lon), float(altitude), date_stamp, output_file))
+
+    if tasks:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Tagging an image takes about a millisecond, send them in chunks
+            list(executor.map(_tag_image, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+
+    seconds = time.perf_counter() - start
+    return {
+        "tagged": len(tasks),
+        "skipped": len(image_files) - len(tasks),
+        "seconds": seconds,
+        "images_per_second": len(tasks) / seconds if seconds > 0 else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="geotag")
+    parser.add_argument("image_dir", type=str, help="Directory of the captured JPEG images.")
+    parser.add_argument("gps_log", type=str, help="GPS log recorded during the capture.")
+    parser.add_argument("--output-dir", type=str, default=None, help="Write tagged copies instead of in place.")
+    parser.add_argument("--time-source", choices=("mtime", "exif"), default="mtime", help="Capture time of images.")
+    parser.add_argument("--time-offset", type=float, default=0.0, help="Seconds added to the capture times.")
+    parser.add_argument("--max-gap", type=float, default=1.0, help="Longest GPS outage to interpolate over [s].")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    image_files = sorted(
+        {path for pattern in IMAGE_PATTERNS for path in glob.glob(os.path.join(args.image_dir, pattern))}
+    )
+    report = geotag_images(
+        image_files,
+        read_fixes(args.gps_log),
+        output_dir=args.output_dir,
+        time_source=args.time_source,
+        time_offset=args.time_offset,
+        max_gap=args.max_gap,
+        workers=args.workers,
+    )
+    print(
+        f"Tagged {report['tagged']} images, skipped {report['skipped']} without a GPS position, "
+        f"in {report['seconds']:.2f} s ({report['images_per_second']:.0f} images/s)"
+    )
@@ -1,20 +1,27 @@
+import asyncio
 import time
 import serial
-import struct
-from ublox_gps import UbloxGps
-from ublox_gps import sparkfun_predefines as sp
-from multiprocessing import Process,Queue
+from multiprocessing import Process
 import piexif
-#import cv2
-from fractions import Fraction
 
 import datetime
-import json
 
 import glob
-import subprocess
+import json
 import os
 
+import numpy as np
+from robo_spray.prescription import load_prescription
+from robo_spray.ringbuffer import FixRingBuffer
+from robo_spray import gpslog
+from robo_spray import receiver
+from robo_spray import ubx
+from robo_spray.fix import FIX_3D
+from robo_spray.fix import FIX_DTYPE
+from robo_spray.fix import FLAG_GNSS_FIX_OK
+from robo_spray.fix import GpsFix
+from robo_spray.fix import make_fix
+
 assets_path = os.path.join(os.path.dirname(__file__),"../../src/assets/")
 
 def convert_to_dms(degrees):
@@ -48,47 +55,31 @@ def to_deg(value, loc):
     sec = round((t1 - min) * 60, 5)
     return (deg, min, sec, loc_value)
 
-def change_to_rational(number):
+def change_to_rational(number, denominator=100000):
     """convert a number to rantional
-    Keyword arguments: number
+    Keyword arguments: number, exact up to 5 decimals like the seconds of to_deg
     return: tuple like (1, 2), (numerator, denominator)
     """
-    f = Fraction(str(number))
-    return (f.numerator, f.denominator)
-
-def geotag_image(img,lat,lon, save_path):
-
-    #exif_latitude = convert_to_dms(lat)
-    #exif_longitude = convert_to_dms(lon)
-
-    exif_latitude = piexif.GPSIFD.GPSLatitude.convert(lat)
-    exif_latitude_ref = 'N' if lat[0] > 0 else 'S'
-    exif_longitude = piexif.GPSIFD.GPSLongitude.convert(lon)
-    exif_longitude_ref = 'E' if lon[0] > 0 else 'W'
-
-    # Create the EXIF data dictionary
-    exif_dict = {"GPS": {
-        piexif.GPSIFD.GPSLatitudeRef: exif_latitude_ref,
-        piexif.GPSIFD.GPSLatitude: exif_latitude,
-        piexif.GPSIFD.GPSLongitudeRef: exif_longitude_ref,
-        piexif.GPSIFD.GPSLongitude: exif_longitude,
-    }}
-
-    # Convert the EXIF data dictionary to bytes
-    exif_bytes = piexif.dump(exif_dict)
-
-    # Add the EXIF data to the image
-    cv2.imwrite(save_path, img, [int(cv2.IMWRITE_JPEG_QUALITY), 95, int(cv2.IMWRITE_JPEG_EXIF_QTABLES), 1, int(cv2.IMWRITE_JPEG_EXIF_THUMBNAIL), 1, int(cv2.IMWRITE_JPEG_EXIF_SIZE), len(exif_bytes), int(cv2.IMWRITE_JPEG_EXIF_DATA), exif_bytes])
-
-
-def set_gps_location(file_name, lat, lng, altitude, gpsTime):
-    """Adds GPS position as EXIF metadata
-    Keyword arguments:
-    file_name -- image file
-    lat -- latitude (as float)
-    lng -- longitude (as float)
-    altitude -- altitude (as float)
-    """
+    # Fixed denominator, a Fraction per value is needlessly slow for EXIF
+    if float(number).is_integer():
+        return (int(number), 1)
+    return (int(round(number * denominator)), denominator)
+
+def geotag_image(img,lat,lon, save_path, altitude=0.0, gpsTime=None):
+    """Saves an image array as a JPEG with its GPS position as EXIF metadata."""
+    # Optional dependency, only needed to encode image arrays
+    import cv2
+
+    ok, jpeg = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
+    if not ok:
+        raise IOError(f"Could not encode {save_path}")
+    with open(save_path, "wb") as file:
+        file.write(jpeg.tobytes())
+    set_gps_location(save_path, lat, lon, altitude, gpsTime)
+
+
+def make_gps_ifd(lat, lng, altitude, gpsTime=None):
+    """Returns the EXIF GPS IFD of a position, see set_gps_location."""
     lat_deg = to_deg(lat, ["S", "N"])
     lng_deg = to_deg(lng, ["W", "E"])
 
@@ -97,185 +88,488 @@ def set_gps_location(file_name, lat, lng, altitude, gpsTime):
 
     gps_ifd = {
       piexif.GPSIFD.GPSVersionID: (2, 0, 0, 0),
-      piexif.GPSIFD.GPSAltitudeRef: 0,
-      piexif.GPSIFD.GPSAltitude: change_to_rational(round(altitude)),
+      piexif.GPSIFD.GPSAltitudeRef: 0 if altitude >= 0 else 1,
+      piexif.GPSIFD.GPSAltitude: change_to_rational(round(abs(altitude))),
       piexif.GPSIFD.GPSLatitudeRef: lat_deg[3],
       piexif.GPSIFD.GPSLatitude: exiv_lat,
       piexif.GPSIFD.GPSLongitudeRef: lng_deg[3],
       piexif.GPSIFD.GPSLongitude: exiv_lng,
-      piexif.GPSIFD.GPSDateStamp: gpsTime
     }
+    if gpsTime is not None:
+        gps_ifd[piexif.GPSIFD.GPSDateStamp] = gpsTime
+    return gps_ifd
 
-    exif_dict = {"GPS": gps_ifd}
+
+def set_gps_location(file_name, lat, lng, altitude, gpsTime=None, output_file=None):
+    """Adds GPS position as EXIF metadata
+    Keyword arguments:
+    file_name -- image file
+    lat -- latitude (as float)
+    lng -- longitude (as float)
+    altitude -- altitude (as float)
+    gpsTime -- GPS date stamp "YYYY:MM:DD"
+    output_file -- tagged copy of the image, file_name is modified if not given
+    """
+    try:
+        # Keep the EXIF metadata of the camera
+        exif_dict = piexif.load(file_name)
+    except Exception:
+        exif_dict = {}
+    exif_dict["GPS"] = make_gps_ifd(lat, lng, altitude, gpsTime)
+    exif_dict.pop("thumbnail", None)
     exif_bytes = piexif.dump(exif_dict)
-    piexif.insert(exif_bytes, file_name)
-
-class ObjectFromDict:
-    def __init__(self, **entries):
-        self.__dict__.update(entries)
-
-def get_product_attribute(device_path):
-    command = ['udevadm', 'info', '-q', 'all', '-a', '-n', device_path]
-    output = subprocess.check_output(command, universal_newlines=True)
-    lines = output.splitlines()
-    for line in lines:
-        line = line.strip()
-        if line.startswith('ATTRS{product}'):
-            product = line.strip().split('==')[-1]
-            return product
+    piexif.insert(exif_bytes, file_name, output_file)
+
+# u-blox USB vendor id
+UBLOX_VENDOR_ID = "1546"
+# Last port the GPS was found on
+GPS_DEVICE_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "robo_spray", "gps_device.json")
+
+
+def read_usb_attributes(tty_name, sysfs_root="/sys"):
+    """Returns the attributes of the USB device of a tty, e.g. ``{"idVendor": "1546", "product": "u-blox GNSS"}``.
+
+    The device link of the tty points to its USB interface, the attributes are on the first parent holding an
+    ``idVendor``. Returns None if the tty is not a USB device.
+    """
+    path = os.path.realpath(os.path.join(sysfs_root, "class", "tty", tty_name, "device"))
+    root = os.path.realpath(sysfs_root)
+    while path.startswith(root) and path != root:
+        if os.path.exists(os.path.join(path, "idVendor")):
+            attributes = {}
+            for name in ("idVendor", "idProduct", "manufacturer", "product"):
+                try:
+                    with open(os.path.join(path, name)) as file:
+                        attributes[name] = file.read().strip()
+                except OSError:
+                    attributes[name] = ""
+            return attributes
+        path = os.path.dirname(path)
     return None
 
-def find_gps_device(gps_product="u-blox"):
-    devices = glob.glob('/dev/ttyACM*')
-    for device in devices:
-        
+
+def is_gps_device(attributes, gps_product="u-blox"):
+    return attributes is not None and (
+        attributes["idVendor"] == UBLOX_VENDOR_ID
+        or gps_product in attributes["product"]
+        or gps_product in attributes["manufacturer"]
+    )
+
+
+def find_gps_device(gps_product="u-blox", sysfs_root="/sys", dev_root="/dev", cache_file=GPS_DEVICE_CACHE):
+    """Returns the serial port of the GPS receiver, or None if not connected.
+
+    The port found last is cached in ``cache_file`` and checked first, by reading only its sysfs attributes.
+    """
+    cached = None
+    if cache_file is not None:
         try:
-           product = get_product_attribute(device_path=device) 
-           if gps_product in product:
-                print(f"Found {product} on {device}")
-                return device
-        except IOError:
+            with open(cache_file) as file:
+                cached = json.load(file)["tty"]
+        except (OSError, ValueError, KeyError):
             pass
 
+    ttys = sorted(
+        os.path.basename(path)
+        for pattern in ("ttyACM*", "ttyUSB*")
+        for path in glob.glob(os.path.join(sysfs_root, "class", "tty", pattern))
+    )
+    if cached in ttys:
+        ttys.remove(cached)
+        ttys.insert(0, cached)
+
+    for tty in ttys:
+        device = os.path.join(dev_root, tty)
+        attributes = read_usb_attributes(tty, sysfs_root)
+        if not os.path.exists(device) or not is_gps_device(attributes, gps_product):
+            continue
+        if tty != cached:
+            print(f"Found {attributes['product']} on {device}")
+            if cache_file is not None:
+                try:
+                    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                    with open(cache_file, "w") as file:
+                        json.dump({"tty": tty}, file)
+                except OSError:
+                    pass
+        return device
+
     return None
 
+class FixHistory:
+    """Bounded history of GPS fixes indexed by their monotonic receive time ``t_mono``.
+
+    Fixes are stored in time order in a numpy array twice the capacity, compacted when its end is reached, so the
+    retained fixes are always one contiguous sorted slice: appends are amortized O(1) and time lookups are binary
+    searches.
+
+    Args:
+        capacity: Number of fixes retained, the oldest are dropped first.
+    """
+
+    def __init__(self, capacity: int = 3000) -> None:
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=FIX_DTYPE).view(np.recarray)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    @property
+    def fixes(self) -> np.recarray:
+        """View of the retained fixes, oldest first."""
+        return self.data[self.start:self.end]
+
+    @property
+    def t_mono(self) -> np.ndarray:
+        return self.data.t_mono[self.start:self.end]
+
+    def latest(self):
+        """Returns the latest fix, or None if empty."""
+        return self.data[self.end - 1] if len(self) else None
+
+    def append(self, fixes) -> None:
+        """Appends a fix or an array of fixes, FIX_DTYPE records newer than the latest fix."""
+        fixes = np.atleast_1d(np.asarray(fixes, dtype=FIX_DTYPE))[-self.capacity:]
+        if self.end + len(fixes) > len(self.data):
+            # Move the fixes still retained to the front
+            keep = min(len(self), self.capacity - len(fixes))
+            self.data[:keep] = self.data[self.end - keep:self.end]
+            self.start, self.end = 0, keep
+        self.data[self.end:self.end + len(fixes)] = fixes
+        self.end += len(fixes)
+        self.start = max(self.start, self.end - self.capacity)
+
+    def window(self, t_start: float, t_end: float) -> np.recarray:
+        """Returns a copy of the fixes received between ``t_start`` and ``t_end`` included."""
+        t_mono = self.t_mono
+        first = np.searchsorted(t_mono, t_start, side="left")
+        last = np.searchsorted(t_mono, t_end, side="right")
+        return self.fixes[first:last].copy()
+
+    def position_at(self, t, max_gap: float = 1.0):
+        """Returns the position at time ``t``, interpolated between the fixes around it.
+
+        Args:
+            t: A monotonic time, or an array of times.
+            max_gap: Longest time in seconds between the two fixes around ``t`` to interpolate over.
+
+        Returns:
+            (lat, lon), NaN where ``t`` is outside of the history or in a gap longer than ``max_gap``.
+        """
+        t = np.asarray(t, dtype=np.float64)
+        fixes, t_mono = self.fixes, self.t_mono
+        if len(fixes) == 0:
+            nan = np.full(t.shape, np.nan)
+            return nan, nan.copy()
+
+        lat = np.interp(t, t_mono, fixes.lat, left=np.nan, right=np.nan)
+        lon = np.interp(t, t_mono, fixes.lon, left=np.nan, right=np.nan)
+        after = np.clip(np.searchsorted(t_mono, t, side="left"), 1, max(len(t_mono) - 1, 1))
+        gap = t_mono[after] - t_mono[after - 1] if len(t_mono) > 1 else np.zeros(t.shape)
+        # A time falling exactly on a fix is never in a gap
+        exact = t_mono[np.minimum(np.searchsorted(t_mono, t), len(t_mono) - 1)] == t
+        invalid = (gap > max_gap) & ~exact
+        lat = np.where(invalid, np.nan, lat)
+        lon = np.where(invalid, np.nan, lon)
+        if t.ndim == 0:
+            return float(lat), float(lon)
+        return lat, lon
+
+
 class GPS:
-    def __init__(self,update_ms=300,simulation=False):
+    def __init__(self,update_ms=40,simulation=False,port_id=receiver.PORT_USB,use_process=True,
+                 record_file=None,replay_file=None,replay_speed=1.0):
+        # Preferred navigation period, slower periods are negotiated if the receiver rejects it
+        self.update_ms = update_ms
+        self.port_id = port_id
+        self.receiver_config = None
+
+        # GPS log to record the receiver stream to, see robo_spray.gpslog
+        self.record_file = record_file
+        self.recorder = None
+        # GPS log replayed instead of the receiver, replay_speed times faster, as fast as possible if None
+        self.replay_file = replay_file
+        self.replay_speed = replay_speed
+        # Whether the replayed log holds raw receiver bytes, its fixes are then decoded again
+        self.replay_raw = False
+
         try:
+            if replay_file is not None:
+                raise IOError(f"Replaying {replay_file}")
             device = find_gps_device()
-            self.gps_port = serial.Serial(device, baudrate=38400, timeout=1)
-            self.gps = UbloxGps(self.gps_port)
+            if device is None:
+                raise IOError("No u-blox GPS device found")
+            self.gps_port = serial.Serial(device, baudrate=38400, timeout=0.1)
         except Exception as e:
             print(e)
             self.gps_port = None
-            self.gps = None
 
-        if self.gps:
-            # Setup samping rate
-            ubx_id = 0x08
-            ubx_payload = struct.pack("<HHH", update_ms, 1, 0)
-            # Send the UBX-CFG-RATE message
-            self.gps.send_message(sp.CFG_CLS, ubx_id, ubx_payload)
+        # Splits the receiver byte stream into UBX frames, see _run()
+        self.parser = ubx.UbxParser()
+
+        if self.gps_port:
+            self.configure_receiver()
 
         self.simulation = simulation
-        self.queue:Queue = Queue() # FIFO Queue
+        # Read the receiver in a separate process, or in the running asyncio event loop
+        if use_process and replay_file is not None and replay_speed is None:
+            # Only the event loop replay waits for the consumers, a process would overrun the ring
+            print("Replaying as fast as possible in the event loop")
+            use_process = False
+        self.use_process = use_process
+        self.process = None
+        # Simulation or replay task of the asyncio mode
+        self.source_task = None
+        # Last fixes, shared with the GPS process. In the event loop new fixes are published directly.
+        self.ring = FixRingBuffer(notify=use_process)
         self.running = False
 
-        self.geo:object = None
+        self.geo:GpsFix = None
+        # Sequence number of self.geo
+        self.geo_seq = 0
+        # Fixes of the last minutes, see FixHistory
+        self.history = FixHistory()
 
-        # Dry run
-        if 0:
-            self.update_gps()
-            _ = self.get_gps_data()
+        # Event-driven consumers, see fixes()
+        self.subscribers = []
 
     def start(self):
-        self.process = Process(target=self._run, args=())
-        self.running = True 
-        self.process.start()
-    
+        self.running = True
+        if self.use_process:
+            self.process = Process(target=self._run, args=())
+            self.process.start()
+            return
+
+        self._open_recorder()
+        loop = asyncio.get_event_loop()
+        if self.replay_file is not None:
+            self.source_task = loop.create_task(self._replay_async())
+        elif self.gps_port is None or self.simulation:
+            print("Running GPS simulation mode")
+            self.source_task = loop.create_task(self._simulate_async())
+        else:
+            # Never block the event loop, read only what the receiver already sent
+            self.gps_port.timeout = 0
+            loop.add_reader(self.gps_port.fileno(), self._on_serial_data)
+
     def _run(self):
-        if self.gps == None or self.simulation:
+        self._open_recorder()
+        if self.replay_file is not None:
+            for wait, kind, payload in gpslog.replay_schedule(self.replay_file, self.replay_speed):
+                time.sleep(wait)
+                self._replay(kind, payload)
+            print("GPS replay finished")
+            self._close_recorder()
+            return
+
+        if self.gps_port is None or self.simulation:
             print("GPS module not detected. Verify the connection.")
             print("Running GPS simulation mode")
-            
-            # Runing GPS Simulation
-            with open(os.path.join(assets_path,'spray_position_all.json')) as file:
-                data = json.load(file)
-                    # Add markers to the MapView 
-            sorted_features = sorted(data['features'], key=lambda feature: feature['properties']['name'])
-
-            sorted_data = {
-                'type': 'FeatureCollection',
-                'features': sorted_features
-            }
-
-            gps_data_len = len(sorted_data['features'])
-            idx = 0
-            while self.running:
-                # Get the current time
-                current_time = datetime.datetime.now()
-                coordinates = sorted_data['features'][idx]['geometry']['coordinates']
-                geo_dict = {
-                            "year":current_time.year,
-                            "month":current_time.month,
-                            "day":current_time.day,
-                            "hour":current_time.hour,
-                            "min":current_time.min,
-                            "sec":current_time.second,
-                            "nano":current_time.microsecond*1000,
-                            "lon":coordinates[0],
-                            "lat":coordinates[1],
-                            "height": 0,
-                            "headMot":0,
-                } 
-
-
-                try:
-                    self.queue.put(ObjectFromDict(**geo_dict),timeout=0)
-                except Exception as e:
-                    print("GPS queue is full")
-                    print(e)
-
-                idx += 1
-                # Reset
-                if idx == gps_data_len:
-                    print("Reset idx")
-                    idx = 0
+            for fix in self._simulated_fixes():
+                self._store(fix)
                 time.sleep(0.10)
 
         while self.running:
             self.update_gps()
-            time.sleep(0.01)
+
+    async def _simulate_async(self):
+        for fix in self._simulated_fixes():
+            self._store(fix)
+            self._publish()
+            await asyncio.sleep(0.10)
+
+    async def _replay_async(self):
+        for wait, kind, payload in gpslog.replay_schedule(self.replay_file, self.replay_speed):
+            if not self.running:
+                break
+            await asyncio.sleep(wait)
+            if self._replay(kind, payload):
+                self._publish()
+                if self.replay_speed is None:
+                    # As fast as possible, but deterministic: every consumer gets every fix
+                    while any(fixes.full() for fixes in self.subscribers):
+                        await asyncio.sleep(0)
+        print("GPS replay finished")
+
+    def _replay(self, kind, payload):
+        """Replays a GPS log record as if just received, returns the number of new fixes."""
+        if kind == gpslog.RAW:
+            self.replay_raw = True
+            return self._parse(payload)
+        if kind == gpslog.FIX and not self.replay_raw:
+            # A log of decoded fixes only, e.g. recorded in simulation
+            fix = np.frombuffer(payload, dtype=FIX_DTYPE).view(np.recarray)[0].copy()
+            fix.t_mono = time.monotonic()
+            self._store(fix)
+            return 1
+        return 0
+
+    def _open_recorder(self):
+        if self.record_file is not None:
+            self.recorder = gpslog.GpsLogWriter(self.record_file)
+
+    def _close_recorder(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def _store(self, fix):
+        """Appends a fix to the ring buffer, and to the GPS log when recording."""
+        self.ring.append_record(fix)
+        if self.recorder is not None:
+            self.recorder.write_fix(fix)
+
+    def _simulated_fixes(self):
+        """Yields simulated fixes walking the spray track, until stopped."""
+        # Runing GPS Simulation on the memory-mapped track, in name order
+        track = load_prescription(os.path.join(assets_path,'spray_position_all.json'))
+        order = sorted(range(len(track)), key=track.name)
+
+        gps_data_len = len(order)
+        idx = 0
+        while self.running:
+            # Get the current time
+            current_time = datetime.datetime.now()
+            coordinates = track.points[order[idx]]
+            yield make_fix(
+                t_mono=time.monotonic(),
+                year=current_time.year,
+                month=current_time.month,
+                day=current_time.day,
+                hour=current_time.hour,
+                min=current_time.minute,
+                sec=current_time.second,
+                nano=current_time.microsecond*1000,
+                fixType=FIX_3D,
+                fixFlags=FLAG_GNSS_FIX_OK,
+                lon=coordinates[0],
+                lat=coordinates[1],
+                height=0,
+                headMot=0,
+            )
+
+            idx += 1
+            # Reset
+            if idx == gps_data_len:
+                print("Reset idx")
+                idx = 0
+
+    def configure_receiver(self):
+        """Configures the receiver to stream only NAV-PVT, at ``update_ms`` or the fastest slower period it accepts."""
+        meas_rates_ms = [self.update_ms] + [ms for ms in receiver.MEAS_RATES_MS if ms > self.update_ms]
+        try:
+            self.receiver_config = receiver.configure_receiver(self.gps_port, meas_rates_ms, self.port_id)
+            print(f"GPS configured: {self.receiver_config}")
+        except IOError as e:
+            print(e)
 
     def update_gps(self):
+        """Reads the bytes received so far and publishes the NAV-PVT fixes they complete."""
         try:
-            geo_response = self.gps.geo_coords()
-        except Exception as e:
+            # Everything already buffered in one read, or block until the next byte or the port timeout
+            data = self.gps_port.read(self.gps_port.in_waiting or 1)
+        except serial.SerialException as e:
+            print(e)
+            time.sleep(0.1)
+            return 0
+        return self._parse(data)
+
+    def _parse(self, data):
+        """Decodes the NAV-PVT fixes completed by ``data`` into the ring buffer, returns their number."""
+        t_mono = time.monotonic()
+        if self.recorder is not None:
+            self.recorder.write_raw(t_mono, data)
+        count = 0
+        for msg_cls, msg_id, payload in self.parser.feed(data):
+            if msg_cls == ubx.NAV_CLS and msg_id == ubx.NAV_PVT:
+                self._store(ubx.decode_nav_pvt(payload, t_mono))
+                count += 1
+        return count
+
+    def _on_serial_data(self):
+        """Called by the event loop when the receiver sent bytes, in the asyncio mode."""
+        try:
+            data = self.gps_port.read(max(self.gps_port.in_waiting, 1))
+        except serial.SerialException as e:
             print(e)
-            geo_response = None
-
-        if geo_response:
-            if 0:
-                print("UTC Time {}:{}:{}".format(geo_response.hour, geo_response.min,geo_response.sec))
-                print("Longitude: ", geo_response.lon) 
-                print("Latitude: ", geo_response.lat)
-                print("Heading of Motion: ", geo_response.headMot)
-
-            geo_dict = {
-                        "year":geo_response.year,
-                        "month":geo_response.month,
-                        "day":geo_response.day,
-                        "hour":geo_response.hour,
-                        "min":geo_response.min,
-                        "sec":geo_response.sec,
-                        "nano":geo_response.nano,
-                        "lon":geo_response.lon,
-                        "lat":geo_response.lat,
-                        "height": geo_response.height,
-                        "headMot":geo_response.headMot,
-            }
-
-            try:
-                self.queue.put(ObjectFromDict(**geo_dict),timeout=0)
-            except Exception as e:
-                print("GPS queue is full")
-                print(e)
+            asyncio.get_event_loop().remove_reader(self.gps_port.fileno())
+            return
+        if self._parse(data):
+            self._publish()
 
     def get_gps_data(self):
-        #@TODO: Add EKF here. Aggrgate all the previous GPS data points
-        
-        # Get all gps points from the queue
-        while not self.queue.empty():
-            # print(self.queue.qsize())
-            self.geo = self.queue.get()
-            # print("UTC Time {}:{}:{}".format(self.geo.hour, self.geo.min,self.geo.sec))
-
+        # Fused with the wheel odometry by robo_spray.fusion.PoseFilter in the app
+
+        # Fixes received since the last call, read at once since the GPS process may write meanwhile.
+        # The ring only retains its capacity
+        new_fixes = self.ring.last(self.ring.capacity)
+        new_fixes = new_fixes[new_fixes.seq > self.geo_seq]
+        if len(new_fixes):
+            self.history.append(new_fixes)
+            # Latest gps point of the ring buffer
+            self.geo = GpsFix.from_record(new_fixes[-1])
+            self.geo_seq = self.geo.seq
 
         return self.geo
-    
+
+    def position_at(self, t_mono, max_gap: float = 1.0):
+        """Returns the (lat, lon) at the monotonic time ``t_mono`` interpolated from the history, see FixHistory."""
+        self.get_gps_data()
+        return self.history.position_at(t_mono, max_gap)
+
+    def get_last_gps_data(self, n: int):
+        """Returns up to the last ``n`` GPS fixes as a numpy record array, oldest first."""
+        return self.ring.last(n)
+
+    async def fixes(self):
+        """Yields every new GPS fix once, as soon as it is received.
+
+        A consumer slower than the fix rate only gets the latest fix, and nothing is yielded while no new fix
+        arrives. Several consumers can iterate concurrently.
+        """
+        loop = asyncio.get_event_loop()
+        # In the asyncio mode the serial reader publishes the fixes itself
+        if self.use_process and not self.subscribers:
+            loop.add_reader(self.ring.fileno(), self._on_new_fix)
+
+        fixes: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.subscribers.append(fixes)
+        try:
+            while True:
+                yield await fixes.get()
+        finally:
+            self.subscribers.remove(fixes)
+            if self.use_process and not self.subscribers:
+                loop.remove_reader(self.ring.fileno())
+
+    def _on_new_fix(self):
+        """Called by the event loop when the GPS process wrote new fixes."""
+        self.ring.drain()
+        self._publish()
+
+    def _publish(self):
+        """Hands the latest fix to the consumers of fixes(), if it is new."""
+        seq = self.geo_seq
+        if self.get_gps_data() is None or self.geo_seq == seq:
+            return
+        for fixes in self.subscribers:
+            # Keep only the latest fix for slow consumers
+            if fixes.full():
+                fixes.get_nowait()
+            fixes.put_nowait(self.geo)
+
     def stop(self):
         self.running = False
-        self.process.kill()
+        if self.process is not None:
+            self.process.kill()
+        if self.source_task is not None:
+            self.source_task.cancel()
+        elif not self.use_process and self.gps_port is not None:
+            asyncio.get_event_loop().remove_reader(self.gps_port.fileno())
+        # The GPS process is killed with its recorder, it loses at most the last flush period
+        self._close_recorder()
 
 if __name__ == "__main__":
 
@@ -0,0 +1,126 @@
+"""Compact log of a GPS receiver stream, for recording field runs and replaying them.
+
+The log stores the raw bytes read from the receiver, so a replay goes through the same parser as a live run, and
+the fixes decoded from them, so a run can be analyzed without parsing. Each record is stamped with the monotonic
+time at which it was received.
+
+Layout (little-endian):
+
+    header  magic "RSGL", uint32 version
+    records uint8 kind, float64 t_mono, uint32 size, then ``size`` bytes of payload
+            RAW: bytes read from the receiver
+            FIX: one FIX_DTYPE record
+"""
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+from robo_spray.fix import FIX_DTYPE
+
+MAGIC = b"RSGL"
+VERSION = 1
+HEADER_FORMAT = "<4sI"
+RECORD_FORMAT = struct.Struct("<BdI")
+
+RAW = 0
+FIX = 1
+
+
+class GpsLogWriter:
+    """Appends records to a GPS log.
+
+    Args:
+        log_file: Path of the log, overwritten if it exists.
+        flush_period: Maximum time in seconds a record stays buffered in memory.
+    """
+
+    def __init__(self, log_file: str, flush_period: float = 1.0) -> None:
+        self.log_file = log_file
+        self.flush_period = flush_period
+        self.file = open(log_file, "wb")
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION))
+        self.last_flush = time.monotonic()
+
+    def _write(self, kind: int, t_mono: float, payload: bytes) -> None:
+        self.file.write(RECORD_FORMAT.pack(kind, t_mono, len(payload)))
+        self.file.write(payload)
+        if time.monotonic() - self.last_flush >= self.flush_period:
+            self.flush()
+
+    def write_raw(self, t_mono: float, data: bytes) -> None:
+        """Records the bytes read from the receiver at ``t_mono``."""
+        if data:
+            self._write(RAW, t_mono, data)
+
+    def write_fix(self, fix) -> None:
+        """Records a decoded FIX_DTYPE fix."""
+        self._write(FIX, float(fix.t_mono), np.asarray(fix, dtype=FIX_DTYPE).tobytes())
+
+    def flush(self) -> None:
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_log(log_file: str):
+    """Yields the (kind, t_mono, payload) records of a GPS log, stopping at a truncated last record."""
+    with open(log_file, "rb") as file:
+        magic, version = struct.unpack(HEADER_FORMAT, file.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{log_file} is not a version {VERSION} GPS log")
+        while True:
+            header = file.read(RECORD_FORMAT.size)
+            if len(header) < RECORD_FORMAT.size:
+                return
+            kind, t_mono, size = RECORD_FORMAT.unpack(header)
+            payload = file.read(size)
+            if len(payload) < size:
+                return
+            yield kind, t_mono, payload
+
+
+def read_fixes(log_file: str) -> np.recarray:
+    """Returns the decoded fixes of a GPS log as a FIX_DTYPE record array."""
+    payloads = [payload for kind, _, payload in read_log(log_file) if kind == FIX]
+    return np.frombuffer(b"".join(payloads), dtype=FIX_DTYPE).view(np.recarray)
+
+
+def replay_schedule(log_file: str, speed: float = 1.0):
+    """Yields (wait, kind, payload) for the records of a GPS log.
+
+    ``wait`` is the time in seconds to wait before handling the record to reproduce the recorded timing
+    ``speed`` times faster, always 0 if ``speed`` is None to replay as fast as possible.
+    """
+    start = time.monotonic()
+    t_first = None
+    for kind, t_mono, payload in read_log(log_file):
+        if t_first is None:
+            t_first = t_mono
+        wait = 0.0
+        if speed is not None:
+            wait = max(start + (t_mono - t_first) / speed - time.monotonic(), 0.0)
+        yield wait, kind, payload
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="gps-log")
+    parser.add_argument("log_file", type=str, help="A GPS log recorded by the app.")
+    args = parser.parse_args()
+
+    raw_bytes = 0
+    t_first = t_last = None
+    for kind, t_mono, payload in read_log(args.log_file):
+        t_first = t_mono if t_first is None else t_first
+        t_last = t_mono
+        if kind == RAW:
+            raw_bytes += len(payload)
+    fixes = read_fixes(args.log_file)
+
+    duration = t_last - t_first if t_first is not None else 0.0
+    print(f"{args.log_file}: {os.path.getsize(args.log_file)} bytes, {duration:.1f} s")
+    print(f"  raw receiver bytes: {raw_bytes}")
+    print(f"  fixes: {len(fixes)}" + (f", {len(fixes) / duration:.1f} Hz" if duration > 0 else ""))
@@ -0,0 +1,169 @@
+"""Compiled binary prescription map format.
+
+A prescription GeoJSON is compiled once into a ``.rsp`` file holding flat arrays that are memory-mapped read-only
+by the app, the GPS simulator and the matcher, so loading a map does not parse JSON nor create a Python dict per
+target.
+
+Layout (little-endian), every section aligned to 64 bytes:
+
+    header          magic "RSPM", version, number of sections, number of targets N, frame origin lat/lon
+    section table   (offset, size) in bytes of each section below
+    POINTS          float64 (N, 2) target (lon, lat)
+    CONDITIONS      uint16 (N,) code of each target in the condition table
+    NAME_OFFSETS    uint64 (N + 1,) start of each name in NAMES
+    NAMES           utf-8 names, concatenated
+    CONDITION_TABLE utf-8 JSON list of the interned condition strings
+    XY              float64 (N, 2) target (east, north) in the field-local metric frame
+
+The KD-tree is rebuilt over the mapped XY section on load, so the file does not depend on the installed scipy.
+Files of another format version are compiled again from their GeoJSON by ``load_prescription``.
+"""
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+from robo_spray.auto_spray import load_geojson
+from robo_spray.auto_spray import LocalFrame
+from robo_spray.auto_spray import SprayIndex
+from scipy.spatial import KDTree
+
+MAGIC = b"RSPM"
+VERSION = 2
+EXTENSION = ".rsp"
+ALIGNMENT = 64
+
+HEADER_FORMAT = "<4sHHQdd"
+SECTION_FORMAT = "<QQ"
+(POINTS, CONDITIONS, NAME_OFFSETS, NAMES, CONDITION_TABLE, XY) = range(6)
+NUM_SECTIONS = 6
+
+
+class StringTable:
+    """Read-only sequence of strings stored as concatenated utf-8 bytes and offsets."""
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes().decode("utf-8")
+
+
+def compile_prescription(geojson_file: str, output_file: str = None) -> str:
+    """Compiles a prescription GeoJSON into the binary prescription format.
+
+    Args:
+        geojson_file: The GeoJSON FeatureCollection of point targets.
+        output_file: Path of the compiled map, ``geojson_file`` with the ``.rsp`` extension if not given.
+
+    Returns:
+        The path of the compiled map.
+    """
+    if output_file is None:
+        output_file = os.path.splitext(geojson_file)[0] + EXTENSION
+
+    write_prescription(SprayIndex.from_geojson(load_geojson(geojson_file)), output_file)
+    return output_file
+
+
+def write_prescription(index: SprayIndex, output_file: str) -> None:
+    """Writes a prescription index in the binary prescription format."""
+    encoded_names = [name.encode("utf-8") for name in index.names]
+    name_offsets = np.zeros(len(encoded_names) + 1, dtype=np.uint64)
+    np.cumsum([len(name) for name in encoded_names], out=name_offsets[1:])
+
+    sections = [None] * NUM_SECTIONS
+    sections[POINTS] = np.ascontiguousarray(index.points, dtype="<f8").tobytes()
+    sections[CONDITIONS] = np.asarray(index.condition_codes, dtype="<u2").tobytes()
+    sections[NAME_OFFSETS] = name_offsets.astype("<u8").tobytes()
+    sections[NAMES] = b"".join(encoded_names)
+    sections[CONDITION_TABLE] = json.dumps(list(index.condition_table)).encode("utf-8")
+    sections[XY] = np.ascontiguousarray(index.xy, dtype="<f8").tobytes()
+
+    header = struct.pack(
+        HEADER_FORMAT, MAGIC, VERSION, NUM_SECTIONS, len(index), index.frame.origin_lat, index.frame.origin_lon
+    )
+    offset = _align(len(header) + NUM_SECTIONS * struct.calcsize(SECTION_FORMAT))
+    table = b""
+    for section in sections:
+        table += struct.pack(SECTION_FORMAT, offset, len(section))
+        offset = _align(offset + len(section))
+
+    # Readers may have the previous version mapped, replace the file atomically
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "wb") as file:
+        file.write(header + table)
+        for section in sections:
+            file.write(b"\0" * (_align(file.tell()) - file.tell()))
+            file.write(section)
+    os.replace(tmp_file, output_file)
+
+
+def open_prescription(prescription_file: str) -> SprayIndex:
+    """Memory-maps a compiled prescription map read-only into a SprayIndex."""
+    buffer = np.memmap(prescription_file, dtype=np.uint8, mode="r")
+    magic, version, num_sections, count, origin_lat, origin_lon = struct.unpack_from(HEADER_FORMAT, buffer, 0)
+    if magic != MAGIC or version != VERSION or num_sections != NUM_SECTIONS:
+        raise ValueError(f"{prescription_file} is not a version {VERSION} prescription map")
+
+    sections = []
+    for i in range(num_sections):
+        offset, size = struct.unpack_from(
+            SECTION_FORMAT, buffer, struct.calcsize(HEADER_FORMAT) + i * struct.calcsize(SECTION_FORMAT)
+        )
+        sections.append(buffer[offset:offset + size])
+
+    points = sections[POINTS].view("<f8").reshape(count, 2)
+    condition_codes = sections[CONDITIONS].view("<u2")
+    names = StringTable(sections[NAME_OFFSETS].view("<u8"), sections[NAMES])
+    condition_table = json.loads(sections[CONDITION_TABLE].tobytes().decode("utf-8"))
+    # Built over the mapped coordinates, only the tree nodes are allocated
+    kdtree = KDTree(sections[XY].view("<f8").reshape(count, 2), copy_data=False)
+
+    return SprayIndex(
+        points,
+        names,
+        condition_codes,
+        condition_table,
+        frame=LocalFrame(origin_lat, origin_lon),
+        kdtree=kdtree,
+    )
+
+
+def load_prescription(prescription_file: str) -> SprayIndex:
+    """Loads a prescription map, compiling a GeoJSON map first if its compiled file is missing, outdated or of
+    another format version."""
+    if os.path.splitext(prescription_file)[1] == EXTENSION:
+        return open_prescription(prescription_file)
+
+    compiled_file = os.path.splitext(prescription_file)[0] + EXTENSION
+    if not os.path.exists(compiled_file) or os.stat(compiled_file).st_mtime_ns < os.stat(
+        prescription_file
+    ).st_mtime_ns:
+        compile_prescription(prescription_file, compiled_file)
+        return open_prescription(compiled_file)
+
+    try:
+        return open_prescription(compiled_file)
+    except ValueError:
+        compile_prescription(prescription_file, compiled_file)
+        return open_prescription(compiled_file)
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="compile-prescription")
+    parser.add_argument("geojson_file", type=str, help="The prescription GeoJSON to compile.")
+    parser.add_argument("--output", type=str, default=None, help="Path of the compiled map.")
+    args = parser.parse_args()
+
+    output_file = compile_prescription(args.geojson_file, args.output)
+    print(f"Compiled {len(open_prescription(output_file))} targets to {output_file}")
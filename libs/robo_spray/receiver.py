@@ -0,0 +1,198 @@
+"""u-blox receiver configuration.
+
+Configures the receiver for the spray pipeline: UBX-only output with only NAV-PVT enabled, at the fastest
+navigation rate the receiver accepts, over a link fast enough to carry it. Every command is verified with its
+UBX-ACK, rates the receiver NAKs fall back to the next slower one.
+"""
+import struct
+import time
+
+from robo_spray import ubx
+
+# CFG-PRT port identifiers
+PORT_UART1 = 1
+PORT_USB = 3
+
+# CFG-PRT protocol masks
+PROTO_UBX = 0x01
+PROTO_NMEA = 0x02
+
+# CFG-PRT UART mode: 8 data bits, no parity, 1 stop bit
+UART_MODE_8N1 = 0x08D0
+
+# Navigation periods tried in order, 25, 20, 10 and 5 Hz
+MEAS_RATES_MS = (40, 50, 100, 200)
+BAUDRATES = (38400, 57600, 115200, 230400, 460800)
+
+# Default NMEA sentences and NAV messages some receivers ship enabled, superseded by NAV-PVT
+NMEA_CLS = 0xF0
+DISABLED_MESSAGES = (
+    (NMEA_CLS, 0x00),  # GGA
+    (NMEA_CLS, 0x01),  # GLL
+    (NMEA_CLS, 0x02),  # GSA
+    (NMEA_CLS, 0x03),  # GSV
+    (NMEA_CLS, 0x04),  # RMC
+    (NMEA_CLS, 0x05),  # VTG
+    (ubx.NAV_CLS, 0x02),  # NAV-POSLLH
+    (ubx.NAV_CLS, 0x03),  # NAV-STATUS
+    (ubx.NAV_CLS, 0x06),  # NAV-SOL
+    (ubx.NAV_CLS, 0x12),  # NAV-VELNED
+    (ubx.NAV_CLS, 0x21),  # NAV-TIMEUTC
+)
+
+# NAV-PVT frame on the wire, 10 bits per byte on an 8N1 link
+NAV_PVT_FRAME_BITS = (ubx.HEADER_SIZE + ubx.NAV_PVT_FORMAT.size + ubx.CHECKSUM_SIZE) * 10
+# Fraction of the link bandwidth NAV-PVT may use, the rest is left for ACKs and jitter
+LINK_UTILIZATION = 0.5
+
+
+class ReceiverConfig:
+    """Configuration applied to the receiver."""
+
+    def __init__(self, meas_rate_ms: int, baudrate: int) -> None:
+        self.meas_rate_ms = meas_rate_ms
+        self.baudrate = baudrate
+
+    @property
+    def rate_hz(self) -> float:
+        return 1000.0 / self.meas_rate_ms
+
+    def __repr__(self) -> str:
+        return f"ReceiverConfig(rate_hz={self.rate_hz:g}, baudrate={self.baudrate})"
+
+
+def required_baudrate(meas_rate_ms: int) -> int:
+    """Returns the slowest standard baud rate carrying NAV-PVT every ``meas_rate_ms`` within LINK_UTILIZATION."""
+    bits_per_second = NAV_PVT_FRAME_BITS * 1000.0 / meas_rate_ms
+    for baudrate in BAUDRATES:
+        if bits_per_second <= baudrate * LINK_UTILIZATION:
+            return baudrate
+    return BAUDRATES[-1]
+
+
+def send_command(port, parser: ubx.UbxParser, msg_cls: int, msg_id: int, payload: bytes, timeout: float = 1.0):
+    """Sends a CFG command and waits for its acknowledgment.
+
+    Frames received meanwhile are discarded.
+
+    Returns:
+        True if the receiver acknowledged the command, False if it rejected it, None on timeout.
+    """
+    port.write(ubx.build_frame(msg_cls, msg_id, payload))
+    port.flush()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for ack_cls, ack_id, ack_payload in parser.feed(port.read(port.in_waiting or 1)):
+            if ack_cls == ubx.ACK_CLS and ack_payload[:2] == bytes((msg_cls, msg_id)):
+                return ack_id == ubx.ACK_ACK
+    return None
+
+
+def poll(port, parser: ubx.UbxParser, msg_cls: int, msg_id: int, payload: bytes = b"", timeout: float = 1.0):
+    """Polls a message and returns its payload, or None on timeout."""
+    port.write(ubx.build_frame(msg_cls, msg_id, payload))
+    port.flush()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for frame_cls, frame_id, frame_payload in parser.feed(port.read(port.in_waiting or 1)):
+            if (frame_cls, frame_id) == (msg_cls, msg_id):
+                return frame_payload
+    return None
+
+
+def set_port(port, parser: ubx.UbxParser, port_id: int, baudrate: int, timeout: float = 1.0) -> bool:
+    """Restricts the receiver port to UBX in and out, switching a UART to ``baudrate``.
+
+    The receiver changes its baud rate right after the command, its ACK may be lost, so a baud rate change is
+    verified by polling CFG-RATE at the new rate instead. The host port is restored if the receiver does not answer.
+
+    Returns:
+        True if the receiver is configured and answers at ``baudrate``.
+    """
+    uart = port_id != PORT_USB
+    payload = struct.pack(
+        "<BBHIIHHHH",
+        port_id,
+        0,
+        0,
+        UART_MODE_8N1 if uart else 0,
+        baudrate if uart else 0,
+        PROTO_UBX,
+        PROTO_UBX,
+        0,
+        0,
+    )
+    if not uart or baudrate == port.baudrate:
+        return bool(send_command(port, parser, ubx.CFG_CLS, ubx.CFG_PRT, payload, timeout))
+
+    previous_baudrate = port.baudrate
+    port.write(ubx.build_frame(ubx.CFG_CLS, ubx.CFG_PRT, payload))
+    port.flush()
+    # Let the receiver switch before talking at the new rate
+    time.sleep(0.1)
+    port.baudrate = baudrate
+    port.reset_input_buffer()
+    parser.buffer.clear()
+    if poll(port, parser, ubx.CFG_CLS, ubx.CFG_RATE, timeout=timeout) is not None:
+        return True
+    port.baudrate = previous_baudrate
+    port.reset_input_buffer()
+    parser.buffer.clear()
+    return False
+
+
+def configure_receiver(
+    port,
+    meas_rates_ms=MEAS_RATES_MS,
+    port_id: int = PORT_USB,
+    timeout: float = 1.0,
+) -> ReceiverConfig:
+    """Configures the receiver to output only NAV-PVT, at the fastest accepted rate.
+
+    Args:
+        port: Open serial port of the receiver.
+        meas_rates_ms: Navigation periods in milliseconds to try, fastest first. A period the receiver rejects, or
+            that the link cannot carry, falls back to the next one.
+        port_id: Receiver port the host is connected to, PORT_USB or a UART. The baud rate of a UART is raised to
+            the ``required_baudrate`` of the fastest period.
+        timeout: Time in seconds to wait for each acknowledgment.
+
+    Returns:
+        The applied configuration.
+
+    Raises:
+        IOError: If the receiver does not acknowledge the configuration or rejects every rate.
+    """
+    parser = ubx.UbxParser()
+
+    baudrate = port.baudrate
+    if port_id != PORT_USB:
+        baudrate = max(baudrate, required_baudrate(min(meas_rates_ms)))
+    if not set_port(port, parser, port_id, baudrate, timeout):
+        if baudrate == port.baudrate:
+            raise IOError("The receiver did not acknowledge its port configuration")
+        print(f"The receiver did not switch to {baudrate} baud, keeping {port.baudrate} baud")
+        baudrate = port.baudrate
+        set_port(port, parser, port_id, baudrate, timeout)
+
+    for msg_cls, msg_id in DISABLED_MESSAGES:
+        # Messages the receiver does not support are NAK'ed, they are off anyway
+        send_command(port, parser, ubx.CFG_CLS, ubx.CFG_MSG, struct.pack("<BBB", msg_cls, msg_id, 0), timeout)
+
+    meas_rate_ms = None
+    for candidate in meas_rates_ms:
+        if port_id != PORT_USB and required_baudrate(candidate) > baudrate:
+            continue
+        # One navigation solution per measurement, aligned to UTC
+        if send_command(port, parser, ubx.CFG_CLS, ubx.CFG_RATE, struct.pack("<HHH", candidate, 1, 0), timeout):
+            meas_rate_ms = candidate
+            break
+    if meas_rate_ms is None:
+        raise IOError(f"The receiver rejected every navigation period of {list(meas_rates_ms)} ms")
+
+    # NAV-PVT on every navigation solution
+    nav_pvt = struct.pack("<BBB", ubx.NAV_CLS, ubx.NAV_PVT, 1)
+    if not send_command(port, parser, ubx.CFG_CLS, ubx.CFG_MSG, nav_pvt, timeout):
+        raise IOError("The receiver did not enable NAV-PVT")
+
+    return ReceiverConfig(meas_rate_ms, baudrate)
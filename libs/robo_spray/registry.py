@@ -0,0 +1,132 @@
+"""Registry of the targets already sprayed, persisted in an append-only journal.
+
+Targets are identified by their ordinal in the prescription index. The registry is a bitmap, so lookups and updates
+are O(1) and take one bit per target. Every newly sprayed ordinal is appended to a journal file, which is replayed
+when the registry is opened again, so a restart resumes without spraying the same target twice. The journal header
+holds the fingerprint of the map, a journal of another map is discarded.
+"""
+import os
+import time
+
+import numpy as np
+
+MAGIC = b"RSPJ"
+HEADER_SIZE = 24  # magic, reserved, uint64 number of targets, uint64 map fingerprint
+RECORD_DTYPE = np.dtype("<u4")  # uint32 ordinals
+
+
+class SprayedRegistry:
+    """Bitmap of the sprayed targets of a prescription map, journaled to disk.
+
+    ``mark`` only updates the bitmap, so it can be called on the spray path. Appends are batched by
+    ``flush_if_due``, called once the spray command is sent: the journal is written and fsync'ed when
+    ``flush_every`` marks are pending or ``flush_period`` seconds have passed since the last flush, whichever comes
+    first. Only the marks of the last unflushed batch can be lost on a crash.
+
+    Args:
+        journal_file: Path of the journal, created if missing.
+        size: Number of targets of the map.
+        fingerprint: Fingerprint of the map, see TargetIndex.fingerprint. A journal written for a map of another size
+            or fingerprint is discarded.
+        flush_every: Number of marks batched before the journal is synced.
+        flush_period: Time in seconds after which pending marks are synced by ``flush_if_due``.
+    """
+
+    def __init__(
+        self, journal_file: str, size: int, fingerprint: int = 0, flush_every: int = 8, flush_period: float = 0.5
+    ) -> None:
+        if size > np.iinfo(RECORD_DTYPE).max:
+            raise ValueError(f"Maps of more than {np.iinfo(RECORD_DTYPE).max} targets are not supported")
+        self.journal_file = journal_file
+        self.size = size
+        self.fingerprint = fingerprint
+        self.flush_every = flush_every
+        self.flush_period = flush_period
+
+        self.bitmap = np.zeros((size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+        self.file = self._open_journal()
+
+    def _open_journal(self):
+        header = MAGIC + bytes(4) + self.size.to_bytes(8, "little") + self.fingerprint.to_bytes(8, "little")
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "rb") as file:
+                data = file.read()
+            if data[:HEADER_SIZE] == header:
+                # A crash can leave a partially written last record, drop it
+                record_size = RECORD_DTYPE.itemsize
+                valid_size = HEADER_SIZE + (len(data) - HEADER_SIZE) // record_size * record_size
+                ordinals = np.frombuffer(
+                    data, dtype=RECORD_DTYPE, offset=HEADER_SIZE, count=(valid_size - HEADER_SIZE) // record_size
+                )
+                self._set(ordinals[ordinals < self.size])
+                file = open(self.journal_file, "r+b")
+                file.truncate(valid_size)
+                file.seek(valid_size)
+                return file
+            print(f"Discarding sprayed journal {self.journal_file} of another map")
+
+        file = open(self.journal_file, "wb")
+        file.write(header)
+        file.flush()
+        os.fsync(file.fileno())
+        return file
+
+    def _set(self, ordinals: np.ndarray) -> None:
+        np.bitwise_or.at(self.bitmap, ordinals >> 3, (1 << (ordinals & 7)).astype(np.uint8))
+        self.count = int(np.unpackbits(self.bitmap).sum())
+
+    def __len__(self) -> int:
+        """Number of sprayed targets."""
+        return self.count
+
+    def __contains__(self, ordinal: int) -> bool:
+        return bool(self.bitmap[ordinal >> 3] & (1 << (ordinal & 7)))
+
+    def mark(self, ordinal: int) -> bool:
+        """Marks the target ``ordinal`` as sprayed, journaled by the next ``flush_if_due`` or ``flush``.
+
+        Returns:
+            True if the target was not sprayed before.
+        """
+        byte, bit = ordinal >> 3, 1 << (ordinal & 7)
+        if self.bitmap[byte] & bit:
+            return False
+        self.bitmap[byte] |= bit
+        self.count += 1
+
+        self.pending.append(int(ordinal))
+        return True
+
+    def flush_if_due(self) -> None:
+        """Flushes the pending marks once ``flush_every`` are batched or ``flush_period`` has passed, call it
+        periodically outside of the spray path."""
+        if len(self.pending) >= self.flush_every or (
+            self.pending and time.monotonic() - self.last_flush >= self.flush_period
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Appends the pending marks to the journal and syncs it to disk."""
+        if self.pending:
+            self.file.write(np.array(self.pending, dtype=RECORD_DTYPE).tobytes())
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    def clear(self) -> None:
+        """Forgets every sprayed target, e.g. to spray the field again."""
+        self.pending = []
+        self.bitmap[:] = 0
+        self.count = 0
+        self.file.close()
+        os.remove(self.journal_file)
+        self.file = self._open_journal()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
@@ -0,0 +1,126 @@
+"""Shared-memory ring buffer of GPS fixes.
+
+The GPS process writes fixed-layout FIX_DTYPE records into a ring of shared memory and consumers in the app process
+read the latest fix, or the last N fixes, straight from it: no pickling, no lock round trip and no growth when the
+consumer stalls, old fixes are simply overwritten.
+
+There is a single writer. Each slot carries the sequence number of the fix it holds, which is cleared while the slot
+is being written, and the fix counter is only advanced once the slot is complete. A reader checks the sequence numbers
+of its copy and re-reads the counter after it, dropping the slot the writer may have been overwriting meanwhile.
+
+The scheme relies on the writer's stores becoming visible to readers in program order (slot, then counter), there is
+no explicit fence. x86 guarantees it. On aarch64, e.g. the Amiga brain, plain stores may become visible out of order:
+the many interpreter instructions between the stores make it unlikely, but it is not guaranteed.
+"""
+import ctypes
+import multiprocessing
+import os
+
+import numpy as np
+from robo_spray.fix import FIX_DTYPE
+
+# Header: uint64 number of fixes written
+HEADER_SIZE = 64
+
+
+class FixRingBuffer:
+    """Ring of the last ``capacity`` GPS fixes in shared memory.
+
+    Create it before starting the writer process. Besides the shared memory, a pipe wakes consumers waiting on
+    ``fileno()``, e.g. with ``loop.add_reader``. Without ``notify`` the pipe is not written, for a writer in the
+    consumer process that wakes its consumers itself.
+    """
+
+    def __init__(self, capacity: int = 64, notify: bool = True) -> None:
+        self.capacity = capacity
+        self.notify = notify
+        self.shared = multiprocessing.RawArray(ctypes.c_uint8, HEADER_SIZE + capacity * FIX_DTYPE.itemsize)
+        self.notify_reader, self.notify_writer = multiprocessing.Pipe(duplex=False)
+        # Notifications never block the writer on a stalled consumer
+        os.set_blocking(self.notify_reader.fileno(), False)
+        os.set_blocking(self.notify_writer.fileno(), False)
+        self._map()
+
+    def _map(self) -> None:
+        self.counter = np.frombuffer(self.shared, dtype="<u8", count=1)
+        self.records = np.frombuffer(
+            self.shared, dtype=FIX_DTYPE, count=self.capacity, offset=HEADER_SIZE
+        ).view(np.recarray)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["counter"], state["records"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def __len__(self) -> int:
+        """Number of fixes written so far."""
+        return int(self.counter[0])
+
+    def append(self, **fields) -> None:
+        """Writes a fix from its FIX_DTYPE field values, see FIX_DTYPE. Only called by the writer process."""
+        seq = int(self.counter[0]) + 1
+        record = self.records[(seq - 1) % self.capacity]
+        record.seq = 0
+        for name, value in fields.items():
+            record[name] = value
+        record.seq = seq
+        self.counter[0] = seq
+
+        if not self.notify:
+            return
+        try:
+            os.write(self.notify_writer.fileno(), b"\0")
+        except BlockingIOError:
+            # Consumers have not drained the pipe, they will read the latest fix anyway
+            pass
+
+    def append_record(self, fix) -> None:
+        """Writes a fix from a FIX_DTYPE record, its ``seq`` is ignored. Only called by the writer process."""
+        self.append(**{name: fix[name] for name in FIX_DTYPE.names if name != "seq"})
+
+    def latest(self):
+        """Returns a copy of the latest fix as a numpy record, or None if no fix was written yet."""
+        while True:
+            seq = int(self.counter[0])
+            if seq == 0:
+                return None
+            index = (seq - 1) % self.capacity
+            record = self.records[index:index + 1].copy()[0]
+            # The slot being written is the one after the counter, it must not be the copied one
+            if record.seq == seq and int(self.counter[0]) + 1 - seq < self.capacity:
+                return record
+
+    def last(self, n: int) -> np.recarray:
+        """Returns a copy of up to the last ``n`` fixes, oldest first.
+
+        At most ``capacity - 1`` fixes are returned: the oldest slot is the next one the writer overwrites.
+        """
+        while True:
+            seq = int(self.counter[0])
+            n = min(n, seq, self.capacity - 1)
+            indices = np.arange(seq - n, seq) % self.capacity
+            records = self.records[indices]
+            if not np.array_equal(records.seq, np.arange(seq - n + 1, seq + 1)):
+                continue
+            # Fixes written during the copy may have started overwriting its oldest slots, seq intact or not
+            overwritten = int(self.counter[0]) + 1 - self.capacity
+            if overwritten < seq - n + 1:
+                return records
+            if overwritten < seq:
+                return records[records.seq > overwritten]
+
+    def fileno(self) -> int:
+        """File descriptor readable when new fixes were written."""
+        return self.notify_reader.fileno()
+
+    def drain(self) -> None:
+        """Clears the pending notifications, call it before reading the latest fix."""
+        try:
+            while os.read(self.notify_reader.fileno(), 4096):
+                pass
+        except BlockingIOError:
+            pass
@@ -0,0 +1,92 @@
+"""Shared state of the farm-ng services the app talks to.
+
+A single ServiceStateWatcher task polls the state of a service client and caches it, so the tasks streaming from or
+to the service wait on state transitions instead of each querying the service before every message.
+"""
+import asyncio
+
+
+class Backoff:
+    """Exponentially growing delay between reconnection attempts.
+
+    Args:
+        initial: First delay in seconds.
+        maximum: Longest delay in seconds.
+        factor: Growth of the delay after each attempt.
+    """
+
+    def __init__(self, initial: float = 0.1, maximum: float = 5.0, factor: float = 2.0) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.delay = initial
+
+    def next(self) -> float:
+        """Returns the delay before the next attempt and grows it."""
+        delay = self.delay
+        self.delay = min(self.delay * self.factor, self.maximum)
+        return delay
+
+    async def sleep(self) -> None:
+        await asyncio.sleep(self.next())
+
+    def reset(self) -> None:
+        """Call it once connected."""
+        self.delay = self.initial
+
+
+class ServiceStateWatcher:
+    """Caches the state of a service client, refreshed on a timer and on demand.
+
+    ``state`` is the ``value`` of the last ``get_state()`` reply, or None while the service is unreachable, in which
+    case it is retried with an exponential backoff.
+
+    Args:
+        client: A farm-ng service client, e.g. a CanbusClient.
+        period: Time in seconds between two state refreshes of a reachable service.
+        backoff: Delays between the attempts to reach an unreachable service.
+    """
+
+    def __init__(self, client, period: float = 1.0, backoff: Backoff = None) -> None:
+        self.client = client
+        self.period = period
+        self.backoff = backoff or Backoff(maximum=period)
+        self.state = None
+        self._changed = asyncio.Event()
+        self._refresh = asyncio.Event()
+
+    async def run(self) -> None:
+        """Watches the service state forever, run it as a task."""
+        while True:
+            try:
+                state = (await self.client.get_state()).value
+                self.backoff.reset()
+                delay = self.period
+            except Exception as e:
+                print(e)
+                state = None
+                delay = self.backoff.next()
+            self._set(state)
+
+            self._refresh.clear()
+            try:
+                await asyncio.wait_for(self._refresh.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _set(self, state) -> None:
+        if state != self.state:
+            self.state = state
+            # Wake every waiter, the next ones wait on a new event
+            changed, self._changed = self._changed, asyncio.Event()
+            changed.set()
+
+    def refresh(self) -> None:
+        """Requests an immediate refresh, e.g. after a stream error."""
+        self._refresh.set()
+
+    async def wait_for(self, states) -> int:
+        """Waits until the service is in one of ``states`` and returns it."""
+        while self.state not in states:
+            await self._changed.wait()
+        return self.state
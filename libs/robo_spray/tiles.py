@@ -0,0 +1,238 @@
+"""Tile-partitioned prescription index.
+
+Targets are bucketed into fixed-size square cells of the field-local metric frame and stored on disk, one file per
+tile. TiledSprayIndex keeps only an LRU working set of tiles around the robot in memory, so memory stays bounded
+regardless of the field size.
+
+Ordinals of a tiled map follow the tile order: every tile holds a contiguous range of ordinals, which lets
+``name``/``condition`` find the tile of any ordinal with a binary search.
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+from robo_spray.auto_spray import LocalFrame
+from robo_spray.auto_spray import points_fingerprint
+from robo_spray.auto_spray import SprayIndex
+from robo_spray.auto_spray import TargetIndex
+from scipy.spatial import KDTree
+
+MANIFEST = "manifest.json"
+
+
+class Tile:
+    """Targets of one cell, with its own KD-tree."""
+
+    def __init__(self, key, tile_size: float, start: int, points, condition_codes, names, frame: LocalFrame) -> None:
+        # South-west corner of the cell in meters
+        self.x_min = key[0] * tile_size
+        self.y_min = key[1] * tile_size
+        self.start = start
+        self.points = points
+        self.condition_codes = condition_codes
+        self.names = names
+        self.xy = np.column_stack(frame.to_enu(points[:, 1], points[:, 0]))
+        self.kdtree = KDTree(self.xy)
+
+
+def build_tiles(spray_index: SprayIndex, tile_dir: str, tile_size: float = 25.0) -> None:
+    """Partitions a prescription map into tiles of ``tile_size`` meters stored in ``tile_dir``."""
+    os.makedirs(tile_dir, exist_ok=True)
+
+    cells = np.floor(spray_index.xy / tile_size).astype(np.int64)
+    # Sort targets by cell, each cell becomes a contiguous range of ordinals
+    order = np.lexsort((cells[:, 1], cells[:, 0]))
+    cells = cells[order]
+    boundaries = np.flatnonzero(np.any(np.diff(cells, axis=0) != 0, axis=1)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(order)]))
+
+    tiles = []
+    for start, end in zip(starts, ends):
+        ix, iy = (int(v) for v in cells[start])
+        indices = order[start:end]
+        np.savez(
+            os.path.join(tile_dir, _tile_file(ix, iy)),
+            points=np.asarray(spray_index.points)[indices],
+            condition_codes=np.asarray(spray_index.condition_codes)[indices],
+            names=np.array([spray_index.name(i) for i in indices], dtype=str),
+        )
+        tiles.append([ix, iy, int(start), int(end - start)])
+
+    manifest = {
+        "tile_size": tile_size,
+        "origin_lat": spray_index.frame.origin_lat,
+        "origin_lon": spray_index.frame.origin_lon,
+        "count": len(order),
+        "condition_table": list(spray_index.condition_table),
+        # Of the points in tile order, the ordinals of the tiled map
+        "fingerprint": points_fingerprint([np.asarray(spray_index.points)[order]]),
+        "tiles": tiles,
+    }
+    with open(os.path.join(tile_dir, MANIFEST), "w") as file:
+        json.dump(manifest, file)
+
+
+class TiledSprayIndex(TargetIndex):
+    """Prescription index loading only the tiles near the queried positions.
+
+    Args:
+        tile_dir: Directory written by ``build_tiles``.
+        max_tiles: Number of tiles kept in memory, least recently used tiles are evicted first.
+    """
+
+    def __init__(self, tile_dir: str, max_tiles: int = 16) -> None:
+        with open(os.path.join(tile_dir, MANIFEST)) as file:
+            manifest = json.load(file)
+
+        self.tile_dir = tile_dir
+        self.max_tiles = max_tiles
+        self.tile_size = manifest["tile_size"]
+        self.frame = LocalFrame(manifest["origin_lat"], manifest["origin_lon"])
+        self.count = manifest["count"]
+        self.condition_table = manifest["condition_table"]
+        self._fingerprint = manifest.get("fingerprint")
+
+        # (ix, iy) -> (start, count), and tile starts in ordinal order for reverse lookups
+        self.tile_ranges = {(ix, iy): (start, count) for ix, iy, start, count in manifest["tiles"]}
+        self.tile_starts = [start for _, _, start, _ in manifest["tiles"]]
+        self.tile_keys = [(ix, iy) for ix, iy, _, _ in manifest["tiles"]]
+
+        self.tiles: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def fingerprint(self) -> int:
+        """Returns a 64-bit hash of the target positions in ordinal order, see SprayIndex.fingerprint."""
+        if self._fingerprint is None:
+            # Tiles built before the fingerprint was recorded in the manifest, hash them one at a time
+            self._fingerprint = points_fingerprint(self._tile_points(key) for key in self.tile_keys)
+        return self._fingerprint
+
+    def _tile_points(self, key):
+        """Reads the points of a tile without loading it in the working set."""
+        with np.load(os.path.join(self.tile_dir, _tile_file(*key))) as data:
+            return data["points"]
+
+    def tile(self, key):
+        """Returns the tile of cell ``key``, loading it and evicting the least recently used tile if needed."""
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+        if key not in self.tile_ranges:
+            return None
+
+        with np.load(os.path.join(self.tile_dir, _tile_file(*key))) as data:
+            start = self.tile_ranges[key][0]
+            tile = Tile(
+                key, self.tile_size, start, data["points"], data["condition_codes"], data["names"], self.frame
+            )
+        self.tiles[key] = tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def tiles_around(self, position, radius: float):
+        """Yields the tiles overlapping the square of half side ``radius`` around ``position`` (east, north)."""
+        east, north = float(position[0]), float(position[1])
+        x_min, x_max = math.floor((east - radius) / self.tile_size), math.floor((east + radius) / self.tile_size)
+        y_min, y_max = math.floor((north - radius) / self.tile_size), math.floor((north + radius) / self.tile_size)
+        if (x_max - x_min + 1) * (y_max - y_min + 1) > self.max_tiles:
+            raise ValueError(f"A radius of {radius} m needs more than max_tiles={self.max_tiles} tiles")
+        # Tile under the position first
+        home = (math.floor(east / self.tile_size), math.floor(north / self.tile_size))
+        keys = [(ix, iy) for ix in range(x_min, x_max + 1) for iy in range(y_min, y_max + 1)]
+        keys.sort(key=lambda key: key != home)
+        for key in keys:
+            tile = self.tile(key)
+            if tile is not None:
+                yield tile
+
+    def nearest(self, lat: float, lon: float, radius: float = None):
+        """Finds the closest target to a GPS position, see SprayIndex.nearest.
+
+        ``radius`` must be finite since only the tiles within it are searched, it defaults to the tile size.
+        """
+        if radius is None:
+            radius = self.tile_size
+        position = self.frame.to_enu(lat, lon)
+        east, north = float(position[0]), float(position[1])
+        best_index, best_dist = None, radius
+        for tile in self.tiles_around(position, radius):
+            # Skip tiles farther than the best match so far, most queries only search the tile under the robot
+            dx = max(tile.x_min - east, 0.0, east - tile.x_min - self.tile_size)
+            dy = max(tile.y_min - north, 0.0, north - tile.y_min - self.tile_size)
+            if dx * dx + dy * dy >= best_dist * best_dist:
+                continue
+            dist, index = tile.kdtree.query(position, k=1, distance_upper_bound=best_dist)
+            if index < len(tile.points):
+                best_index, best_dist = tile.start + int(index), float(dist)
+        if best_index is None:
+            return None, np.inf
+        return best_index, best_dist
+
+    def within(self, position, radius: float):
+        """Returns (ordinals, xy) of the targets closer than ``radius`` meters to ``position`` (east, north)."""
+        indices, xy = [], []
+        for tile in self.tiles_around(position, radius):
+            local = np.asarray(tile.kdtree.query_ball_point(position, radius), dtype=np.intp)
+            indices.append(tile.start + local)
+            xy.append(tile.xy[local])
+        if not indices:
+            return np.empty(0, dtype=np.intp), np.empty((0, 2))
+        return np.concatenate(indices), np.concatenate(xy)
+
+    def _locate(self, index: int):
+        key = self.tile_keys[bisect.bisect_right(self.tile_starts, index) - 1]
+        tile = self.tile(key)
+        return tile, index - tile.start
+
+    def name(self, index: int) -> str:
+        tile, local = self._locate(index)
+        return str(tile.names[local])
+
+    def condition(self, index: int) -> str:
+        tile, local = self._locate(index)
+        return self.condition_table[tile.condition_codes[local]]
+
+    def feature(self, index: int) -> dict:
+        tile, local = self._locate(index)
+        return {
+            "type": "Feature",
+            "properties": {"name": str(tile.names[local]), "condition": self.condition(index)},
+            "geometry": {"type": "Point", "coordinates": [float(v) for v in tile.points[local]]},
+        }
+
+    def to_geojson(self) -> dict:
+        """Returns the targets of the tiles currently loaded as a GeoJSON FeatureCollection.
+
+        Targets of the tiles not queried yet are missing, e.g. no marker is drawn from a freshly opened index.
+        """
+        features = [
+            self.feature(tile.start + local) for tile in list(self.tiles.values()) for local in range(len(tile.points))
+        ]
+        return {"type": "FeatureCollection", "features": features}
+
+
+def _tile_file(ix: int, iy: int) -> str:
+    return f"tile_{ix}_{iy}.npz"
+
+
+if __name__ == "__main__":
+    from robo_spray.prescription import load_prescription
+
+    parser = argparse.ArgumentParser(prog="build-tiles")
+    parser.add_argument("prescription_file", type=str, help="The prescription GeoJSON or compiled .rsp map.")
+    parser.add_argument("tile_dir", type=str, help="Output directory of the tiles.")
+    parser.add_argument("--tile-size", type=float, default=25.0, help="Side of the tiles in meters.")
+    args = parser.parse_args()
+
+    spray_index = load_prescription(args.prescription_file)
+    build_tiles(spray_index, args.tile_dir, args.tile_size)
+    print(f"Wrote {len(spray_index)} targets to {args.tile_dir}")
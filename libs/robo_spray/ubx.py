@@ -0,0 +1,132 @@
+"""Incremental UBX protocol framing and NAV-PVT decoding.
+
+UbxParser consumes the raw byte stream of a u-blox receiver in chunks of any size, resynchronizes on the UBX sync
+characters, which also skips interleaved NMEA sentences, and validates the checksum of every frame. NAV-PVT
+payloads decode straight into FIX_DTYPE records, so the receiver's periodic output can be consumed without poll
+requests.
+"""
+import struct
+import time
+
+import numpy as np
+from robo_spray.fix import FIX_DTYPE
+
+SYNC = b"\xb5\x62"
+# sync, class, id, length
+HEADER_SIZE = 6
+CHECKSUM_SIZE = 2
+MAX_PAYLOAD_SIZE = 4096
+
+NAV_CLS = 0x01
+NAV_PVT = 0x07
+ACK_CLS = 0x05
+ACK_NAK = 0x00
+ACK_ACK = 0x01
+CFG_CLS = 0x06
+CFG_PRT = 0x00
+CFG_MSG = 0x01
+CFG_RATE = 0x08
+
+NAV_PVT_FORMAT = struct.Struct("<IHBBBBBBIiBBBBiiiiIIiiiiiIIHB5xihH")
+
+
+def checksum(data: bytes) -> bytes:
+    """8-bit Fletcher checksum of the class, id, length and payload of a frame."""
+    ck_a = ck_b = 0
+    for byte in data:
+        ck_a = (ck_a + byte) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return bytes((ck_a, ck_b))
+
+
+def build_frame(msg_cls: int, msg_id: int, payload: bytes = b"") -> bytes:
+    """Returns the UBX frame of a message, a poll request if ``payload`` is empty."""
+    body = struct.pack("<BBH", msg_cls, msg_id, len(payload)) + payload
+    return SYNC + body + checksum(body)
+
+
+class UbxParser:
+    """Splits a raw receiver byte stream into checksum-validated UBX frames."""
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.checksum_errors = 0
+
+    def feed(self, data: bytes):
+        """Appends received bytes and returns the list of complete (class, id, payload) frames."""
+        self.buffer += data
+        frames = []
+        buffer = self.buffer
+        start = 0
+        while True:
+            start = buffer.find(SYNC, start)
+            if start < 0:
+                # Keep a trailing first sync character
+                start = len(buffer) - 1 if buffer.endswith(SYNC[:1]) else len(buffer)
+                break
+            if len(buffer) - start < HEADER_SIZE:
+                break
+            msg_cls, msg_id, length = struct.unpack_from("<BBH", buffer, start + 2)
+            if length > MAX_PAYLOAD_SIZE:
+                # Not a real frame, resync after this sync pattern
+                start += 1
+                continue
+            end = start + HEADER_SIZE + length + CHECKSUM_SIZE
+            if len(buffer) < end:
+                break
+            if checksum(buffer[start + 2:end - CHECKSUM_SIZE]) != buffer[end - CHECKSUM_SIZE:end]:
+                self.checksum_errors += 1
+                start += 1
+                continue
+            frames.append((msg_cls, msg_id, bytes(buffer[start + HEADER_SIZE:end - CHECKSUM_SIZE])))
+            start = end
+
+        del buffer[:start]
+        return frames
+
+
+def decode_nav_pvt(payload: bytes, t_mono: float = None) -> np.record:
+    """Decodes a NAV-PVT payload into a FIX_DTYPE record, stamped with the receive time ``t_mono``."""
+    (
+        iTOW, year, month, day, hour, minute, sec, _valid, _tAcc, nano,
+        fixType, flags, _flags2, numSV, lon, lat, height, _hMSL, hAcc, vAcc,
+        velN, velE, velD, gSpeed, headMot, _sAcc, headAcc, _pDOP, _flags3, _headVeh, _magDec, _magAcc,
+    ) = NAV_PVT_FORMAT.unpack_from(payload)
+
+    fix = np.zeros(1, dtype=FIX_DTYPE).view(np.recarray)[0]
+    fix.t_mono = time.monotonic() if t_mono is None else t_mono
+    fix.iTOW = iTOW
+    fix.year = year
+    fix.month = month
+    fix.day = day
+    fix.hour = hour
+    fix["min"] = minute
+    fix.sec = sec
+    fix.nano = nano
+    fix.fixType = fixType
+    fix.fixFlags = flags
+    fix.numSV = numSV
+    fix.lon = lon * 1e-7
+    fix.lat = lat * 1e-7
+    fix.height = height * 1e-3
+    fix.hAcc = hAcc * 1e-3
+    fix.vAcc = vAcc * 1e-3
+    fix.velN = velN * 1e-3
+    fix.velE = velE * 1e-3
+    fix.velD = velD * 1e-3
+    fix.gSpeed = gSpeed * 1e-3
+    fix.headMot = headMot * 1e-5
+    fix.headAcc = headAcc * 1e-5
+    return fix
+
+
+def encode_nav_pvt(fix) -> bytes:
+    """Encodes a FIX_DTYPE record as a NAV-PVT payload, e.g. to record or simulate a receiver stream."""
+    return NAV_PVT_FORMAT.pack(
+        int(fix.iTOW), int(fix.year), int(fix.month), int(fix.day), int(fix.hour), int(fix["min"]), int(fix.sec),
+        0x07, 0, int(fix.nano), int(fix.fixType), int(fix.fixFlags), 0, int(fix.numSV),
+        round(fix.lon * 1e7), round(fix.lat * 1e7), round(fix.height * 1e3), round(fix.height * 1e3),
+        round(fix.hAcc * 1e3), round(fix.vAcc * 1e3),
+        round(fix.velN * 1e3), round(fix.velE * 1e3), round(fix.velD * 1e3), round(fix.gSpeed * 1e3),
+        round(fix.headMot * 1e5), 0, round(fix.headAcc * 1e5), 0, 0, 0, 0, 0,
+    )
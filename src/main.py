@@ -4,17 +4,15 @@ import asyncio
 import os
 from typing import List
 from typing import Optional
-import json
 import time
+from collections import deque
 
 # import farm_ng libs
 import grpc
 from farm_ng.canbus import canbus_pb2
 from farm_ng.canbus.canbus_client import CanbusClient
 from farm_ng.canbus.packet import AmigaControlState
-from farm_ng.canbus.packet import AmigaTpdo1
 from farm_ng.canbus.packet import make_amiga_rpdo1_proto
-from farm_ng.canbus.packet import parse_amiga_tpdo1_proto
 from farm_ng.oak import oak_pb2
 from farm_ng.oak.camera_client import OakCameraClient
 from farm_ng.service import service_pb2
@@ -45,9 +43,19 @@ from kivy.graphics import Color, Ellipse
 
 # import internal libs
 from robo_spray.gps import GPS
-from robo_spray.can import make_amiga_spray1_proto
+from robo_spray.fix import GpsFix
+from robo_spray.can import CanDecoder
+from robo_spray.can import get_amiga_spray1_request
+from robo_spray.can import make_amiga_spray_pulse_proto
+from robo_spray.can import SPRAY2_DUTY_STEPS
+from robo_spray.can import SprayTelemetry
 from robo_spray.map import draw_markers, draw_tracks, remove_markers
-from robo_spray.auto_spray import build_kd_tree, match_gps_position, calculate_utm_distance
+from robo_spray.auto_spray import load_spray_index
+from robo_spray.tiles import TiledSprayIndex
+from robo_spray.registry import SprayedRegistry
+from robo_spray.fusion import PoseFilter
+from robo_spray.service import Backoff
+from robo_spray.service import ServiceStateWatcher
 
 
 import os
@@ -56,7 +64,13 @@ this_path = os.path.dirname(__file__)
 class SprayApp(App):
     """Base class for the main Kivy app."""
 
-    def __init__(self,address:str, canbus_port: int) -> None:
+    def __init__(self,address:str, canbus_port: int, predictive_spray: bool = False, spray_latency: float = 0.4,
+                 tile_dir: Optional[str] = None, sprayed_journal: Optional[str] = None,
+                 new_pass: bool = False,
+                 gps_in_event_loop: bool = False, fuse_odometry: bool = True,
+                 gps_record: Optional[str] = None, gps_replay: Optional[str] = None,
+                 gps_replay_speed: Optional[float] = 1.0, can_heartbeat: float = 0.2,
+                 spray_pulses: bool = False) -> None:
         super().__init__()
 
         self.address = address
@@ -64,28 +78,89 @@ class SprayApp(App):
 
         self.async_tasks: List[asyncio.Task] = []
 
-        self.gps = GPS(simulation=False)
-        self.geo:any = None
+        # The GPS is read either by a separate process or directly in the app event loop
+        self.gps = GPS(simulation=False, use_process=not gps_in_event_loop,
+                       record_file=gps_record, replay_file=gps_replay, replay_speed=gps_replay_speed)
+        self.geo:Optional[GpsFix] = None
 
-        self.spray_activate = 0
+        # Set when spray_activate changes, wakes spray_generator
+        self.spray_changed = asyncio.Event()
+        self._spray_activate = 0
+        # Spray commands are sent on change and then every can_heartbeat seconds, every 20 ms if 0
+        self.can_heartbeat:float = can_heartbeat
         self.auto_spray_activate:bool = False
 
+        # Auto sprays sent as one pulse frame each, timed by the feather, instead of an activation
+        # held by the host
+        self.spray_pulses:bool = spray_pulses
+        self.spray_pulse_seq:int = 0
+        self.pending_pulses = deque()
+
         self.auto_spray_radious:float = 3.0
 
+        # Predictive trigger: project the position forward with the heading and speed
+        # and schedule the spray for the time of arrival over the target
+        self.predictive_spray:bool = predictive_spray
+        # System latency [s]: GPS fix age + CAN round trip + nozzle opening
+        self.spray_latency:float = spray_latency
+
         self.markers:List[MapMarker] = []
 
         self.spray_pos_id = ""
 
         self.spray_start_time = 0
-
-        with open(os.path.join(this_path,"assets/spray_position_points.json")) as file:
-            self.spary_pos = json.load(file)
-
-        with open(os.path.join(this_path,"assets/spray_position_all.json")) as file:
-            self.spary_track = json.load(file)
+        self.spray_stop_handle:Optional[asyncio.TimerHandle] = None
+        self.scheduled_sprays:List[asyncio.TimerHandle] = []
+        # Targets whose spray is scheduled, marked sprayed only once their spray starts
+        self.scheduled_targets = set()
+
+        # Prescription index is built once per loaded map and reused by auto_spray
+        if tile_dir is None:
+            self.spray_index = load_spray_index(os.path.join(this_path,"assets/spray_position_points.json"))
+        else:
+            # Large fields: only the tiles around the robot are kept in memory
+            self.spray_index = TiledSprayIndex(tile_dir)
+
+        # Targets already sprayed, journaled so that a session resumes after a restart or a crash.
+        # The journal of the same map is kept, a new pass over the field clears it explicitly
+        if sprayed_journal is None:
+            sprayed_journal = os.path.join(tile_dir or os.path.join(this_path,"assets"),"sprayed.journal")
+        self.sprayed = SprayedRegistry(sprayed_journal, len(self.spray_index), self.spray_index.fingerprint())
+        if new_pass:
+            self.sprayed.clear()
+
+        # GPS fixes fused with the wheel odometry, the spray decision then runs at the control rate
+        # on a fresh pose instead of on each fix
+        self.fuse_odometry:bool = fuse_odometry
+        self.pose_filter = PoseFilter(frame=self.spray_index.frame)
+
+        # Numeric state decoded from the CAN bus, formatted for the labels by display_map_function
+        # Status frames of the feather are matched with the pulses sent to measure their latency
+        self.spray_telemetry = SprayTelemetry()
+        self.can_decoder = CanDecoder(on_odometry=self.pose_filter.update_odometry,
+                                      on_spray_status=self.spray_telemetry.on_status)
+        self.amiga_state = ""
+        self.amiga_speed = ""
+        self.amiga_rate = ""
+        self._amiga_frames = 0
+        self.spray_status = ""
+        self._spray_status_frames = 0
+
+        self.spary_track = load_spray_index(os.path.join(this_path,"assets/spray_position_all.json"))
                 
 
         
+    @property
+    def spray_activate(self) -> int:
+        """Spray activation level commanded to the feather."""
+        return self._spray_activate
+
+    @spray_activate.setter
+    def spray_activate(self, activate: int) -> None:
+        if activate != self._spray_activate:
+            self._spray_activate = activate
+            self.spray_changed.set()
+
     def build(self):
         return Builder.load_file("res/main.kv")
 
@@ -126,8 +201,9 @@ class SprayApp(App):
             print("Auto spray On")
             self.auto_spray_activate = True
             # self.drwaw_circle()
-            # draw_tracks(mapview=self.mapview,data=self.spary_track)
-            self.markers = draw_markers(mapview=self.mapview,data=self.spary_pos)
+            # draw_tracks(mapview=self.mapview,data=self.spary_track.to_geojson())
+            # A tiled map only has the targets of the tiles loaded so far
+            self.markers = draw_markers(mapview=self.mapview,data=self.spray_index.to_geojson())
         else:
             print("Auto spray Off")
             self.auto_spray_activate = False
@@ -137,12 +213,24 @@ class SprayApp(App):
             self.spray_activate = 0
             # self.clear_circle()
 
+            # Drop the sprays scheduled by the predictive trigger
+            for handle in self.scheduled_sprays:
+                handle.cancel()
+            self.scheduled_sprays.clear()
+            # Their targets were not sprayed
+            self.scheduled_targets.clear()
+            if self.spray_pulses:
+                # A pulse of duration 0 cancels those the feather holds
+                self.send_spray_pulse(0.0, 0.0)
+            self.sprayed.flush()
+
             remove_markers(self.mapview, self.markers)
             
             
     def on_exit_btn(self) -> None:
         """Kills the running kivy application."""
         self.gps.stop()
+        self.sprayed.close()
         App.get_running_app().stop()
 
     async def app_func(self):
@@ -157,7 +245,7 @@ class SprayApp(App):
         # Placeholder task
         self.async_tasks.append(asyncio.ensure_future(self.update_gps_function()))
         self.async_tasks.append(asyncio.ensure_future(self.display_map_function()))
-        self.async_tasks.append(asyncio.ensure_future(self.auto_spray()))
+        self.async_tasks.append(asyncio.ensure_future(self.control_function()))
 
         
         # configure the canbus client
@@ -165,6 +253,9 @@ class SprayApp(App):
             address=self.address, port=self.canbus_port
         )
         canbus_client: CanbusClient = CanbusClient(canbus_config)
+        # One task watches the service state for every task using the client
+        self.canbus_state = ServiceStateWatcher(canbus_client)
+        self.async_tasks.append(asyncio.ensure_future(self.canbus_state.run()))
 
 
         # Canbus task(s)
@@ -184,10 +275,26 @@ class SprayApp(App):
         while self.root is None:
             await asyncio.sleep(0.01)
 
-        while True:
-            # Get GPS data
-            self.geo = self.gps.get_gps_data()
-            await asyncio.sleep(0.1)
+        async for geo in self.gps.fixes():
+            self.geo = geo
+            self.pose_filter.update_gps(geo)
+            if self.auto_spray_activate and not self.fuse_odometry:
+                # Evaluate the spray exactly once per new fix, as soon as it arrives
+                amiga = self.can_decoder.amiga
+                speed = amiga.meas_speed if amiga.t_mono is not None else geo.gSpeed
+                self.auto_spray(geo.lat, geo.lon, geo.headMot, speed)
+
+    async def control_function(self, period: float = 0.02) -> None:
+        """Evaluates the auto spray on the fused pose at the control rate of spray_generator."""
+        while self.root is None:
+            await asyncio.sleep(0.01)
+
+        while self.fuse_odometry:
+            if self.auto_spray_activate:
+                pose = self.pose_filter.pose_at()
+                if pose is not None:
+                    self.auto_spray(pose.lat, pose.lon, pose.heading, pose.speed)
+            await asyncio.sleep(period)
 
     async def display_map_function(self) -> None:
         """Placeholder forever loop."""
@@ -207,102 +314,156 @@ class SprayApp(App):
                 mapview_marker.lat = self.geo.lat
                 mapview_marker.lon = self.geo.lon
 
+            self.update_amiga_labels()
+            self.update_spray_status()
 
+            await asyncio.sleep(0.5)
 
+    def update_amiga_labels(self) -> None:
+        """Formats the Amiga state decoded since the last display refresh."""
+        amiga = self.can_decoder.amiga
+        if amiga.frames == self._amiga_frames:
+            return
+        self._amiga_frames = amiga.frames
+        self.amiga_state = AmigaControlState(amiga.state).name[6:]
+        self.amiga_speed = str(amiga.meas_speed)
+        self.amiga_rate = str(amiga.meas_ang_rate)
+
+    def update_spray_status(self) -> None:
+        """Formats the feather status and the pulse telemetry, reports the pulses dropped since the last refresh."""
+        dropped = self.spray_telemetry.expire()
+        if dropped:
+            print(f"{dropped} spray pulse(s) not acknowledged by the feather")
+        feather = self.can_decoder.feather
+        if feather.frames == self._spray_status_frames and not dropped:
+            return
+        self._spray_status_frames = feather.frames
+        self.spray_status = (f"Feather switch {'open' if feather.switch_open else 'closed'} "
+                             f"sections {feather.open_mask:#06x} seq {feather.last_seq}. {self.spray_telemetry}")
+        if feather.unsupported_sections:
+            self.spray_status += " Commanded sections not wired to the feather."
+
+    def start_spray(self, index:int, delay:float = 0.0) -> None:
+        """Activates the sprayer once over the target ``index`` of the prescription map, in ``delay`` seconds.
+
+        ``delay`` is only used for pulses, the host schedules the other sprays."""
+        # Access matched target properties
+        name = self.spray_index.name(index)
+        condition = self.spray_index.condition(index)
+
+        btn:Button = self.root.ids["spray_btn_layout"]
+        # Start timer
+        self.spray_start_time = time.time()
+        btn.state = "down"
+        if condition == "high":
+            activate = 3
+        elif condition == "med":
+            activate = 2
+        elif condition == "low":
+            activate = 1
+        else:
+            activate = 1
+        print(f"Spray {name} {condition}:{activate}")
 
-            await asyncio.sleep(0.5)
+        # The spray duration [s] is the activation level
+        if self.spray_pulses:
+            # The feather times the pulse, the host only resets the button at its end
+            self.send_spray_pulse(delay, activate)
+        else:
+            self.spray_activate = activate
+        # The target is sprayed once its spray starts, a pulse cancelled before then is not recorded
+        if delay > 0.0:
+            self.schedule_spray(delay, self.mark_sprayed, index)
+        else:
+            self.mark_sprayed(index)
+        if self.spray_stop_handle is not None:
+            self.spray_stop_handle.cancel()
+        self.spray_stop_handle = asyncio.get_event_loop().call_later(delay + activate, self.stop_spray)
+
+    def mark_sprayed(self, index:int) -> None:
+        """Records the target ``index`` as sprayed, once its spray started."""
+        self.scheduled_targets.discard(index)
+        self.sprayed.mark(index)
+
+    def skip_target(self, index:int) -> bool:
+        """Whether the target ``index`` is already sprayed or scheduled."""
+        return index in self.sprayed or index in self.scheduled_targets
+
+    def schedule_spray(self, delay:float, callback, *args) -> asyncio.TimerHandle:
+        """Calls ``callback(*args)`` in ``delay`` seconds, unless the auto spray is turned off before."""
+        loop = asyncio.get_event_loop()
+        # Forget the callbacks already run
+        self.scheduled_sprays = [handle for handle in self.scheduled_sprays if handle.when() > loop.time()]
+        handle = loop.call_later(delay, callback, *args)
+        self.scheduled_sprays.append(handle)
+        return handle
+
+    def send_spray_pulse(self, start_offset:float, duration:float) -> None:
+        """Queues a fully open spray pulse for spray_generator, see AmigaSprayPulse."""
+        # 1 to 255, the feather reports 0 before its first pulse
+        self.spray_pulse_seq = self.spray_pulse_seq % 255 + 1
+        proto = make_amiga_spray_pulse_proto(
+            self.spray_pulse_seq, SPRAY2_DUTY_STEPS - 1, start_offset, duration)
+        self.pending_pulses.append(
+            (self.spray_pulse_seq, start_offset, canbus_pb2.SendCanbusMessageRequest(message=proto)))
+        self.spray_changed.set()
+
+    def stop_spray(self) -> None:
+        """Deactivates the sprayer at the end of an auto spray."""
+        self.spray_stop_handle = None
+        btn:Button = self.root.ids["spray_btn_layout"]
+        btn.state = "normal"
+        self.spray_activate = 0
 
-    async def auto_spray(self) -> None:
-        """Placeholder forever loop."""
-        while self.root is None:
-            await asyncio.sleep(0.01)
+    def auto_spray(self, lat:float, lon:float, heading:float, speed:float) -> None:
+        """Sprays the targets reached at a position, heading in degrees clockwise from north and speed in m/s."""
+        if self.predictive_spray:
+            # Next target on the projected path and when to command the spray over it
+            index, delay = self.spray_index.predict(
+                lat, lon, heading=heading, speed=speed, latency=self.spray_latency,
+                radius=self.auto_spray_radious, skip=self.skip_target)
+        else:
+            # Match GPS position to the closest target within the spray radius, in meters
+            index, _ = self.spray_index.nearest(lat, lon, radius=self.auto_spray_radious)
+            delay = 0.0
 
-        while True:
-            
-            while self.auto_spray_activate:
-                if self.geo:
-                    gps_position = (self.geo.lon,self.geo.lat)
-
-                    # Build KD-Tree
-                    kdtree = build_kd_tree(self.spary_pos)
-
-                    # Match GPS position to GeoJSON feature
-                    matched_feature = match_gps_position(gps_position, kdtree, self.spary_pos)
-
-                    # Access matched feature properties
-                    name = matched_feature['properties']['name']
-                    # You can access other properties based on your GeoJSON structure
-                    condition = matched_feature['properties']['condition']
-                    # print(f'Matched feature name: {name}')
-
-                    # Calc dist
-                    dist = calculate_utm_distance(self.geo.lat,self.geo.lon,
-                                        matched_feature['geometry']['coordinates'][1],matched_feature['geometry']['coordinates'][0])
-                    
-                    btn:Button = self.root.ids["spray_btn_layout"]
-                    # If the dist is closer than spray radious and new id
-                    # Activate the sprayer once
-                    if dist < self.auto_spray_radious and self.spray_pos_id != name:
-                        self.spray_pos_id = name
-                        # Start timer
-                        self.spray_start_time = time.time()
-                        btn.state = "down"
-                        if condition == "high":
-                            self.spray_activate = 3
-                        elif condition == "med":
-                            self.spray_activate = 2
-                        elif condition == "low":
-                            self.spray_activate = 1
-                        else:
-                            self.spray_activate = 1
-                        print(f"Spray {condition}:{self.spray_activate}")
-
-                    curr_time = time.time()
-
-                    if curr_time - self.spray_start_time > self.spray_activate:
-                        btn.state = "normal"
-                        self.spray_activate = 0
-                        # print(f"Spray {condition}:{self.spray_activate}")
-                else:
-                    print("Wait for self.geo")
-                    
-                await asyncio.sleep(0.1)
+        # If a target is closer than spray radious and not sprayed yet
+        # Activate the sprayer once
+        if index is not None and not self.skip_target(index):
+            self.spray_pos_id = self.spray_index.name(index)
+            self.scheduled_targets.add(index)
+            if delay > 0.0 and not self.spray_pulses:
+                self.schedule_spray(delay, self.start_spray, index)
+            else:
+                # Pulses carry the delay to the feather
+                self.start_spray(index, delay)
 
-            await asyncio.sleep(0.1)
 
 
     async def stream_canbus(self, client: CanbusClient) -> None:
         """This task:
 
         - listens to the canbus client's stream
-        - filters for AmigaTpdo1 messages
-        - extracts useful values from AmigaTpdo1 messages
+        - dispatches the frames of interest to the CanDecoder by arbitration ID
         """
         while self.root is None:
             await asyncio.sleep(0.01)
 
         response_stream = None
+        streamable = (service_pb2.ServiceState.IDLE, service_pb2.ServiceState.RUNNING)
+        backoff = Backoff()
 
         while True:
-            # check the state of the service
-            state = await client.get_state()
-
-            if state.value not in [
-                service_pb2.ServiceState.IDLE,
-                service_pb2.ServiceState.RUNNING,
-            ]:
+            # Cached state of the service, see ServiceStateWatcher
+            if self.canbus_state.state not in streamable:
                 if response_stream is not None:
                     response_stream.cancel()
                     response_stream = None
 
                 # print("Canbus service is not streaming or ready to stream")
-                await asyncio.sleep(0.1)
-                continue
+                await self.canbus_state.wait_for(streamable)
 
-            if (
-                response_stream is None
-                and state.value != service_pb2.ServiceState.UNAVAILABLE
-            ):
+            if response_stream is None:
                 # get the streaming object
                 response_stream = client.stream()
 
@@ -314,18 +475,15 @@ class SprayApp(App):
                 print(e)
                 response_stream.cancel()
                 response_stream = None
+                # The service may be gone, check it now and retry later and later
+                self.canbus_state.refresh()
+                await backoff.sleep()
                 continue
+            backoff.reset()
 
-            for proto in response.messages.messages:
-                amiga_tpdo1: Optional[AmigaTpdo1] = parse_amiga_tpdo1_proto(proto)
-                if amiga_tpdo1:
-                    # Store the value for possible other uses
-                    self.amiga_tpdo1 = amiga_tpdo1
-
-                    # Update the Label values as they are received
-                    self.amiga_state = AmigaControlState(amiga_tpdo1.state).name[6:]
-                    self.amiga_speed = str(amiga_tpdo1.meas_speed)
-                    self.amiga_rate = str(amiga_tpdo1.meas_ang_rate)
+            # Frames of interest update numeric state and feed the odometry, the labels are formatted at the
+            # display rate by update_amiga_labels
+            self.can_decoder.feed(response.messages.messages)
 
 
     async def send_can_msgs(self, client: CanbusClient) -> None:
@@ -335,19 +493,17 @@ class SprayApp(App):
             await asyncio.sleep(0.01)
 
         response_stream = None
+        running = (service_pb2.ServiceState.RUNNING,)
+        backoff = Backoff()
         while True:
-            # check the state of the service
-            state = await client.get_state()
-
             # Wait for a running CAN bus service
-            if state.value != service_pb2.ServiceState.RUNNING:
+            if self.canbus_state.state not in running:
                 # Cancel existing stream, if it exists
                 if response_stream is not None:
                     response_stream.cancel()
                     response_stream = None
                 # print("Waiting for running canbus service...")
-                await asyncio.sleep(0.1)
-                continue
+                await self.canbus_state.wait_for(running)
 
             if response_stream is None:
                 print("Start sending CAN messages")
@@ -357,29 +513,45 @@ class SprayApp(App):
                 async for response in response_stream:
                     # Sit in this loop and wait until canbus service reports back it is not sending
                     assert response.success
+                    backoff.reset()
             except Exception as e:
                 print(e)
                 response_stream.cancel()
                 response_stream = None
+                self.canbus_state.refresh()
+                await backoff.sleep()
                 continue
 
             await asyncio.sleep(0.1)
 
     async def spray_generator(self, period: float = 0.02):
         """The spray generator yields an AmigaSpray1 (spray control command) for the canbus client to send on the bus
-        at the specified period (recommended 50hz) based on the onscreen spray button."""
+        at the specified period (recommended 50hz) based on the onscreen spray button.
+
+        With a can_heartbeat, a command is sent as soon as the spray activation changes and then only every
+        can_heartbeat seconds, so the feather still gets a periodic refresh. Queued spray pulses are sent first, once
+        each. The sprayed journal is synced once the commands are sent, never between a mark and its command."""
         while self.root is None:
             await asyncio.sleep(0.01)
 
         #joystick: VirtualJoystickWidget = self.root.ids["joystick"]
         while True:
             # print(f"self.activate:{self.spray_activate}")
-            msg: canbus_pb2.RawCanbusMessage = make_amiga_spray1_proto(
-                state_req=AmigaControlState.STATE_AUTO_ACTIVE,
-                activate=self.spray_activate,
-            )
-            yield canbus_pb2.SendCanbusMessageRequest(message=msg)
-            await asyncio.sleep(period)
+            self.spray_changed.clear()
+            while self.pending_pulses:
+                seq, start_offset, request = self.pending_pulses.popleft()
+                self.spray_telemetry.sent(seq, time.monotonic(), start_offset)
+                yield request
+            # Pre-encoded per activation level, nothing is built per send
+            yield get_amiga_spray1_request(AmigaControlState.STATE_AUTO_ACTIVE, self.spray_activate)
+            self.sprayed.flush_if_due()
+            if self.can_heartbeat > 0:
+                try:
+                    await asyncio.wait_for(self.spray_changed.wait(), self.can_heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(period)
 
 
 
@@ -403,12 +575,99 @@ if __name__ == "__main__":
         help="The grpc port where the canbus service is running.",
     )
 
+    parser.add_argument(
+        "--predictive-spray",
+        action="store_true",
+        help="Schedule the spray for the predicted time of arrival over the target using heading and speed.",
+    )
+
+    parser.add_argument(
+        "--spray-latency",
+        type=float,
+        default=0.4,
+        help="Total system latency [s] from the GPS fix to the nozzle opening, used by --predictive-spray.",
+    )
+
+    parser.add_argument(
+        "--tile-dir",
+        type=str,
+        default=None,
+        help="Directory of a tiled prescription map (see robo_spray.tiles) to use instead of the bundled map. "
+        "Only the targets of the tiles loaded around the robot are drawn as markers.",
+    )
+
+    parser.add_argument(
+        "--sprayed-journal",
+        type=str,
+        default=None,
+        help="Journal of the targets already sprayed. Defaults to sprayed.journal next to the map.",
+    )
+
+    parser.add_argument(
+        "--new-pass",
+        action="store_true",
+        help="Clear the sprayed journal at startup to spray the whole map again. By default the targets already "
+        "sprayed on the same map are skipped, so a restart resumes the pass.",
+    )
+
+    parser.add_argument(
+        "--gps-in-event-loop",
+        action="store_true",
+        help="Read the GPS in the app event loop instead of a separate process, for a lower fix latency.",
+    )
+
+    parser.add_argument(
+        "--no-odometry-fusion",
+        action="store_true",
+        help="Evaluate the auto spray once per GPS fix instead of on the GPS and odometry pose at the control rate.",
+    )
+
+    parser.add_argument(
+        "--gps-record",
+        type=str,
+        default=None,
+        help="Record the GPS receiver stream to this log, see robo_spray.gpslog.",
+    )
+
+    parser.add_argument(
+        "--gps-replay",
+        type=str,
+        default=None,
+        help="Replay a GPS log recorded with --gps-record instead of reading the receiver.",
+    )
+
+    parser.add_argument(
+        "--gps-replay-speed",
+        type=float,
+        default=1.0,
+        help="Speed factor of --gps-replay, 0 to replay as fast as possible, in the event loop so no fix is dropped.",
+    )
+
+    parser.add_argument(
+        "--can-heartbeat",
+        type=float,
+        default=0.2,
+        help="Send spray commands on change and then every CAN_HEARTBEAT seconds, 0 to send them every 20 ms.",
+    )
+
+    parser.add_argument(
+        "--spray-pulses",
+        action="store_true",
+        help="Send each auto spray as one pulse frame timed by the feather, which needs the pulse firmware.",
+    )
+
     args = parser.parse_args()
 
     loop = asyncio.get_event_loop()
     try:
         loop.run_until_complete(SprayApp(
-                address=args.address, canbus_port=args.canbus_port
+                address=args.address, canbus_port=args.canbus_port,
+                predictive_spray=args.predictive_spray, spray_latency=args.spray_latency,
+                tile_dir=args.tile_dir, sprayed_journal=args.sprayed_journal, new_pass=args.new_pass,
+                gps_in_event_loop=args.gps_in_event_loop, fuse_odometry=not args.no_odometry_fusion,
+                gps_record=args.gps_record, gps_replay=args.gps_replay,
+                gps_replay_speed=args.gps_replay_speed or None, can_heartbeat=args.can_heartbeat,
+                spray_pulses=args.spray_pulses
             ).app_func()
         )
     except asyncio.CancelledError:
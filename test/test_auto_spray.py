@@ -0,0 +1,188 @@
+"""Tests for the auto spray prescription index."""
+import json
+import os
+
+import numpy as np
+
+from robo_spray.auto_spray import _spray_index_cache
+from robo_spray.auto_spray import build_kd_tree
+from robo_spray.auto_spray import calculate_utm_distance
+from robo_spray.auto_spray import calculate_utm_distances
+from robo_spray.auto_spray import get_spray_index
+from robo_spray.auto_spray import LocalFrame
+from robo_spray.auto_spray import load_spray_index
+from robo_spray.auto_spray import match_gps_position
+from robo_spray.auto_spray import match_gps_positions
+from robo_spray.auto_spray import SPRAY_INDEX_CACHE_SIZE
+
+ASSETS_PATH = os.path.join(os.path.dirname(__file__), "../src/assets/")
+
+
+def load_points() -> dict:
+    with open(os.path.join(ASSETS_PATH, "spray_position_points.json")) as file:
+        return json.load(file)
+
+
+class TestSprayIndex:
+    def test_match_same_as_kd_tree(self) -> None:
+        data = load_points()
+        index = get_spray_index(data)
+        kdtree = build_kd_tree(data)
+        for feature in data["features"]:
+            lon, lat = feature["geometry"]["coordinates"]
+            gps_position = (lon + 1e-6, lat - 1e-6)
+            assert index.match(gps_position) is match_gps_position(gps_position, kdtree, data)
+
+    def test_nearest_within_radius(self) -> None:
+        data = load_points()
+        index = get_spray_index(data)
+        lon, lat = data["features"][3]["geometry"]["coordinates"]
+        i, dist = index.nearest(lat, lon, radius=3.0)
+        assert i == 3
+        assert dist < 1e-6
+
+        # ~1 km north of the field
+        assert index.nearest(lat + 0.01, lon, radius=3.0) == (None, np.inf)
+
+    def test_nearest_is_metric(self) -> None:
+        # 1e-5 deg of longitude is ~0.87 m at this latitude, 1e-5 deg of latitude is ~1.11 m.
+        # Nearest in degrees is a tie, in meters it must be the target to the east.
+        data = {
+            "features": [
+                {"properties": {"name": "north"}, "geometry": {"coordinates": [-121.75, 38.53001]}},
+                {"properties": {"name": "east"}, "geometry": {"coordinates": [-121.74999, 38.53]}},
+            ]
+        }
+        i, dist = get_spray_index(data).nearest(38.53, -121.75)
+        assert i == 1
+        assert abs(dist - calculate_utm_distance(38.53, -121.75, 38.53, -121.74999)) < 1e-3
+
+    def test_memoized_per_map(self) -> None:
+        data = load_points()
+        assert get_spray_index(data) is get_spray_index(data)
+        assert get_spray_index(load_points()) is not get_spray_index(data)
+
+    def test_cache_bounded(self) -> None:
+        data = load_points()
+        index = get_spray_index(data)
+        for _ in range(SPRAY_INDEX_CACHE_SIZE):
+            get_spray_index(load_points())
+        assert len(_spray_index_cache) == SPRAY_INDEX_CACHE_SIZE
+        # Evicted, rebuilt on the next call
+        assert get_spray_index(data) is not index
+
+    def test_reloaded_on_file_change(self, tmp_path) -> None:
+        path = tmp_path / "points.json"
+        path.write_text(json.dumps(load_points()))
+        index = load_spray_index(str(path))
+        assert load_spray_index(str(path)) is index
+
+        mtime_ns = os.stat(path).st_mtime_ns + 10**9
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        assert load_spray_index(str(path)) is not index
+
+
+class TestLocalFrame:
+    def test_distance_matches_geodesic(self) -> None:
+        frame = LocalFrame(38.5323, -121.7520)
+        rng = np.random.default_rng(0)
+        lat = 38.5323 + rng.uniform(-0.005, 0.005, (20, 2))
+        lon = -121.7520 + rng.uniform(-0.005, 0.005, (20, 2))
+        for (lat1, lat2), (lon1, lon2) in zip(lat, lon):
+            x1, y1 = frame.to_enu(lat1, lon1)
+            x2, y2 = frame.to_enu(lat2, lon2)
+            expected = calculate_utm_distance(lat1, lon1, lat2, lon2)
+            # Relative error below 1e-4 across a ~1 km field
+            assert abs(np.hypot(x2 - x1, y2 - y1) - expected) < 1e-4 * expected + 1e-6
+
+    def test_round_trip(self) -> None:
+        frame = LocalFrame(38.5323, -121.7520)
+        lat, lon = frame.to_latlon(*frame.to_enu(38.533, -121.751))
+        assert abs(lat - 38.533) < 1e-12
+        assert abs(lon + 121.751) < 1e-12
+
+
+class TestBatchMatching:
+    def test_distances_match_scalar(self) -> None:
+        rng = np.random.default_rng(1)
+        lat1 = rng.uniform(-80, 80, 200)
+        lon1 = rng.uniform(-180, 180, 200)
+        # Mix of field scale and continental scale pairs
+        lat2 = np.concatenate((lat1[:100] + rng.uniform(-1e-3, 1e-3, 100), rng.uniform(-80, 80, 100)))
+        lon2 = np.concatenate((lon1[:100] + rng.uniform(-1e-3, 1e-3, 100), rng.uniform(-180, 180, 100)))
+
+        distances = calculate_utm_distances(lat1, lon1, lat2, lon2)
+        expected = [calculate_utm_distance(*pair) for pair in zip(lat1, lon1, lat2, lon2)]
+        np.testing.assert_allclose(distances, expected, rtol=0, atol=1e-3)
+        assert calculate_utm_distances(38.53, -121.75, 38.53, -121.75) == 0.0
+
+    def test_match_many_same_as_scalar(self) -> None:
+        data = load_points()
+        index = get_spray_index(data)
+        rng = np.random.default_rng(2)
+        lats = 38.5323 + rng.uniform(-1e-4, 1e-4, 500)
+        lons = -121.7520 + rng.uniform(-1e-4, 1e-4, 500)
+
+        indices, distances, in_radius = match_gps_positions(lats, lons, index, radius=3.0)
+        for lat, lon, i, dist, inside in zip(lats, lons, indices, distances, in_radius):
+            nearest, nearest_dist = index.nearest(lat, lon)
+            assert i == nearest
+            assert abs(dist - nearest_dist) < 1e-9
+            assert inside == (index.nearest(lat, lon, radius=3.0)[0] is not None)
+            feature_lon, feature_lat = data["features"][i]["geometry"]["coordinates"]
+            assert abs(dist - calculate_utm_distance(lat, lon, feature_lat, feature_lon)) < 1e-3
+
+
+class TestPredictiveTrigger:
+    def make_index(self):
+        frame = LocalFrame(38.53, -121.75)
+        # Targets 2, 5 and 10 m north of the origin and one 5 m east of it
+        lat, lon = frame.to_latlon(np.array([0.0, 0.0, 0.0, 5.0]), np.array([2.0, 5.0, 10.0, 0.0]))
+        features = [
+            {"properties": {"name": f"t{i}"}, "geometry": {"coordinates": [lon[i], lat[i]]}} for i in range(4)
+        ]
+        return get_spray_index({"features": features})
+
+    def test_schedules_time_of_arrival(self) -> None:
+        index = self.make_index()
+        # Driving north at 2 m/s with 0.4 s of latency: target 2 m ahead is reached in 1 s
+        target, delay = index.predict(38.53, -121.75, heading=0.0, speed=2.0, latency=0.4, radius=0.5)
+        assert target == 0
+        assert abs(delay - 0.6) < 1e-3
+
+    def test_fires_now_when_latency_exceeds_arrival(self) -> None:
+        index = self.make_index()
+        target, delay = index.predict(38.53, -121.75, heading=0.0, speed=4.0, latency=1.0, radius=0.5)
+        assert (target, delay) == (0, 0.0)
+
+    def test_heading_and_reverse(self) -> None:
+        index = self.make_index()
+        # Target east is 5 s away, beyond the default horizon
+        assert index.predict(38.53, -121.75, heading=90.0, speed=1.0, latency=0.0, radius=0.5) == (None, None)
+        target, delay = index.predict(38.53, -121.75, heading=90.0, speed=1.0, latency=0.0, radius=0.5, horizon=6)
+        assert target == 3
+        assert abs(delay - 5.0) < 1e-3
+        # Backing up while facing south drives north
+        target, _ = index.predict(38.53, -121.75, heading=180.0, speed=-2.0, latency=0.0, radius=0.5)
+        assert target == 0
+
+    def test_nothing_on_path(self) -> None:
+        index = self.make_index()
+        assert index.predict(38.53, -121.75, heading=270.0, speed=2.0, latency=0.4, radius=0.5) == (None, None)
+
+    def test_skips_sprayed_targets(self) -> None:
+        index = self.make_index()
+        # Target 0 already sprayed, the next one on the path is scheduled ahead of time
+        target, delay = index.predict(
+            38.53, -121.75, heading=0.0, speed=2.5, latency=0.4, radius=0.5, skip={0}.__contains__
+        )
+        assert target == 1
+        assert abs(delay - 1.6) < 1e-3
+        # Standing still, the nearest target not skipped within the radius
+        assert index.predict(38.53, -121.75, heading=0.0, speed=0.0, latency=0.4, radius=6.0) == (0, 0.0)
+        assert index.predict(
+            38.53, -121.75, heading=0.0, speed=0.0, latency=0.4, radius=6.0, skip={0}.__contains__
+        ) == (3, 0.0)
+        assert index.predict(
+            38.53, -121.75, heading=0.0, speed=0.0, latency=0.4, radius=1.0, skip={0}.__contains__
+        ) == (None, None)
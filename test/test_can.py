@@ -0,0 +1,170 @@
+"""Tests for the spray CAN commands."""
+import pytest
+from farm_ng.canbus import canbus_pb2
+from farm_ng.canbus.packet import AmigaControlState
+from farm_ng.canbus.packet import AmigaTpdo1
+from robo_spray.can import AMIGA_TPDO1_ID
+from robo_spray.can import AmigaSpray1
+from robo_spray.can import AmigaSpray2
+from robo_spray.can import AmigaSprayPulse
+from robo_spray.can import CanDecoder
+from robo_spray.can import get_amiga_spray1_proto
+from robo_spray.can import make_amiga_spray1_proto
+from robo_spray.can import make_amiga_spray2_proto
+from robo_spray.can import make_amiga_spray_pulse_proto
+from robo_spray.can import SPRAY2_ID
+from robo_spray.can import SPRAY_PULSE_ID
+from robo_spray.can import SPRAY_STATUS_ID
+from robo_spray.can import SPRAY_STATUS_STRUCT
+from robo_spray.can import SprayTelemetry
+from robo_spray.can import STATUS_SWITCH_OPEN
+from robo_spray.can import STATUS_UNSUPPORTED_SECTIONS
+
+
+class TestSpray1:
+    def test_cached_proto(self) -> None:
+        proto = get_amiga_spray1_proto(AmigaControlState.STATE_AUTO_ACTIVE, 2)
+        assert get_amiga_spray1_proto(AmigaControlState.STATE_AUTO_ACTIVE, 2) is proto
+        assert get_amiga_spray1_proto(AmigaControlState.STATE_AUTO_ACTIVE, 3) is not proto
+        assert get_amiga_spray1_proto(AmigaControlState.STATE_ESTOPPED, 2) is not proto
+
+        assert proto == make_amiga_spray1_proto(AmigaControlState.STATE_AUTO_ACTIVE, 2)
+        assert proto.id == 0x777
+
+        packet = AmigaSpray1()
+        packet.decode(proto.data)
+        assert (packet.state_req, packet.activate) == (AmigaControlState.STATE_AUTO_ACTIVE, 2)
+
+
+class TestSpray2:
+    def test_round_trip(self) -> None:
+        levels = [7, 0, 3, 5, 1, 6, 2, 4, 7, 7, 0, 1, 2, 3, 4, 5]
+        proto = make_amiga_spray2_proto(0xA5C3, levels)
+        assert proto.id == SPRAY2_ID
+        assert len(proto.data) == 8
+
+        packet = AmigaSpray2()
+        packet.decode(proto.data)
+        assert (packet.mask, packet.levels) == (0xA5C3, levels)
+
+    def test_duties(self) -> None:
+        packet = AmigaSpray2.from_duties([1.0, 0.0, 0.5, 0.1])
+        assert packet.mask == 0b1101
+        assert packet.levels[:4] == [7, 0, 3, 0]
+        assert packet.duties()[:5] == [1.0, 0.0, 0.5, 0.125, 0.0]
+
+    def test_invalid(self) -> None:
+        with pytest.raises(ValueError):
+            AmigaSpray2(1 << 16)
+        with pytest.raises(ValueError):
+            AmigaSpray2(1, [8])
+        with pytest.raises(ValueError):
+            AmigaSpray2(1, [0] * 17)
+
+
+class TestSprayPulse:
+    def test_round_trip(self) -> None:
+        proto = make_amiga_spray_pulse_proto(seq=257, level=7, start_offset=0.1234, duration=2.0, mask=0x8001)
+        assert proto.id == SPRAY_PULSE_ID
+        assert len(proto.data) == 8
+
+        packet = AmigaSprayPulse()
+        packet.decode(proto.data)
+        assert (packet.seq, packet.level) == (1, 7)
+        assert (packet.start_offset_ms, packet.duration_ms, packet.mask) == (123, 2000, 0x8001)
+
+    def test_clipped(self) -> None:
+        packet = AmigaSprayPulse()
+        packet.decode(make_amiga_spray_pulse_proto(seq=0, level=7, start_offset=-0.5, duration=100.0).data)
+        assert (packet.start_offset_ms, packet.duration_ms) == (0, 0xFFFF)
+
+
+class TestCanDecoder:
+    def test_amiga_tpdo1(self) -> None:
+        odometry = []
+        decoder = CanDecoder(on_odometry=lambda *args: odometry.append(args))
+        tpdo1 = AmigaTpdo1(AmigaControlState.STATE_AUTO_ACTIVE, meas_speed=1.25, meas_ang_rate=-0.5)
+        messages = [
+            canbus_pb2.RawCanbusMessage(id=0x123, data=bytes(8)),
+            canbus_pb2.RawCanbusMessage(id=AMIGA_TPDO1_ID, data=tpdo1.encode()),
+        ]
+
+        assert decoder.feed(messages, t_mono=3.0) == 1
+        amiga = decoder.amiga
+        assert (amiga.state, amiga.meas_speed, amiga.meas_ang_rate) == (AmigaControlState.STATE_AUTO_ACTIVE, 1.25, -0.5)
+        assert (amiga.t_mono, amiga.frames) == (3.0, 1)
+        assert odometry == [(1.25, -0.5, 3.0)]
+
+    def test_legacy_tpdo1(self) -> None:
+        decoder = CanDecoder()
+        legacy = AmigaTpdo1(AmigaControlState.STATE_AUTO_READY, meas_speed=0.5).encode()[:5]
+        decoder.feed([canbus_pb2.RawCanbusMessage(id=AMIGA_TPDO1_ID, data=legacy)])
+        assert (decoder.amiga.state, decoder.amiga.meas_speed) == (AmigaControlState.STATE_AUTO_READY, 0.5)
+
+    def test_register(self) -> None:
+        decoder = CanDecoder()
+        frames = []
+        decoder.register(0x42, lambda data, t_mono: frames.append((data, t_mono)))
+        decoder.feed([canbus_pb2.RawCanbusMessage(id=0x42, data=b"\x01")], t_mono=1.0)
+        assert frames == [(b"\x01", 1.0)]
+        assert decoder.amiga.t_mono is None
+
+
+def status_message(flags: int, last_seq: int, open_mask: int = 0, feather_ms: int = 0):
+    return canbus_pb2.RawCanbusMessage(
+        id=SPRAY_STATUS_ID, data=SPRAY_STATUS_STRUCT.pack(flags, last_seq, open_mask, feather_ms)
+    )
+
+
+class TestSprayTelemetry:
+    def test_status(self) -> None:
+        decoder = CanDecoder()
+        decoder.feed([status_message(STATUS_SWITCH_OPEN, 5, 0x3, 123456)], t_mono=2.0)
+        feather = decoder.feather
+        assert feather.switch_open
+        assert (feather.last_seq, feather.open_mask, feather.feather_ms) == (5, 0x3, 123456)
+        assert (feather.t_mono, feather.frames) == (2.0, 1)
+        assert not feather.unsupported_sections
+
+        decoder.feed([status_message(STATUS_UNSUPPORTED_SECTIONS, 5)])
+        assert feather.unsupported_sections and not feather.switch_open
+
+    def test_latencies(self) -> None:
+        telemetry = SprayTelemetry()
+        decoder = CanDecoder(on_spray_status=telemetry.on_status)
+        telemetry.sent(1, 10.0, start_offset=0.2)
+
+        # Accepted, then opened at its start
+        decoder.feed([status_message(0, 1)], t_mono=10.01)
+        decoder.feed([status_message(STATUS_SWITCH_OPEN, 1)], t_mono=10.25)
+        assert telemetry.acknowledged == 1
+        assert list(telemetry.ack_latencies) == pytest.approx([0.01])
+        assert list(telemetry.actuation_latencies) == pytest.approx([0.05])
+
+        # Heartbeats do not count twice
+        decoder.feed([status_message(STATUS_SWITCH_OPEN, 1)], t_mono=11.0)
+        assert (telemetry.acknowledged, len(telemetry.actuation_latencies)) == (1, 1)
+
+    def test_superseded(self) -> None:
+        telemetry = SprayTelemetry(timeout=0.5)
+        decoder = CanDecoder(on_spray_status=telemetry.on_status)
+        # A pulse and the cancel sent right after it, across the wrap of the sequence numbers
+        telemetry.sent(255, 10.0)
+        telemetry.sent(1, 10.01)
+        decoder.feed([status_message(0, 1)], t_mono=10.05)
+
+        assert telemetry.expire(10.6) == 0
+        assert (telemetry.acknowledged, telemetry.superseded, telemetry.dropped) == (1, 1, 0)
+
+    def test_dropped(self) -> None:
+        telemetry = SprayTelemetry(timeout=0.5)
+        decoder = CanDecoder(on_spray_status=telemetry.on_status)
+        telemetry.sent(1, 10.0)
+        decoder.feed([status_message(STATUS_SWITCH_OPEN, 1)], t_mono=10.02)
+        telemetry.sent(2, 10.1)
+        # Heartbeats still report the first pulse
+        decoder.feed([status_message(STATUS_SWITCH_OPEN, 1)], t_mono=10.5)
+
+        assert telemetry.expire(10.3) == 0
+        assert telemetry.expire(10.7) == 1
+        assert (telemetry.acknowledged, telemetry.superseded, telemetry.dropped) == (1, 0, 1)
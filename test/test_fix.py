@@ -0,0 +1,40 @@
+"""Tests for the GPS fix types."""
+import pickle
+
+import numpy as np
+import pytest
+from robo_spray.fix import FIX_3D
+from robo_spray.fix import FIX_DTYPE
+from robo_spray.fix import GpsFix
+from robo_spray.fix import make_fix
+
+
+class TestGpsFix:
+    def test_record_round_trip(self) -> None:
+        record = make_fix(seq=7, t_mono=12.5, min=42, fixType=FIX_3D, lat=38.5323, lon=-121.752, hAcc=0.014)
+        fix = GpsFix.from_record(record)
+
+        assert (fix.seq, fix.t_mono, fix.min, fix.fixType) == (7, 12.5, 42, FIX_3D)
+        assert fix.lat == 38.5323 and fix["lon"] == -121.752
+        assert fix.hAcc == pytest.approx(0.014)
+        assert type(fix.lat) is float and type(fix.seq) is int
+
+        assert fix.to_record().tobytes() == record.tobytes()
+        assert fix.to_bytes() == record.tobytes()
+        assert GpsFix.from_bytes(record.tobytes()) == fix
+
+    def test_slots(self) -> None:
+        fix = GpsFix(lat=1.0)
+        assert fix.lon == 0 and fix.lat == 1.0
+        assert not hasattr(fix, "__dict__")
+        with pytest.raises(AttributeError):
+            fix.latitude = 1.0
+        with pytest.raises(TypeError):
+            GpsFix(latitude=1.0)
+
+    def test_pickle(self) -> None:
+        fix = GpsFix.from_record(make_fix(seq=3, lat=38.5, lon=-121.75))
+        data = pickle.dumps(fix)
+        assert pickle.loads(data) == fix
+        # Smaller than the numpy record it replaces
+        assert len(data) < len(pickle.dumps(np.zeros(1, dtype=FIX_DTYPE)[0]))
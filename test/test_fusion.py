@@ -0,0 +1,83 @@
+"""Tests for the GPS and wheel odometry fusion filter."""
+import math
+
+import numpy as np
+from robo_spray.auto_spray import LocalFrame
+from robo_spray.fix import FIX_3D
+from robo_spray.fix import FIX_DTYPE
+from robo_spray.fix import FIX_NONE
+from robo_spray.fusion import PoseFilter
+
+FRAME = LocalFrame(38.5323, -121.7520)
+
+
+def make_fix(t: float, east: float, north: float, heading: float, speed: float, h_acc: float = 0.02) -> np.record:
+    fix = np.zeros(1, dtype=FIX_DTYPE).view(np.recarray)[0]
+    fix.t_mono = t
+    fix.fixType = FIX_3D
+    fix.lat, fix.lon = FRAME.to_latlon(east, north)
+    fix.hAcc = h_acc
+    fix.headMot = heading
+    fix.headAcc = 1.0
+    fix.gSpeed = speed
+    return fix
+
+
+def error(pose, east: float, north: float) -> float:
+    pose_east, pose_north = FRAME.to_enu(pose.lat, pose.lon)
+    return math.hypot(pose_east - east, pose_north - north)
+
+
+class TestPoseFilter:
+    def test_straight_line_between_fixes(self) -> None:
+        fusion = PoseFilter(frame=FRAME)
+        assert fusion.pose_at(0.0) is None
+        speed = 1.0
+        rng = np.random.default_rng(0)
+        errors = []
+        for tick in range(500):
+            t = tick * 0.02
+            fusion.update_odometry(speed, 0.0, t)
+            if tick % 40 == 0:
+                # 1.25 Hz fixes with 2 cm noise
+                east, north = rng.normal(0.0, 0.02, 2) + (0.0, speed * t)
+                fusion.update_gps(make_fix(t, east, north, 0.0, speed))
+            pose = fusion.pose_at(t + 0.01)
+            errors.append(error(pose, 0.0, speed * (t + 0.01)))
+
+        # A 0.8 s old fix would be 0.8 m behind, the fused pose follows the robot
+        assert max(errors[40:]) < 0.1
+        assert pose.speed == speed
+        assert abs((pose.heading + 180.0) % 360.0 - 180.0) < 2.0
+
+    def test_turn_from_odometry(self) -> None:
+        fusion = PoseFilter(frame=FRAME)
+        speed, ang_rate = 1.0, 0.2
+        fusion.update_gps(make_fix(0.0, 0.0, 0.0, 0.0, speed))
+        fusion.update_odometry(speed, ang_rate, 0.0)
+
+        # Counterclockwise arc of radius 5 m starting northward, centered at (-5, 0)
+        t = 0.4
+        pose = fusion.pose_at(t)
+        radius = speed / ang_rate
+        expected = (-radius + radius * math.cos(ang_rate * t), radius * math.sin(ang_rate * t))
+        assert error(pose, *expected) < 1e-3
+        assert math.isclose(pose.heading, 360.0 - math.degrees(ang_rate * t), abs_tol=1e-6)
+
+        # pose_at does not change the state
+        assert fusion.t_mono == 0.0
+        # Stale odometry is no longer extrapolated
+        assert fusion.pose_at(1.0).speed == 1.0 and fusion.pose_at(1.0).heading == 0.0
+
+    def test_coasts_on_gps_speed_without_odometry(self) -> None:
+        fusion = PoseFilter(frame=FRAME)
+        fusion.update_gps(make_fix(0.0, 0.0, 0.0, 90.0, 2.0))
+        pose = fusion.pose_at(0.5)
+        assert error(pose, 1.0, 0.0) < 1e-3
+
+    def test_ignores_fixes_without_position(self) -> None:
+        fusion = PoseFilter(frame=FRAME)
+        fix = make_fix(0.0, 0.0, 0.0, 0.0, 0.0)
+        fix.fixType = FIX_NONE
+        fusion.update_gps(fix)
+        assert not fusion.initialized
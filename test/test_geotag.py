@@ -0,0 +1,88 @@
+"""Tests for the batch geotagging of images."""
+import os
+import struct
+
+import numpy as np
+import piexif
+import pytest
+from robo_spray.fix import FIX_3D
+from robo_spray.fix import FIX_TIME_ONLY
+from robo_spray.fix import FLAG_GNSS_FIX_OK
+from robo_spray.fix import make_fix
+from robo_spray.geotag import fix_utc_times
+from robo_spray.geotag import geotag_images
+from robo_spray.gps import change_to_rational
+
+# Smallest JPEG piexif can tag: SOI, JFIF APP0, SOS, EOI
+JPEG = (
+    b"\xff\xd8"
+    + b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    + b"\xff\xda" + struct.pack(">H", 8) + b"\x01\x01\x00\x00\x3f\x00"
+    + b"\x00\x00\xff\xd9"
+)
+# 2023-06-01 17:28:00 UTC
+T0 = 1685640480.0
+
+
+def make_fixes(n: int) -> np.recarray:
+    """Fixes every second from T0, moving north."""
+    fixes = np.stack([
+        make_fix(seq=i + 1, year=2023, month=6, day=1, hour=17, min=28, sec=i, fixType=FIX_3D,
+                 fixFlags=FLAG_GNSS_FIX_OK, lat=38.5 + i * 1e-5, lon=-121.75, height=15.0 + i)
+        for i in range(n)
+    ])
+    return fixes.view(np.recarray)
+
+
+def exif_degrees(value) -> float:
+    return sum(numerator / denominator / 60**i for i, (numerator, denominator) in enumerate(value))
+
+
+class TestGeotag:
+    def test_fix_utc_times(self) -> None:
+        fixes = make_fixes(3)
+        fixes.nano[1] = 500_000_000
+        np.testing.assert_allclose(fix_utc_times(fixes), T0 + np.array([0.0, 1.5, 2.0]))
+
+    def make_images(self, image_dir, capture_times) -> list:
+        image_dir.mkdir()
+        image_files = []
+        for i, capture_time in enumerate(capture_times):
+            image_file = str(image_dir / f"img_{i}.jpg")
+            with open(image_file, "wb") as file:
+                file.write(JPEG)
+            os.utime(image_file, (capture_time, capture_time))
+            image_files.append(image_file)
+        return image_files
+
+    def test_geotag_images(self, tmp_path) -> None:
+        image_dir, output_dir = tmp_path / "images", tmp_path / "tagged"
+        image_files = self.make_images(image_dir, [T0 + 1.5, T0 + 3.25, T0 + 60.0])
+
+        report = geotag_images(image_files, make_fixes(5), output_dir=str(output_dir), workers=2)
+        assert report["tagged"] == 2 and report["skipped"] == 1
+        assert report["images_per_second"] > 0
+
+        gps = piexif.load(str(output_dir / "img_1.jpg"))["GPS"]
+        assert exif_degrees(gps[piexif.GPSIFD.GPSLatitude]) == pytest.approx(38.5 + 3.25e-5, abs=1e-7)
+        assert exif_degrees(gps[piexif.GPSIFD.GPSLongitude]) == pytest.approx(121.75, abs=1e-7)
+        assert gps[piexif.GPSIFD.GPSLongitudeRef] == b"W"
+        assert gps[piexif.GPSIFD.GPSDateStamp] == b"2023:06:01"
+        # The capture after the log is not tagged, the originals are untouched
+        assert not (output_dir / "img_2.jpg").exists()
+        assert piexif.load(image_files[0])["GPS"] == {}
+
+    def test_fixes_without_position(self, tmp_path) -> None:
+        image_files = self.make_images(tmp_path / "images", [T0 + 1.5, T0 + 3.25])
+        fixes = make_fixes(5)
+        fixes.fixType[3] = FIX_TIME_ONLY
+        fixes.fixFlags[4] = 0
+
+        report = geotag_images(image_files, fixes, output_dir=str(tmp_path / "tagged"), workers=1)
+        assert report["tagged"] == 1 and report["skipped"] == 1
+        assert not (tmp_path / "tagged" / "img_1.jpg").exists()
+
+    def test_change_to_rational(self) -> None:
+        assert change_to_rational(25) == (25, 1)
+        assert change_to_rational(48.343) == (4834300, 100000)
+        assert change_to_rational(0.00001) == (1, 100000)
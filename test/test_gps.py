@@ -0,0 +1,335 @@
+"""Tests for the GPS reader modes."""
+import asyncio
+import json
+import os
+import pty
+import select
+import time
+
+import numpy as np
+import pytest
+import serial
+from robo_spray import fix as fix_module
+from robo_spray import gps as gps_module
+from robo_spray import gpslog
+from robo_spray.fix import FIX_DTYPE
+from robo_spray.gps import FixHistory
+from robo_spray.gps import GPS
+from robo_spray.ubx import build_frame
+from robo_spray.ubx import encode_nav_pvt
+from robo_spray.ubx import NAV_CLS
+from robo_spray.ubx import NAV_PVT
+from test_ubx import make_fix
+
+
+def make_gps(monkeypatch, device: str, **kwargs) -> GPS:
+    monkeypatch.setattr(gps_module, "find_gps_device", lambda: device)
+    monkeypatch.setattr(GPS, "configure_receiver", lambda self: None)
+    return GPS(**kwargs)
+
+
+class TestEventLoopMode:
+    def test_fixes_from_serial(self, monkeypatch) -> None:
+        master, slave = pty.openpty()
+        gps = make_gps(monkeypatch, os.ttyname(slave), use_process=False)
+        assert isinstance(gps.gps_port, serial.Serial)
+
+        async def receive():
+            gps.start()
+            fixes = gps.fixes()
+            received = []
+            for i in range(3):
+                # A fix split over two writes, preceded by NMEA
+                frame = b"$GNTXT,01*00\r\n" + build_frame(NAV_CLS, NAV_PVT, encode_nav_pvt(make_fix(i)))
+                os.write(master, frame[:30])
+                await asyncio.sleep(0.01)
+                os.write(master, frame[30:])
+                received.append(await asyncio.wait_for(fixes.__anext__(), 1.0))
+            await fixes.aclose()
+            gps.stop()
+            return received
+
+        try:
+            received = asyncio.run(receive())
+        finally:
+            gps.gps_port.close()
+            os.close(master)
+            os.close(slave)
+
+        assert gps.process is None
+        assert [int(fix.iTOW) for fix in received] == [0, 1000, 2000]
+        assert [int(fix.seq) for fix in received] == [1, 2, 3]
+        # Nothing went through the notification pipe
+        assert not select.select([gps.ring.fileno()], [], [], 0)[0]
+
+    def test_simulation(self, monkeypatch) -> None:
+        gps = make_gps(monkeypatch, None, use_process=False, simulation=True)
+
+        async def receive():
+            gps.start()
+            fixes = gps.fixes()
+            received = [await asyncio.wait_for(fixes.__anext__(), 1.0) for _ in range(2)]
+            await fixes.aclose()
+            gps.stop()
+            return received
+
+        first, second = asyncio.run(receive())
+        assert second.seq == first.seq + 1
+        assert second.t_mono > first.t_mono
+
+    def test_each_fix_evaluated_once(self, monkeypatch) -> None:
+        gps = make_gps(monkeypatch, None, use_process=False, simulation=True)
+
+        async def receive():
+            evaluated = []
+
+            async def consume():
+                # As update_gps_function, one spray evaluation per yielded fix
+                async for geo in gps.fixes():
+                    evaluated.append(int(geo.seq))
+
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.01)
+            for fix in make_history_fixes(20):
+                gps.ring.append_record(fix)
+                gps._publish()
+                await asyncio.sleep(0.001)
+            # Without a new fix nothing is evaluated
+            for _ in range(5):
+                gps._publish()
+                await asyncio.sleep(0.001)
+            await asyncio.sleep(0.05)
+            task.cancel()
+            return evaluated
+
+        assert asyncio.run(receive()) == list(range(1, 21))
+
+
+def make_history_fixes(n: int, period: float = 0.1) -> np.recarray:
+    fixes = np.zeros(n, dtype=FIX_DTYPE).view(np.recarray)
+    fixes.seq = np.arange(1, n + 1)
+    fixes.t_mono = np.arange(n) * period
+    fixes.lat = 38.5 + np.arange(n) * 1e-6
+    fixes.lon = -121.75
+    return fixes
+
+
+class TestFixHistory:
+    def test_bounded(self) -> None:
+        history = FixHistory(capacity=10)
+        assert history.latest() is None
+        fixes = make_history_fixes(55)
+        for fix in fixes[:30]:
+            history.append(fix)
+        history.append(fixes[30:])
+
+        assert len(history) == 10
+        np.testing.assert_array_equal(history.fixes.seq, np.arange(46, 56))
+        assert history.latest().seq == 55
+
+    def test_window(self) -> None:
+        history = FixHistory(capacity=100)
+        history.append(make_history_fixes(50))
+        window = history.window(1.0, 1.5)
+        np.testing.assert_allclose(window.t_mono, [1.0, 1.1, 1.2, 1.3, 1.4, 1.5])
+        assert len(history.window(10.0, 20.0)) == 0
+
+    def test_position_at(self) -> None:
+        history = FixHistory(capacity=100)
+        fixes = make_history_fixes(20)
+        # A 2 s outage after the 10th fix
+        fixes.t_mono[10:] += 2.0
+        history.append(fixes)
+
+        lat, lon = history.position_at(0.25)
+        assert lat == pytest.approx(38.5 + 2.5e-6, abs=1e-12)
+        assert lon == pytest.approx(-121.75)
+        # Exactly on the fixes around the outage, but not inside it
+        assert history.position_at(fixes.t_mono[9])[0] == pytest.approx(fixes.lat[9])
+        assert history.position_at(fixes.t_mono[10])[0] == pytest.approx(fixes.lat[10])
+        assert np.isnan(history.position_at(2.0)[0])
+        # Outside of the history
+        assert np.isnan(history.position_at(-1.0)[0])
+
+        lats, _ = history.position_at(np.array([0.05, 0.15, 100.0]))
+        np.testing.assert_allclose(lats[:2], 38.5 + np.array([0.5e-6, 1.5e-6]))
+        assert np.isnan(lats[2])
+
+    def test_gps_history_from_ring(self, monkeypatch) -> None:
+        gps = make_gps(monkeypatch, None, simulation=True)
+        for fix in make_history_fixes(100):
+            gps.ring.append_record(fix)
+        gps.get_gps_data()
+        # Only the fixes still in the ring, less the slot overwritten next, are recovered
+        assert len(gps.history) == gps.ring.capacity - 1
+        for fix in make_history_fixes(103)[100:]:
+            gps.ring.append_record(fix)
+        assert gps.position_at(10.2)[0] == pytest.approx(38.5 + 102e-6)
+        assert gps.history.latest().seq == 103
+
+    def test_gps_history_concurrent_writes(self, monkeypatch) -> None:
+        gps = make_gps(monkeypatch, None, simulation=True)
+        fixes = make_history_fixes(10)
+        for fix in fixes[:5]:
+            gps.ring.append_record(fix)
+        gps.get_gps_data()
+        for fix in fixes[5:7]:
+            gps.ring.append_record(fix)
+
+        # The GPS process writes while the app reads the ring
+        last = gps.ring.last
+
+        def last_during_writes(n):
+            for fix in fixes[7:]:
+                gps.ring.append_record(fix)
+            return last(n)
+
+        monkeypatch.setattr(gps.ring, "last", last_during_writes)
+        assert gps.get_gps_data().seq == 10
+        np.testing.assert_array_equal(gps.history.fixes.seq, np.arange(1, 11))
+        assert np.all(np.diff(gps.history.t_mono) > 0)
+
+
+class TestRecordReplay:
+    def receive(self, gps: GPS, n: int):
+        async def receive():
+            gps.start()
+            fixes = gps.fixes()
+            received = [await asyncio.wait_for(fixes.__anext__(), 1.0) for _ in range(n)]
+            await fixes.aclose()
+            gps.stop()
+            return received
+
+        return asyncio.run(receive())
+
+    def test_record_and_replay_raw_stream(self, monkeypatch, tmp_path) -> None:
+        log_file = str(tmp_path / "run.gpslog")
+        master, slave = pty.openpty()
+        gps = make_gps(monkeypatch, os.ttyname(slave), use_process=False, record_file=log_file)
+
+        async def record():
+            gps.start()
+            fixes = gps.fixes()
+            for i in range(5):
+                os.write(master, b"$GNTXT*00\r\n" + build_frame(NAV_CLS, NAV_PVT, encode_nav_pvt(make_fix(i))))
+                await asyncio.wait_for(fixes.__anext__(), 1.0)
+                await asyncio.sleep(0.05)
+            await fixes.aclose()
+            gps.stop()
+
+        try:
+            asyncio.run(record())
+        finally:
+            gps.gps_port.close()
+            os.close(master)
+            os.close(slave)
+
+        recorded = gpslog.read_fixes(log_file)
+        assert list(recorded.iTOW) == [0, 1000, 2000, 3000, 4000]
+
+        # Replayed through the parser, as fast as possible
+        replay = make_gps(monkeypatch, None, use_process=False, replay_file=log_file, replay_speed=None)
+        replayed = self.receive(replay, 5)
+        assert [int(fix.iTOW) for fix in replayed] == [0, 1000, 2000, 3000, 4000]
+        assert replay.replay_raw
+        assert replay.gps_port is None
+
+    def test_replay_timing(self, monkeypatch, tmp_path) -> None:
+        log_file = str(tmp_path / "sim.gpslog")
+        writer = gpslog.GpsLogWriter(log_file)
+        for i in range(4):
+            writer.write_fix(fix_module.make_fix(t_mono=100.0 + 0.2 * i, iTOW=i))
+        writer.close()
+
+        replay = make_gps(monkeypatch, None, use_process=False, replay_file=log_file, replay_speed=4.0)
+        start = time.monotonic()
+        replayed = self.receive(replay, 4)
+        # 0.6 s of log replayed 4 times faster
+        assert 0.14 <= replayed[-1].t_mono - start < 0.4
+        assert [int(fix.iTOW) for fix in replayed] == [0, 1, 2, 3]
+        assert not replay.replay_raw
+
+    def test_max_speed_replay_complete(self, monkeypatch, tmp_path) -> None:
+        log_file = str(tmp_path / "sim.gpslog")
+        writer = gpslog.GpsLogWriter(log_file)
+        for i in range(200):
+            writer.write_fix(fix_module.make_fix(t_mono=100.0 + 0.1 * i, iTOW=i))
+        writer.close()
+
+        # Far more fixes than the ring holds, replayed as fast as possible in the default process mode
+        replay = make_gps(monkeypatch, None, use_process=True, replay_file=log_file, replay_speed=None)
+        replayed = self.receive(replay, 200)
+        assert replay.process is None
+        assert [int(fix.iTOW) for fix in replayed] == list(range(200))
+
+    def test_truncated_log(self, tmp_path) -> None:
+        log_file = str(tmp_path / "crash.gpslog")
+        writer = gpslog.GpsLogWriter(log_file)
+        writer.write_raw(1.0, b"abc")
+        writer.write_raw(2.0, b"defg")
+        writer.close()
+        with open(log_file, "r+b") as file:
+            file.truncate(os.path.getsize(log_file) - 2)
+        assert list(gpslog.read_log(log_file)) == [(gpslog.RAW, 1.0, b"abc")]
+
+
+def make_sysfs(root, ttys) -> None:
+    """Builds a fake sysfs tree and /dev for ``ttys``, a dict of tty name to (idVendor, product)."""
+    (root / "dev").mkdir()
+    (root / "sys" / "class" / "tty").mkdir(parents=True)
+    for i, (tty, (vendor, product)) in enumerate(ttys.items()):
+        usb_device = root / "sys" / "devices" / "usb1" / f"1-{i}"
+        interface = usb_device / f"1-{i}:1.0"
+        (interface / "tty" / tty).mkdir(parents=True)
+        (usb_device / "idVendor").write_text(vendor + "\n")
+        (usb_device / "idProduct").write_text("01a9\n")
+        (usb_device / "product").write_text(product + "\n")
+        (root / "sys" / "class" / "tty" / tty).mkdir()
+        os.symlink(interface, root / "sys" / "class" / "tty" / tty / "device")
+        (root / "dev" / tty).touch()
+    # Not a USB tty
+    (root / "sys" / "class" / "tty" / "ttyS0").mkdir()
+
+
+class TestFindGpsDevice:
+    def test_from_sysfs(self, tmp_path) -> None:
+        make_sysfs(tmp_path, {"ttyACM0": ("2341", "Arduino Uno"), "ttyACM1": ("1546", "u-blox GNSS receiver")})
+        sysfs, dev, cache = str(tmp_path / "sys"), str(tmp_path / "dev"), str(tmp_path / "cache" / "gps.json")
+
+        assert gps_module.read_usb_attributes("ttyACM0", sysfs)["product"] == "Arduino Uno"
+        assert gps_module.read_usb_attributes("ttyS0", sysfs) is None
+        assert gps_module.find_gps_device(sysfs_root=sysfs, dev_root=dev, cache_file=cache) == os.path.join(
+            dev, "ttyACM1"
+        )
+        with open(cache) as file:
+            assert json.load(file) == {"tty": "ttyACM1"}
+
+    def test_cache_validated(self, tmp_path, monkeypatch) -> None:
+        make_sysfs(tmp_path, {"ttyACM0": ("1546", "u-blox GNSS receiver"), "ttyACM1": ("1546", "u-blox 2")})
+        sysfs, dev, cache = str(tmp_path / "sys"), str(tmp_path / "dev"), str(tmp_path / "gps.json")
+        with open(cache, "w") as file:
+            json.dump({"tty": "ttyACM1"}, file)
+
+        # The cached port is checked first
+        read = []
+        original = gps_module.read_usb_attributes
+
+        def read_usb_attributes(tty, root):
+            read.append(tty)
+            return original(tty, root)
+
+        monkeypatch.setattr(gps_module, "read_usb_attributes", read_usb_attributes)
+        assert gps_module.find_gps_device(sysfs_root=sysfs, dev_root=dev, cache_file=cache).endswith("ttyACM1")
+        assert read == ["ttyACM1"]
+
+        # A stale cache falls back to the scan
+        os.remove(os.path.join(dev, "ttyACM1"))
+        assert gps_module.find_gps_device(sysfs_root=sysfs, dev_root=dev, cache_file=cache).endswith("ttyACM0")
+        with open(cache) as file:
+            assert json.load(file) == {"tty": "ttyACM0"}
+
+    def test_not_connected(self, tmp_path) -> None:
+        make_sysfs(tmp_path, {"ttyACM0": ("2341", "Arduino Uno")})
+        assert gps_module.find_gps_device(
+            sysfs_root=str(tmp_path / "sys"), dev_root=str(tmp_path / "dev"), cache_file=None
+        ) is None
@@ -0,0 +1,67 @@
+"""Tests for the compiled binary prescription map format."""
+import os
+import struct
+
+import numpy as np
+from robo_spray.auto_spray import get_spray_index
+from robo_spray.auto_spray import load_geojson
+from robo_spray.prescription import compile_prescription
+from robo_spray.prescription import load_prescription
+from robo_spray.prescription import open_prescription
+from robo_spray.prescription import VERSION
+
+ASSETS_PATH = os.path.join(os.path.dirname(__file__), "../src/assets/")
+
+
+class TestPrescription:
+    def test_round_trip(self, tmp_path) -> None:
+        geojson_file = os.path.join(ASSETS_PATH, "spray_position_points.json")
+        compiled = open_prescription(compile_prescription(geojson_file, str(tmp_path / "points.rsp")))
+        expected = get_spray_index(load_geojson(geojson_file))
+
+        assert len(compiled) == len(expected)
+        np.testing.assert_array_equal(compiled.points, expected.points)
+        for i in range(len(expected)):
+            assert compiled.name(i) == expected.name(i)
+            assert compiled.condition(i) == expected.condition(i)
+            assert compiled.feature(i)["geometry"] == expected.feature(i)["geometry"]
+
+        lon, lat = expected.points[2]
+        assert compiled.nearest(lat + 1e-6, lon, radius=3.0) == expected.nearest(lat + 1e-6, lon, radius=3.0)
+
+    def test_read_only_mapping(self, tmp_path) -> None:
+        geojson_file = os.path.join(ASSETS_PATH, "spray_position_all.json")
+        compiled = open_prescription(compile_prescription(geojson_file, str(tmp_path / "all.rsp")))
+        assert not compiled.points.flags.writeable
+        # Targets without a condition are interned as the empty string
+        assert compiled.condition_table == [""]
+
+    def test_compiled_once(self, tmp_path) -> None:
+        geojson_file = tmp_path / "points.json"
+        geojson_file.write_bytes(open(os.path.join(ASSETS_PATH, "spray_position_points.json"), "rb").read())
+        load_prescription(str(geojson_file))
+        compiled_file = tmp_path / "points.rsp"
+        mtime_ns = os.stat(compiled_file).st_mtime_ns
+
+        load_prescription(str(geojson_file))
+        assert os.stat(compiled_file).st_mtime_ns == mtime_ns
+
+    def test_recompiled_on_version_change(self, tmp_path) -> None:
+        geojson_file = tmp_path / "points.json"
+        geojson_file.write_bytes(open(os.path.join(ASSETS_PATH, "spray_position_points.json"), "rb").read())
+        compiled_file = tmp_path / "points.rsp"
+        compile_prescription(str(geojson_file), str(compiled_file))
+        # Rewrite the version field of the header, the file stays newer than the GeoJSON
+        data = bytearray(compiled_file.read_bytes())
+        struct.pack_into("<H", data, 4, VERSION - 1)
+        compiled_file.write_bytes(bytes(data))
+
+        compiled = load_prescription(str(geojson_file))
+        assert len(compiled) == len(load_geojson(str(geojson_file))["features"])
+        assert struct.unpack_from("<H", compiled_file.read_bytes(), 4)[0] == VERSION
+
+    def test_tree_over_mapped_coordinates(self, tmp_path) -> None:
+        geojson_file = os.path.join(ASSETS_PATH, "spray_position_points.json")
+        compiled = open_prescription(compile_prescription(geojson_file, str(tmp_path / "points.rsp")))
+        assert not compiled.xy.flags.writeable
+        np.testing.assert_allclose(compiled.xy, get_spray_index(load_geojson(geojson_file)).xy)
@@ -0,0 +1,118 @@
+"""Tests for the u-blox receiver configuration against a simulated receiver."""
+import struct
+
+import pytest
+from robo_spray import receiver
+from robo_spray import ubx
+
+
+class FakeReceiver:
+    """Serial port of a simulated receiver answering CFG commands.
+
+    Args:
+        min_meas_rate_ms: Fastest navigation period accepted, faster CFG-RATE commands are NAK'ed.
+        baudrate: Baud rate of the receiver UART.
+        switch_baudrate: Whether the receiver applies a baud rate change of CFG-PRT.
+    """
+
+    def __init__(self, min_meas_rate_ms: int = 50, baudrate: int = 38400, switch_baudrate: bool = True) -> None:
+        self.min_meas_rate_ms = min_meas_rate_ms
+        self.receiver_baudrate = baudrate
+        self.switch_baudrate = switch_baudrate
+        self.baudrate = baudrate
+        self.parser = ubx.UbxParser()
+        self.output = bytearray()
+        self.commands = []
+        self.message_rates = {}
+        self.meas_rate_ms = 1000
+        self.out_proto = receiver.PROTO_UBX | receiver.PROTO_NMEA
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.output)
+
+    def read(self, size: int) -> bytes:
+        data = bytes(self.output[:size])
+        del self.output[:size]
+        # A host at the wrong baud rate only reads garbage
+        return data if self.baudrate == self.receiver_baudrate else bytes(len(data))
+
+    def flush(self) -> None:
+        pass
+
+    def reset_input_buffer(self) -> None:
+        self.output.clear()
+
+    def write(self, data: bytes) -> None:
+        if self.baudrate != self.receiver_baudrate:
+            return
+        for msg_cls, msg_id, payload in self.parser.feed(data):
+            self.commands.append((msg_cls, msg_id))
+            self.handle(msg_cls, msg_id, payload)
+
+    def reply(self, msg_cls: int, msg_id: int, payload: bytes) -> None:
+        self.output += b"$GNTXT,01,01,02,NMEA noise*00\r\n" + ubx.build_frame(msg_cls, msg_id, payload)
+
+    def handle(self, msg_cls: int, msg_id: int, payload: bytes) -> None:
+        ack = ubx.ACK_ACK
+        if (msg_cls, msg_id) == (ubx.CFG_CLS, ubx.CFG_RATE) and not payload:
+            self.reply(ubx.CFG_CLS, ubx.CFG_RATE, struct.pack("<HHH", self.meas_rate_ms, 1, 0))
+            return
+        if (msg_cls, msg_id) == (ubx.CFG_CLS, ubx.CFG_RATE):
+            meas_rate_ms = struct.unpack_from("<H", payload)[0]
+            if meas_rate_ms < self.min_meas_rate_ms:
+                ack = ubx.ACK_NAK
+            else:
+                self.meas_rate_ms = meas_rate_ms
+        elif (msg_cls, msg_id) == (ubx.CFG_CLS, ubx.CFG_MSG):
+            self.message_rates[payload[:2]] = payload[2]
+        elif (msg_cls, msg_id) == (ubx.CFG_CLS, ubx.CFG_PRT):
+            self.out_proto = struct.unpack_from("<H", payload, 14)[0]
+            baudrate = struct.unpack_from("<I", payload, 8)[0]
+            if baudrate and baudrate != self.receiver_baudrate:
+                # The ACK is lost in the baud rate switch
+                if self.switch_baudrate:
+                    self.receiver_baudrate = baudrate
+                return
+        self.reply(ubx.ACK_CLS, ack, bytes((msg_cls, msg_id)))
+
+
+class TestConfigureReceiver:
+    def test_usb_binary_only(self) -> None:
+        port = FakeReceiver(min_meas_rate_ms=40)
+        config = receiver.configure_receiver(port, timeout=0.2)
+
+        assert config.meas_rate_ms == 40 and config.rate_hz == 25
+        assert port.out_proto == receiver.PROTO_UBX
+        assert port.message_rates[bytes((ubx.NAV_CLS, ubx.NAV_PVT))] == 1
+        for msg in receiver.DISABLED_MESSAGES:
+            assert port.message_rates[bytes(msg)] == 0
+        # USB links are not baud rate limited
+        assert port.baudrate == 38400
+
+    def test_rate_falls_back_on_nak(self) -> None:
+        port = FakeReceiver(min_meas_rate_ms=100)
+        config = receiver.configure_receiver(port, timeout=0.2)
+        assert config.meas_rate_ms == 100
+        assert port.meas_rate_ms == 100
+
+    def test_uart_baudrate_raised(self) -> None:
+        port = FakeReceiver(min_meas_rate_ms=40)
+        config = receiver.configure_receiver(port, port_id=receiver.PORT_UART1, timeout=0.2)
+
+        assert config.baudrate == receiver.required_baudrate(40) == 57600
+        assert port.baudrate == port.receiver_baudrate == 57600
+        assert config.meas_rate_ms == 40
+
+    def test_uart_keeps_baudrate_if_switch_fails(self) -> None:
+        port = FakeReceiver(min_meas_rate_ms=40, switch_baudrate=False)
+        config = receiver.configure_receiver(port, port_id=receiver.PORT_UART1, timeout=0.2)
+
+        # Only the periods the 38400 baud link can carry are tried
+        assert config.baudrate == 38400
+        assert config.meas_rate_ms == 100
+
+    def test_no_rate_accepted(self) -> None:
+        port = FakeReceiver(min_meas_rate_ms=1000)
+        with pytest.raises(IOError):
+            receiver.configure_receiver(port, meas_rates_ms=(40, 100), timeout=0.2)
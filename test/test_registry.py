@@ -0,0 +1,75 @@
+"""Tests for the sprayed-target registry."""
+from robo_spray.registry import SprayedRegistry
+
+
+class TestSprayedRegistry:
+    def test_mark_once(self, tmp_path) -> None:
+        registry = SprayedRegistry(str(tmp_path / "sprayed.journal"), size=2_000_000)
+        assert 1_999_999 not in registry
+        assert registry.mark(1_999_999)
+        assert not registry.mark(1_999_999)
+        assert 1_999_999 in registry
+        assert 1_999_998 not in registry
+        assert len(registry) == 1
+        registry.close()
+
+    def test_resume_after_restart(self, tmp_path) -> None:
+        journal_file = str(tmp_path / "sprayed.journal")
+        registry = SprayedRegistry(journal_file, size=100, flush_every=2, flush_period=60.0)
+        for ordinal in (3, 7, 42):
+            registry.mark(ordinal)
+            registry.flush_if_due()
+        # Simulated crash: the last mark was not flushed yet
+        registry.file.close()
+
+        registry = SprayedRegistry(journal_file, size=100)
+        assert 3 in registry and 7 in registry
+        assert 42 not in registry
+        assert len(registry) == 2
+        registry.close()
+
+    def test_mark_not_synced(self, tmp_path) -> None:
+        journal_file = tmp_path / "sprayed.journal"
+        registry = SprayedRegistry(str(journal_file), size=100, flush_every=1, flush_period=0.0)
+        registry.mark(5)
+        # Only flush_if_due writes the journal, mark stays off the disk
+        assert len(registry.pending) == 1
+        registry.flush_if_due()
+        assert not registry.pending
+        assert 5 in SprayedRegistry(str(journal_file), size=100)
+        registry.close()
+
+    def test_torn_record_and_other_map(self, tmp_path) -> None:
+        journal_file = tmp_path / "sprayed.journal"
+        registry = SprayedRegistry(str(journal_file), size=100, flush_every=1)
+        registry.mark(5)
+        registry.close()
+        with open(journal_file, "ab") as file:
+            file.write(b"\x01\x00")
+
+        registry = SprayedRegistry(str(journal_file), size=100)
+        assert 5 in registry and len(registry) == 1
+        assert registry.mark(6)
+        registry.close()
+        assert SprayedRegistry(str(journal_file), size=100).bitmap[0] == 0b1100000
+
+        # A journal of another map is discarded
+        assert len(SprayedRegistry(str(journal_file), size=200)) == 0
+
+    def test_other_map_of_same_size(self, tmp_path) -> None:
+        journal_file = str(tmp_path / "sprayed.journal")
+        registry = SprayedRegistry(journal_file, size=100, fingerprint=1234, flush_every=1)
+        registry.mark(5)
+        registry.close()
+
+        assert 5 in SprayedRegistry(journal_file, size=100, fingerprint=1234)
+        assert len(SprayedRegistry(journal_file, size=100, fingerprint=4321)) == 0
+
+    def test_clear(self, tmp_path) -> None:
+        journal_file = str(tmp_path / "sprayed.journal")
+        registry = SprayedRegistry(journal_file, size=10, flush_every=1)
+        registry.mark(1)
+        registry.clear()
+        assert 1 not in registry
+        registry.close()
+        assert len(SprayedRegistry(journal_file, size=10)) == 0
@@ -0,0 +1,64 @@
+"""Tests for the shared-memory GPS fix ring buffer."""
+import multiprocessing
+import select
+
+import numpy as np
+from robo_spray.ringbuffer import FixRingBuffer
+
+
+def write_fixes(ring: FixRingBuffer, n: int) -> None:
+    for i in range(n):
+        ring.append(t_mono=float(i), lat=38.5 + i * 1e-6, lon=-121.75, headMot=float(i))
+
+
+class TestFixRingBuffer:
+    def test_latest_and_last(self) -> None:
+        ring = FixRingBuffer(capacity=8)
+        assert ring.latest() is None
+        write_fixes(ring, 20)
+
+        latest = ring.latest()
+        assert latest.seq == 20
+        assert latest.headMot == 19.0
+
+        last = ring.last(5)
+        np.testing.assert_array_equal(last.seq, np.arange(16, 21))
+        # Only the capacity is retained, less the slot overwritten next
+        assert len(ring.last(100)) == 7
+
+    def test_last_drops_slot_overwritten_during_copy(self) -> None:
+        ring = FixRingBuffer(capacity=8)
+        write_fixes(ring, 7)
+
+        class Records(np.recarray):
+            def __getitem__(self, index):
+                records = super().__getitem__(index)
+                if isinstance(index, np.ndarray):
+                    # The writer overwrites the slot of fix 1 with fix 9 while its seq was already copied
+                    ring.append(t_mono=-1.0, lat=0.0, lon=0.0, headMot=-1.0)
+                    ring.append(t_mono=-1.0, lat=0.0, lon=0.0, headMot=-1.0)
+                return records
+
+        ring.records = ring.records.view(Records)
+        last = ring.last(8)
+        np.testing.assert_array_equal(last.seq, np.arange(3, 8))
+        assert (last.t_mono >= 0.0).all()
+
+    def test_shared_with_process(self) -> None:
+        ring = FixRingBuffer(capacity=4)
+        process = multiprocessing.Process(target=write_fixes, args=(ring, 10))
+        process.start()
+        process.join()
+
+        assert len(ring) == 10
+        assert ring.latest().t_mono == 9.0
+        # The writer signaled new fixes
+        assert select.select([ring.fileno()], [], [], 0)[0]
+        ring.drain()
+        assert not select.select([ring.fileno()], [], [], 0)[0]
+
+    def test_writer_never_blocks(self) -> None:
+        ring = FixRingBuffer(capacity=4)
+        # Far more notifications than a pipe buffer holds, without any consumer
+        write_fixes(ring, 100_000)
+        assert ring.latest().seq == 100_000
@@ -0,0 +1,65 @@
+"""Tests for the shared service state watcher."""
+import asyncio
+
+from robo_spray.service import Backoff
+from robo_spray.service import ServiceStateWatcher
+
+IDLE, RUNNING = 1, 2
+
+
+class State:
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+
+class FakeClient:
+    """Service client whose state is scripted, raising while ``state`` is None."""
+
+    def __init__(self) -> None:
+        self.state = None
+        self.calls = 0
+
+    async def get_state(self) -> State:
+        self.calls += 1
+        if self.state is None:
+            raise ConnectionError("unreachable")
+        return State(self.state)
+
+
+class TestBackoff:
+    def test_exponential(self) -> None:
+        backoff = Backoff(initial=0.1, maximum=0.5)
+        assert [backoff.next() for _ in range(5)] == [0.1, 0.2, 0.4, 0.5, 0.5]
+        backoff.reset()
+        assert backoff.next() == 0.1
+
+
+class TestServiceStateWatcher:
+    def test_waiters_woken_on_transition(self) -> None:
+        client = FakeClient()
+
+        async def scenario():
+            watcher = ServiceStateWatcher(client, period=10.0, backoff=Backoff(initial=0.01, maximum=0.02))
+            task = asyncio.ensure_future(watcher.run())
+            waiters = [asyncio.ensure_future(watcher.wait_for((RUNNING,))) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            # Unreachable, retried with the backoff
+            assert watcher.state is None and client.calls >= 3
+            assert not any(waiter.done() for waiter in waiters)
+
+            client.state = RUNNING
+            states = await asyncio.wait_for(asyncio.gather(*waiters), 1.0)
+            calls = client.calls
+            # Reachable, refreshed on the period only
+            await asyncio.sleep(0.05)
+            assert client.calls == calls
+
+            # A stream error triggers an immediate refresh
+            client.state = IDLE
+            watcher.refresh()
+            await asyncio.sleep(0.01)
+            assert watcher.state == IDLE
+            task.cancel()
+            return states
+
+        assert asyncio.run(scenario()) == [RUNNING, RUNNING]
@@ -0,0 +1,85 @@
+"""Tests for the tile-partitioned prescription index."""
+import json
+
+import numpy as np
+from robo_spray.auto_spray import LocalFrame
+from robo_spray.auto_spray import SprayIndex
+from robo_spray.tiles import build_tiles
+from robo_spray.tiles import TiledSprayIndex
+
+
+def make_index(n_targets: int = 2000) -> SprayIndex:
+    rng = np.random.default_rng(0)
+    frame = LocalFrame(38.5323, -121.7520)
+    # 200 m x 200 m field
+    lat, lon = frame.to_latlon(rng.uniform(-100, 100, n_targets), rng.uniform(-100, 100, n_targets))
+    names = [f"target_{i}" for i in range(n_targets)]
+    condition_codes = rng.integers(0, 3, n_targets).astype(np.uint16)
+    return SprayIndex(np.column_stack((lon, lat)), names, condition_codes, ["high", "low", "med"], frame=frame)
+
+
+class TestTiledSprayIndex:
+    def test_same_matches_as_in_memory(self, tmp_path) -> None:
+        index = make_index()
+        build_tiles(index, str(tmp_path), tile_size=20.0)
+        tiled = TiledSprayIndex(str(tmp_path), max_tiles=9)
+
+        rng = np.random.default_rng(1)
+        for east, north in rng.uniform(-110, 110, (300, 2)):
+            lat, lon = index.frame.to_latlon(east, north)
+            expected, expected_dist = index.nearest(lat, lon, radius=3.0)
+            ordinal, dist = tiled.nearest(lat, lon, radius=3.0)
+            if expected is None:
+                assert ordinal is None
+            else:
+                assert tiled.name(ordinal) == index.name(expected)
+                assert tiled.condition(ordinal) == index.condition(expected)
+                assert abs(dist - expected_dist) < 1e-9
+
+            expected, expected_delay = index.predict(lat, lon, heading=45.0, speed=1.5, latency=0.3, radius=1.0)
+            ordinal, delay = tiled.predict(lat, lon, heading=45.0, speed=1.5, latency=0.3, radius=1.0)
+            assert (ordinal is None) == (expected is None)
+            if expected is not None:
+                assert tiled.name(ordinal) == index.name(expected)
+                assert abs(delay - expected_delay) < 1e-9
+
+            assert len(tiled.tiles) <= 9
+
+    def test_match_and_loaded_features(self, tmp_path) -> None:
+        index = make_index(500)
+        build_tiles(index, str(tmp_path), tile_size=50.0)
+        tiled = TiledSprayIndex(str(tmp_path))
+        # Nothing is loaded before the first query
+        assert tiled.to_geojson()["features"] == []
+
+        lon, lat = index.points[0]
+        assert tiled.match((lon, lat))["properties"]["name"] == index.name(0)
+        assert len(tiled.to_geojson()["features"]) > 0
+        # Far outside the field
+        assert tiled.match((lon + 1.0, lat)) is None
+
+    def test_fingerprint(self, tmp_path) -> None:
+        index = make_index(500)
+        build_tiles(index, str(tmp_path), tile_size=50.0)
+        tiled = TiledSprayIndex(str(tmp_path))
+        fingerprint = tiled.fingerprint()
+
+        # Manifests written before the fingerprint was recorded hash the tiles
+        manifest_file = tmp_path / "manifest.json"
+        manifest = json.loads(manifest_file.read_text())
+        del manifest["fingerprint"]
+        manifest_file.write_text(json.dumps(manifest))
+        assert TiledSprayIndex(str(tmp_path)).fingerprint() == fingerprint
+
+        # Moving one target changes it
+        index.points[0, 0] += 1e-6
+        build_tiles(index, str(tmp_path), tile_size=50.0)
+        assert TiledSprayIndex(str(tmp_path)).fingerprint() != fingerprint
+
+    def test_ordinals_cover_map(self, tmp_path) -> None:
+        index = make_index(500)
+        build_tiles(index, str(tmp_path), tile_size=50.0)
+        tiled = TiledSprayIndex(str(tmp_path), max_tiles=2)
+        assert len(tiled) == 500
+        assert sorted(tiled.name(i) for i in range(len(tiled))) == sorted(index.names)
+        assert len(tiled.tiles) == 2
@@ -0,0 +1,99 @@
+"""Tests for the UBX stream parser and NAV-PVT decoding."""
+import struct
+
+import numpy as np
+import pytest
+from robo_spray.fix import FIX_3D
+from robo_spray.fix import FIX_DTYPE
+from robo_spray.ringbuffer import FixRingBuffer
+from robo_spray.ubx import build_frame
+from robo_spray.ubx import checksum
+from robo_spray.ubx import decode_nav_pvt
+from robo_spray.ubx import encode_nav_pvt
+from robo_spray.ubx import NAV_CLS
+from robo_spray.ubx import NAV_PVT
+from robo_spray.ubx import UbxParser
+
+NMEA = b"$GNGGA,172814.0,3831.9380,N,12145.1200,W,1,12,0.8,15.2,M,-28.7,M,,*5C\r\n"
+
+
+def make_fix(i: int = 0) -> np.record:
+    fix = np.zeros(1, dtype=FIX_DTYPE).view(np.recarray)[0]
+    fix.iTOW = 1000 * i
+    fix.year, fix.month, fix.day = 2023, 6, 1
+    fix.hour, fix["min"], fix.sec = 17, 28, i % 60
+    fix.fixType = FIX_3D
+    fix.numSV = 14
+    fix.lon = -121.752 + i * 1e-6
+    fix.lat = 38.5323
+    fix.height = 15.2
+    fix.hAcc, fix.vAcc = 0.014, 0.02
+    fix.velN, fix.velE = 1.0, -0.25
+    fix.gSpeed = 1.031
+    fix.headMot = 345.96
+    return fix
+
+
+def pvt_frame(i: int = 0) -> bytes:
+    return build_frame(NAV_CLS, NAV_PVT, encode_nav_pvt(make_fix(i)))
+
+
+class TestFraming:
+    def test_checksum(self) -> None:
+        # UBX-CFG-RATE poll request from the u-blox protocol specification
+        assert build_frame(0x06, 0x08) == b"\xb5\x62\x06\x08\x00\x00\x0e\x30"
+        assert checksum(b"\x06\x08\x00\x00") == b"\x0e\x30"
+
+
+class TestUbxParser:
+    def test_frames_split_across_reads(self) -> None:
+        stream = b"".join(pvt_frame(i) for i in range(3))
+        parser = UbxParser()
+        frames = []
+        for start in range(0, len(stream), 7):
+            frames += parser.feed(stream[start:start + 7])
+
+        assert [(msg_cls, msg_id, len(payload)) for msg_cls, msg_id, payload in frames] == [(NAV_CLS, NAV_PVT, 92)] * 3
+        assert not parser.buffer
+
+    def test_resync_past_nmea_and_garbage(self) -> None:
+        stream = NMEA + pvt_frame(0) + b"\xb5\x00garbage\xb5" + pvt_frame(1) + NMEA
+        frames = UbxParser().feed(stream)
+        assert [decode_nav_pvt(payload).iTOW for _, _, payload in frames] == [0, 1000]
+
+    def test_corrupted_frame_is_dropped(self) -> None:
+        corrupted = bytearray(pvt_frame(0))
+        corrupted[20] ^= 0xFF
+        parser = UbxParser()
+
+        frames = parser.feed(bytes(corrupted) + pvt_frame(1))
+        assert len(frames) == 1
+        assert decode_nav_pvt(frames[0][2]).iTOW == 1000
+        assert parser.checksum_errors == 1
+
+
+class TestDecodeNavPvt:
+    def test_scaling(self) -> None:
+        fix = decode_nav_pvt(encode_nav_pvt(make_fix(3)), t_mono=12.5)
+        expected = make_fix(3)
+
+        assert fix.t_mono == 12.5
+        assert (fix.year, fix.month, fix.day, fix.sec) == (2023, 6, 1, 3)
+        assert fix.fixType == FIX_3D and fix.numSV == 14
+        assert fix.lon == pytest.approx(expected.lon, abs=1e-7)
+        assert fix.lat == pytest.approx(expected.lat, abs=1e-7)
+        for name in ("height", "hAcc", "vAcc", "velN", "velE", "gSpeed", "headMot"):
+            assert fix[name] == pytest.approx(expected[name], abs=1e-3), name
+
+    def test_decoded_fix_in_ring_buffer(self) -> None:
+        ring = FixRingBuffer(capacity=4)
+        for _, _, payload in UbxParser().feed(pvt_frame(0) + pvt_frame(1)):
+            ring.append_record(decode_nav_pvt(payload, t_mono=1.0))
+
+        latest = ring.latest()
+        assert latest.seq == 2
+        assert latest.iTOW == 1000
+        assert latest.gSpeed == pytest.approx(1.031, abs=1e-3)
+
+    def test_payload_size(self) -> None:
+        assert len(encode_nav_pvt(make_fix())) == struct.calcsize("<IHBBBBBBIiBBBBiiiiIIiiiiiIIHB5xihH") == 92